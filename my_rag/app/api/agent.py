@@ -2,6 +2,7 @@
 Agent API 路由
 """
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Dict, Any, List
 from app.services.agent_service import agent_service
@@ -30,7 +31,8 @@ async def agent_chat(request: AgentRequest):
     - 需要时间信息时，使用时间工具
     """
     try:
-        result = agent_service.run(request.question)
+        # 工具调用（检索 / 精排）和 LLM 请求均为同步阻塞，放到线程池中执行
+        result = await run_in_threadpool(agent_service.run, request.question)
         
         return AgentResponse(
             success=result.get("success", False),
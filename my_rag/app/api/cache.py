@@ -4,6 +4,10 @@
 from fastapi import APIRouter, HTTPException
 from typing import Dict, Any
 from app.services.cache_service import cache_service
+from app.services.context_packer import context_packer
+from app.services.milvus_service import milvus_service
+from app.services.rerank_service import rerank_service
+from app.services.single_flight import single_flight
 
 router = APIRouter()
 
@@ -17,6 +21,12 @@ async def get_cache_stats() -> Dict[str, Any]:
     """
     try:
         stats = cache_service.get_cache_stats()
+        stats["embedding_cache"] = milvus_service.embedding_cache.stats()
+        stats["single_flight"] = single_flight.stats()
+        stats["context_packer"] = context_packer.stats()
+        stats["rerank"] = rerank_service.stats()
+        batcher = milvus_service.embedding_batcher
+        stats["embedding_micro_batch"] = batcher.stats() if batcher is not None else None
         return {
             "success": True,
             "data": stats
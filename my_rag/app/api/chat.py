@@ -1,18 +1,152 @@
 """
 问答API路由
 """
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import SessionLocal, get_db
 from app.models.schemas import ChatRequest, ChatResponse
-from app.services.llm_service import llm_service
+from app.services.llm_service import degraded_answer, llm_service
+from app.services.llm_resilience import CircuitOpenError
 from app.services.hybrid_search_service import hybrid_search_service
 from app.services.conversation_service import conversation_service
 from app.services.cache_service import cache_service
+from app.services.milvus_service import milvus_service
+from app.services.search_filter import SearchFilter
+from app.services.semantic_cache import SemanticCache
+from app.services.rerank_cascade import RerankCascade
+from app.services.single_flight import single_flight
 from app.config import settings
 
 router = APIRouter()
 
+
+async def _generate_answer(
+    question: str,
+    question_vector: List[float],
+    filters: Optional[SearchFilter],
+    kb_version: int,
+    cascade: Optional[RerankCascade] = None,
+    on_delta: Optional[Callable[[str], None]] = None,
+    state: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    语义缓存未命中时的完整流程：混合检索 → 精确缓存 → LLM → 写入两级缓存
+    （检索和缓存读写在线程池中执行，LLM 走异步连接池；同一问题的并发请求经单飞合并只执行一次）
+
+    Args:
+        on_delta: 流式请求的增量回调，为 None 时一次生成完整回答
+        state: 本请求的执行记录：被丢弃的召回路写入 dropped_routes，调用 LLM 时写入 cached=False
+    """
+    # 使用混合检索获取上下文（过滤条件下推到 Milvus / ES）
+    retrieved = await run_in_threadpool(
+        hybrid_search_service.search_context_detailed,
+        question,
+        settings.TOP_K,
+        settings.HYBRID_SEARCH_ENABLED,
+        filters,
+        cascade
+    )
+    context = retrieved["context"]
+    if state is not None:
+        state["dropped_routes"] = retrieved["dropped_routes"]
+    
+    cached_answer = await run_in_threadpool(
+        cache_service.get_cached_answer,
+        question, context, kb_version,
+        refresh=lambda: llm_service.chat_with_context(question, context)
+    )
+    if cached_answer:
+        # 精确缓存命中，省去 LLM 调用
+        answer = cached_answer
+        print("🚀 使用缓存答案")
+    else:
+        # 缓存未命中，调用 LLM 生成回答；熔断时返回检索内容作为降级回答，不写入缓存
+        if state is not None:
+            state["cached"] = False
+        try:
+            if on_delta is None:
+                answer = await llm_service.achat_with_context(question, context)
+            else:
+                # 流式请求：逐段转发 LLM 输出，同时拼接完整回答
+                parts = []
+                async for delta in llm_service.achat_with_context_stream(question, context):
+                    parts.append(delta)
+                    on_delta(delta)
+                answer = "".join(parts)
+        except CircuitOpenError:
+            print("🔌 LLM 熔断中，返回降级回答")
+            return degraded_answer(context)
+        
+        # 将答案写入缓存
+        await run_in_threadpool(
+            cache_service.set_cached_answer,
+            question=question,
+            answer=answer,
+            context=context,
+            kb_version=kb_version
+        )
+        print("💾 答案已缓存")
+    
+    await run_in_threadpool(
+        cache_service.set_semantic_answer,
+        question, answer, question_vector, filters, kb_version=kb_version
+    )
+    return answer
+
+
+async def _answer(
+    request: ChatRequest,
+    on_delta: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """
+    问答流水线（/api/chat 与 /stream 共用）
+    
+    1. 检查语义缓存（按问题向量相似度，检索之前），命中直接返回
+    2. 未命中则检索 + 精确缓存 + LLM（同一问题并发时单飞合并，只计算一次）
+    3. 将结果写入两级缓存
+    
+    Args:
+        request: 问答请求
+        on_delta: 流式请求的增量回调；本请求没有亲自调用 LLM 时不会被调用
+    
+    Returns:
+        {"answer", "cached", "dropped_routes"}：cached 表示答案来自缓存或其它请求的计算结果，
+        dropped_routes 为本请求检索时超时/失败被丢弃的召回路
+    """
+    # 语义缓存：问题向量在检索前计算，向量召回时复用查询向量缓存，不重复编码
+    filters = SearchFilter.build(request.document_ids, request.tenant_id, request.tags)
+    cascade = RerankCascade.build(request.rerank_shortlist, request.rerank_skip_margin)
+    question_vector = await run_in_threadpool(milvus_service.get_embedding, request.question)
+    # 版本号和语义缓存会访问 Redis、争用进程内锁，同样不在事件循环上执行
+    kb_version = await run_in_threadpool(cache_service.get_kb_version)
+    semantic_hit = await run_in_threadpool(cache_service.get_semantic_answer, question_vector, filters)
+    
+    if semantic_hit:
+        # 相似问题命中，跳过检索、精排和 LLM
+        print("🚀 使用语义缓存答案")
+        return {"answer": semantic_hit["answer"], "cached": True, "dropped_routes": []}
+    
+    # 检索 + 生成；同一问题同时只计算一次，其余请求共享结果
+    state: Dict[str, Any] = {"cached": True, "dropped_routes": []}
+    scope = SemanticCache.scope_of(filters)
+    if cascade is not None:
+        # 精排参数不同，检索结果可能不同，不合并
+        scope = f"{scope}:{cascade.key()}"
+    flight_key = single_flight.make_key(request.question, scope, kb_version)
+    answer = await single_flight.do(
+        flight_key,
+        lambda: _generate_answer(
+            request.question, question_vector, filters, kb_version, cascade, on_delta, state
+        )
+    )
+    return {"answer": answer, **state}
+
+
 @router.post("", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -21,61 +155,106 @@ async def chat(
     """
     问答接口：接收用户问题，检索相关文档，调用LLM生成回答
     
-    流程：
-    1. 检查缓存
-    2. 如果缓存命中，直接返回
-    3. 如果缓存未命中，使用混合检索获取上下文
-    4. 调用 LLM 生成回答
-    5. 将结果写入缓存
+    流程见 _answer：语义缓存 → 混合检索 → 精确缓存 → LLM → 写入两级缓存；
+    会话读写在线程池中执行
     """
     try:
-        # 1. 获取或创建会话
-        conversation = conversation_service.get_or_create_session(
-            db, request.session_id
+        # 1. 获取或创建会话，保存用户问题
+        conversation = await run_in_threadpool(
+            conversation_service.get_or_create_session, db, request.session_id
         )
-        
-        # 2. 保存用户问题
-        user_message = conversation_service.add_message(
-            db, conversation.id, "user", request.question
-        )
-        
-        # 3. 使用混合检索获取上下文
-        context = hybrid_search_service.search_context(
-            request.question,
-            top_k=settings.TOP_K,
-            use_hybrid=settings.HYBRID_SEARCH_ENABLED
+        await run_in_threadpool(
+            conversation_service.add_message, db, conversation.id, "user", request.question
         )
         
-        # 4. 检查缓存
-        cached_answer = cache_service.get_cached_answer(request.question, context)
-        
-        if cached_answer:
-            # 缓存命中，直接返回
-            answer = cached_answer
-            print("🚀 使用缓存答案")
-        else:
-            # 缓存未命中，调用 LLM 生成回答
-            answer = llm_service.chat_with_context(request.question, context)
-            
-            # 将答案写入缓存
-            cache_service.set_cached_answer(
-                question=request.question,
-                answer=answer,
-                context=context
-            )
-            print("💾 答案已缓存")
+        # 2. 检索 + 生成
+        result = await _answer(request)
         
-        # 5. 保存AI回答
-        assistant_message = conversation_service.add_message(
-            db, conversation.id, "assistant", answer
+        # 3. 保存AI回答
+        assistant_message = await run_in_threadpool(
+            conversation_service.add_message, db, conversation.id, "assistant", result["answer"]
         )
         
         return ChatResponse(
-            answer=answer,
+            answer=result["answer"],
             session_id=conversation.session_id,
-            message_id=assistant_message.id
+            message_id=assistant_message.id,
+            dropped_routes=result["dropped_routes"]
         )
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"问答处理失败: {str(e)}")
 
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """编码一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    流式问答接口（Server-Sent Events）
+    
+    与 /api/chat 共用同一条流水线（含单飞合并），只有 LLM 调用换成流式
+    
+    事件：
+    - meta：{"session_id"}，检索开始前发送
+    - token：{"delta"}，增量回答文本（缓存命中、共享其它请求结果或熔断降级时一次发送完整答案）
+    - done：{"session_id", "message_id", "cached", "dropped_routes"}，回答已保存
+    - error：{"detail"}
+    
+    流结束后将完整回答写入会话消息和缓存
+    """
+    async def events():
+        # 流式响应期间独立管理数据库会话，不依赖请求级依赖注入的生命周期
+        db = SessionLocal()
+        task = None
+        try:
+            conversation = await run_in_threadpool(
+                conversation_service.get_or_create_session, db, request.session_id
+            )
+            await run_in_threadpool(
+                conversation_service.add_message, db, conversation.id, "user", request.question
+            )
+            yield _sse("meta", {"session_id": conversation.session_id})
+            
+            # 流水线在后台任务中执行，LLM 增量经队列转发给客户端
+            deltas: asyncio.Queue = asyncio.Queue()
+            task = asyncio.ensure_future(_answer(request, on_delta=deltas.put_nowait))
+            streamed = False
+            while not (task.done() and deltas.empty()):
+                getter = asyncio.ensure_future(deltas.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    streamed = True
+                    yield _sse("token", {"delta": getter.result()})
+                else:
+                    getter.cancel()
+            result = task.result()
+            if not streamed:
+                yield _sse("token", {"delta": result["answer"]})
+            
+            assistant_message = await run_in_threadpool(
+                conversation_service.add_message, db, conversation.id, "assistant", result["answer"]
+            )
+            yield _sse("done", {
+                "session_id": conversation.session_id,
+                "message_id": assistant_message.id,
+                "cached": result["cached"],
+                "dropped_routes": result["dropped_routes"]
+            })
+        except Exception as e:
+            yield _sse("error", {"detail": f"问答处理失败: {str(e)}"})
+        finally:
+            if task is not None and not task.done():
+                # 客户端断开：取消本请求的计算，单飞合并的等待者会接手
+                task.cancel()
+            db.close()
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -2,27 +2,57 @@
 文档上传API路由
 """
 from pathlib import Path
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models.schemas import UploadResponse
 from app.models.database import Document
 from app.services.document_service import document_service
+from app.services.vector_store import TAG_MAX_LENGTH, TAGS_MAX_CAPACITY, TENANT_ID_MAX_LENGTH
 from app.config import settings
 from datetime import datetime
 
 router = APIRouter()
 
+
+def _parse_tags(tags: Optional[str]) -> Optional[List[str]]:
+    """解析逗号分隔的标签（去空白、去重），超出向量库字段上限时返回 400"""
+    if not tags:
+        return None
+    tag_list = list(dict.fromkeys(t.strip() for t in tags.split(',') if t.strip()))
+    if len(tag_list) > TAGS_MAX_CAPACITY:
+        raise HTTPException(status_code=400, detail=f"标签数量超过限制（最多{TAGS_MAX_CAPACITY}个）")
+    too_long = [t for t in tag_list if len(t.encode('utf-8')) > TAG_MAX_LENGTH]
+    if too_long:
+        raise HTTPException(
+            status_code=400,
+            detail=f"标签长度超过限制（最多{TAG_MAX_LENGTH}字节）: {too_long[0]}"
+        )
+    return tag_list or None
+
+
+def _check_tenant_id(tenant_id: Optional[str]):
+    """租户 ID 超出向量库字段上限时返回 400"""
+    if tenant_id and len(tenant_id.encode('utf-8')) > TENANT_ID_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"租户ID长度超过限制（最多{TENANT_ID_MAX_LENGTH}字节）")
+
 @router.post("", response_model=UploadResponse)
 async def upload_document(
     file: UploadFile = File(...),
+    tenant_id: Optional[str] = Form(None, description="租户ID"),
+    tags: Optional[str] = Form(None, description="文档标签，逗号分隔"),
     db: Session = Depends(get_db)
 ):
     """
     上传文档接口：接收文件，保存到本地，记录元信息到MySQL，异步处理并索引到Milvus
     """
     try:
-        # 1. 验证文件大小
+        # 1. 验证租户和标签（入库前校验，避免文件已接收后写入向量库失败）
+        _check_tenant_id(tenant_id)
+        tag_list = _parse_tags(tags)
+        
+        # 2. 验证文件大小
         file_content = await file.read()
         if len(file_content) > settings.MAX_FILE_SIZE:
             raise HTTPException(
@@ -30,7 +60,7 @@ async def upload_document(
                 detail=f"文件大小超过限制（最大{settings.MAX_FILE_SIZE / 1024 / 1024}MB）"
             )
         
-        # 2. 验证文件类型
+        # 3. 验证文件类型
         file_ext = Path(file.filename).suffix.lower()
         if file_ext not in ['.txt', '.pdf', '.md']:
             raise HTTPException(
@@ -38,7 +68,7 @@ async def upload_document(
                 detail="不支持的文件类型，仅支持 .txt, .pdf, .md"
             )
         
-        # 3. 保存文件到本地
+        # 4. 保存文件到本地
         upload_dir = Path(settings.UPLOAD_DIR)
         upload_dir.mkdir(parents=True, exist_ok=True)
         
@@ -50,7 +80,7 @@ async def upload_document(
         with open(file_path, 'wb') as f:
             f.write(file_content)
         
-        # 4. 记录文档元信息到MySQL
+        # 5. 记录文档元信息到MySQL
         document = Document(
             filename=file.filename,
             file_path=str(file_path),
@@ -62,10 +92,10 @@ async def upload_document(
         db.commit()
         db.refresh(document)
         
-        # 5. 异步处理文档（切分、向量化、索引到Milvus）
+        # 6. 异步处理文档（切分、向量化、索引到Milvus）
         try:
             chunk_count = document_service.process_and_index(
-                str(file_path), document.id, db
+                str(file_path), document.id, db, tenant_id=tenant_id, tags=tag_list
             )
             return UploadResponse(
                 document_id=document.id,
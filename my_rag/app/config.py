@@ -18,17 +18,56 @@ class Settings(BaseSettings):
     MILVUS_COLLECTION_NAME: str = "doc_rag_collection"
     VECTOR_DIM: int = 384  # BGE-small-zh-v1.5维度
     TOP_K: int = 3
+    MILVUS_INDEX_TYPE: str = os.getenv("MILVUS_INDEX_TYPE", "HNSW")  # HNSW / IVF_FLAT / IVF_PQ / DISKANN
+    MILVUS_INDEX_PARAMS: str = os.getenv("MILVUS_INDEX_PARAMS", "")  # 索引构建参数（JSON），如 {"M": 16, "efConstruction": 200}
+    MILVUS_PARTITION_KEY_ENABLED: bool = os.getenv("MILVUS_PARTITION_KEY_ENABLED", "true").lower() == "true"  # tenant_id 作为 partition key
+    DEFAULT_TENANT_ID: str = os.getenv("DEFAULT_TENANT_ID", "default")
+    MILVUS_SEARCH_PARAMS: str = os.getenv("MILVUS_SEARCH_PARAMS", "")  # 检索参数（JSON），如 {"ef": 64} 或 {"nprobe": 16}
+    EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")  # 向量模型后端：torch / onnx / onnx-int8
+    EMBEDDING_ONNX_DIR: str = os.getenv("EMBEDDING_ONNX_DIR", "")  # ONNX 模型导出目录，默认 models/bge-small-zh-v1.5-onnx
+    EMBEDDING_ONNX_THREADS: int = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # ONNX Runtime 线程数，0 表示自动
+    EMBEDDING_BACKEND_VALIDATE: bool = os.getenv("EMBEDDING_BACKEND_VALIDATE", "true").lower() == "true"
+    EMBEDDING_VALIDATION_MIN_COSINE: float = float(os.getenv("EMBEDDING_VALIDATION_MIN_COSINE", "0.99"))  # 与 torch 参考向量的最小余弦
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))  # 入库时每次前向编码的块数
+    MILVUS_INSERT_BATCH_SIZE: int = int(os.getenv("MILVUS_INSERT_BATCH_SIZE", "256"))  # 每批写入 Milvus 的条数
+    
+    # 推理进程池配置（向量编码 / rerank 移出 API 进程）
+    MODEL_WORKERS_ENABLED: bool = os.getenv("MODEL_WORKERS_ENABLED", "false").lower() == "true"
+    MODEL_WORKERS: int = int(os.getenv("MODEL_WORKERS", "0"))  # 推理进程数，0 表示按物理核数自动
+    MODEL_WORKER_THREADS: int = int(os.getenv("MODEL_WORKER_THREADS", "0"))  # 每进程 torch 线程数，0 表示 物理核数 / 进程数
+    MODEL_WORKERS_PRELOAD: bool = os.getenv("MODEL_WORKERS_PRELOAD", "true").lower() == "true"  # 进程启动时加载模型
+    MODEL_WORKERS_ADDRESS: str = os.getenv("MODEL_WORKERS_ADDRESS", "")  # 共享推理服务地址（Unix socket 路径，或仅限回环地址的 host:port），为空则每个 API 进程自带进程池
+    MODEL_WORKERS_AUTHKEY: str = os.getenv("MODEL_WORKERS_AUTHKEY", "")  # 共享推理服务连接认证密钥（共享模式必填，无默认值）
+    MODEL_WORKERS_CONNECTIONS: int = int(os.getenv("MODEL_WORKERS_CONNECTIONS", "8"))  # 每个 API 进程到共享服务的连接数
+    MODEL_WORKERS_TIMEOUT: float = float(os.getenv("MODEL_WORKERS_TIMEOUT", "30"))  # 单次推理等待上限（秒）
+    MICRO_BATCH_ENABLED: bool = os.getenv("MICRO_BATCH_ENABLED", "true").lower() == "true"  # 并发查询的编码 / 精排合并为一次前向
+    MICRO_BATCH_WAIT_MS: float = float(os.getenv("MICRO_BATCH_WAIT_MS", "3"))  # 收到首个请求后的合并等待时间（毫秒）
+    EMBEDDING_MICRO_BATCH_MAX: int = int(os.getenv("EMBEDDING_MICRO_BATCH_MAX", "32"))  # 每批最多查询数（编码）
+    RERANK_MICRO_BATCH_MAX: int = int(os.getenv("RERANK_MICRO_BATCH_MAX", "8"))  # 每批最多查询数（精排，每个查询约 RECALL_TOP_K 对）
+    
+    # 向量存储后端：milvus（默认）/ local（进程内向量引擎）/ auto（Milvus 不可达时降级为本地）
+    VECTOR_STORE: str = os.getenv("VECTOR_STORE", "milvus")
+    LOCAL_VECTOR_STORE_DIR: str = os.getenv("LOCAL_VECTOR_STORE_DIR", "./data/vector_store")  # 为空则纯内存
+    LOCAL_IVF_MIN_ROWS: int = int(os.getenv("LOCAL_IVF_MIN_ROWS", "50000"))  # 条目数达到该值后启用 IVF 粗量化
+    LOCAL_IVF_NLIST: int = int(os.getenv("LOCAL_IVF_NLIST", "0"))  # IVF 簇数，0 表示 sqrt(条目数)
+    LOCAL_IVF_NPROBE: int = int(os.getenv("LOCAL_IVF_NPROBE", "8"))  # 检索时扫描的簇数
     
     # Elasticsearch 配置
     ES_HOST: str = os.getenv("ES_HOST", "localhost")
     ES_PORT: int = int(os.getenv("ES_PORT", "9200"))
     ES_INDEX_NAME: str = "rag_documents"
     ES_ENABLED: bool = os.getenv("ES_ENABLED", "true").lower() == "true"
+    ES_REQUEST_TIMEOUT: int = int(os.getenv("ES_REQUEST_TIMEOUT", "30"))  # ES 客户端默认请求超时（秒）
     
     # 混合检索配置
     HYBRID_SEARCH_ENABLED: bool = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
     VECTOR_WEIGHT: float = float(os.getenv("VECTOR_WEIGHT", "0.6"))
     KEYWORD_WEIGHT: float = float(os.getenv("KEYWORD_WEIGHT", "0.4"))
+    RECALL_PARALLEL_ENABLED: bool = os.getenv("RECALL_PARALLEL_ENABLED", "true").lower() == "true"  # 多路召回并行
+    RECALL_POOL_SIZE: int = int(os.getenv("RECALL_POOL_SIZE", "16"))  # 召回线程池大小
+    VECTOR_RECALL_TIMEOUT_MS: int = int(os.getenv("VECTOR_RECALL_TIMEOUT_MS", "1000"))  # 向量召回超时，超时则丢弃该路
+    KEYWORD_RECALL_TIMEOUT_MS: int = int(os.getenv("KEYWORD_RECALL_TIMEOUT_MS", "1000"))  # 关键词召回超时，超时则丢弃该路
+    RECALL_BATCH_TIMEOUT_PER_QUERY_MS: int = int(os.getenv("RECALL_BATCH_TIMEOUT_PER_QUERY_MS", "200"))  # 批量召回每多一个查询增加的超时
 
     # Rerank 精排配置（方案1+2+3）
     RERANK_ENABLED: bool = os.getenv("RERANK_ENABLED", "true").lower() == "true"
@@ -36,12 +75,51 @@ class Settings(BaseSettings):
     RECALL_TOP_K: int = int(os.getenv("RECALL_TOP_K", "30"))  # 召回阶段扩量（方案2）
     RERANK_TOP_K: int = int(os.getenv("RERANK_TOP_K", "5"))  # rerank 后最终返回数上限
     RERANK_SCORE_THRESHOLD: float = float(os.getenv("RERANK_SCORE_THRESHOLD", "0.3"))  # rerank 概率阈值（方案3）
+    RERANK_MAX_LENGTH: int = int(os.getenv("RERANK_MAX_LENGTH", "512"))  # 单对 (query, doc) 的 token 上限
+    RERANK_MAX_QUERY_TOKENS: int = int(os.getenv("RERANK_MAX_QUERY_TOKENS", "64"))  # query 截断长度，其余留给 doc
+    RERANK_MAX_BATCH_SIZE: int = int(os.getenv("RERANK_MAX_BATCH_SIZE", "32"))  # 每批最多对数
+    RERANK_BATCH_LATENCY_MS: int = int(os.getenv("RERANK_BATCH_LATENCY_MS", "80"))  # 单批延迟预算，按实测吞吐换算每批 token 数
+    RERANK_BATCH_TOKENS: int = int(os.getenv("RERANK_BATCH_TOKENS", "8192"))  # 尚无吞吐测量时每批填充后的 token 上限
+    RERANK_CACHE_ENABLED: bool = os.getenv("RERANK_CACHE_ENABLED", "true").lower() == "true"  # 缓存 (query, 片段) 打分
+    RERANK_CACHE_SIZE: int = int(os.getenv("RERANK_CACHE_SIZE", "200000"))  # 打分缓存条目上限（每条约百余字节）
+    RERANK_CASCADE_ENABLED: bool = os.getenv("RERANK_CASCADE_ENABLED", "true").lower() == "true"  # 级联精排（RRF 提前退出 + 向量粗筛）
+    RERANK_CASCADE_SHORTLIST: int = int(os.getenv("RERANK_CASCADE_SHORTLIST", "10"))  # 粗筛后进入 Cross-Encoder 的候选数，0 不粗筛
+    RERANK_SKIP_MARGIN: float = float(os.getenv("RERANK_SKIP_MARGIN", "0.35"))  # RRF 第一名领先第二名的相对分差达到此值则跳过 Cross-Encoder，0 不跳过
     VECTOR_DISTANCE_THRESHOLD: float = float(os.getenv("VECTOR_DISTANCE_THRESHOLD", "0.5"))  # 纯向量 COSINE 阈值（无 rerank 时用）
+
+    # 上下文打包配置（检索结果拼进提示词前按 token 预算裁剪）
+    CONTEXT_PACKING_ENABLED: bool = os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true"
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # 上下文 token 上限
+    CONTEXT_MIN_CHUNK_TOKENS: int = int(os.getenv("CONTEXT_MIN_CHUNK_TOKENS", "48"))  # 剩余预算低于该值时不再截断装入片段
+    CONTEXT_TOKENIZER: str = os.getenv("CONTEXT_TOKENIZER", "")  # HF 分词器名或本地路径，为空则按字符估算
     
     # 智谱AI配置
     ZHIPU_API_KEY: str = os.getenv("ZHIPU_API_KEY", "")  # 必须从 .env 注入，禁止硬编码
     ZHIPU_API_URL: str = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
     ZHIPU_MODEL: str = "glm-4"
+    LLM_HTTP2: bool = os.getenv("LLM_HTTP2", "true").lower() == "true"  # 需安装 h2，未安装时回退 HTTP/1.1
+    LLM_POOL_MAX_CONNECTIONS: int = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))  # 连接池最大连接数
+    LLM_POOL_MAX_KEEPALIVE: int = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))  # 保持空闲的长连接数
+    LLM_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("LLM_POOL_KEEPALIVE_EXPIRY", "60"))  # 空闲连接保留时间（秒）
+    LLM_CONNECT_TIMEOUT: float = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))  # 建连超时（秒）
+    LLM_READ_TIMEOUT: float = float(os.getenv("LLM_READ_TIMEOUT", "60"))  # 读取超时（秒），流式时为相邻片段的最大间隔
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))  # 同时进行的 LLM 请求上限
+    LLM_RETRY_MAX_ATTEMPTS: int = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))  # 含首次调用的最大尝试次数
+    LLM_RETRY_BASE_DELAY: float = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.2"))  # 指数退避基数（秒）
+    LLM_RETRY_MAX_DELAY: float = float(os.getenv("LLM_RETRY_MAX_DELAY", "2.0"))  # 单次退避上限（秒）
+    LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"  # 慢请求对冲（会增加调用量）
+    LLM_HEDGE_PERCENTILE: float = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))  # 超过该延迟分位数后发出对冲请求
+    LLM_HEDGE_MIN_DELAY: float = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))  # 对冲等待下限（秒）
+    LLM_BREAKER_FAILURE_RATE: float = float(os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))  # 熔断错误率阈值
+    LLM_BREAKER_MIN_REQUESTS: int = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10"))  # 时间窗内最少请求数
+    LLM_BREAKER_WINDOW: float = float(os.getenv("LLM_BREAKER_WINDOW", "60"))  # 错误率统计时间窗（秒）
+    LLM_BREAKER_COOLDOWN: float = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))  # 熔断后冷却时间（秒）
+    
+    # 本地 LLM 配置（OpenAI 兼容端点：vLLM / Ollama / scripts/mock_llm_server.py）
+    USE_LOCAL_LLM: bool = os.getenv("USE_LOCAL_LLM", "false").lower() == "true"
+    LOCAL_LLM_BASE_URL: str = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:9000/v1")  # 不含 /chat/completions
+    LOCAL_LLM_MODEL: str = os.getenv("LOCAL_LLM_MODEL", "mock-llm")  # 请求中的 model 字段
+    LOCAL_LLM_API_KEY: str = os.getenv("LOCAL_LLM_API_KEY", "")  # 为空则不发送 Authorization
     
     # Redis 配置
     REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
@@ -49,6 +127,29 @@ class Settings(BaseSettings):
     REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
     CACHE_TTL: int = int(os.getenv("CACHE_TTL", "3600"))  # 缓存过期时间（秒）
     CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_L1_ENABLED: bool = os.getenv("ANSWER_CACHE_L1_ENABLED", "true").lower() == "true"  # 答案缓存进程内 L1
+    ANSWER_CACHE_L1_SIZE: int = int(os.getenv("ANSWER_CACHE_L1_SIZE", "1000"))  # L1 容量
+    ANSWER_CACHE_L1_TTL: int = int(os.getenv("ANSWER_CACHE_L1_TTL", "300"))  # L1 存活时间（秒），兜底漏收的失效广播
+    CACHE_COMPRESS_MIN_BYTES: int = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "256"))  # 答案超过该字节数时 zlib 压缩
+    CACHE_REFRESH_AHEAD_ENABLED: bool = os.getenv("CACHE_REFRESH_AHEAD_ENABLED", "false").lower() == "true"  # 热点条目提前刷新
+    CACHE_REFRESH_AHEAD_WINDOW: int = int(os.getenv("CACHE_REFRESH_AHEAD_WINDOW", "300"))  # 剩余 TTL 低于该值（秒）时命中即触发刷新
+
+    # 单飞请求合并配置（同一问题并发时只计算一次）
+    SINGLE_FLIGHT_ENABLED: bool = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    SINGLE_FLIGHT_LOCK_TTL: int = int(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "30"))  # 跨 worker 锁过期时间（秒），应大于一次问答耗时
+    SINGLE_FLIGHT_WAIT_TIMEOUT: float = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT", "30"))  # 等待其它 worker 结果的上限（秒）
+
+    # 语义答案缓存配置（检索之前按问题向量相似度命中）
+    SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # 问题向量 COSINE 相似度阈值
+    SEMANTIC_CACHE_MAX_ENTRIES: int = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "20000"))  # 单代条目上限，超出后整体翻代
+    SEMANTIC_CACHE_REDIS_ENABLED: bool = os.getenv("SEMANTIC_CACHE_REDIS_ENABLED", "true").lower() == "true"  # 多 worker 共享
+
+    # 查询向量缓存配置
+    EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_SIZE: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))  # 进程内 LRU 容量
+    EMBEDDING_CACHE_REDIS_ENABLED: bool = os.getenv("EMBEDDING_CACHE_REDIS_ENABLED", "false").lower() == "true"
+    EMBEDDING_CACHE_TTL: int = int(os.getenv("EMBEDDING_CACHE_TTL", "86400"))  # Redis 二级缓存过期时间（秒）
     
     # 文件上传配置
     UPLOAD_DIR: str = "./uploads"
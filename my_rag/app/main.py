@@ -29,6 +29,16 @@ app.add_middleware(
 # 注册路由
 app.include_router(api_router, prefix="/api", tags=["API"])
 
+@app.on_event("shutdown")
+async def shutdown():
+    """释放 LLM 连接池、单飞合并的 Redis 连接和推理进程池"""
+    from app.services.llm_service import llm_service
+    from app.services.model_workers import model_workers
+    from app.services.single_flight import single_flight
+    await llm_service.aclose()
+    await single_flight.aclose()
+    model_workers.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "RAG问答系统API", "docs": "/docs"}
@@ -36,9 +46,14 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康检查端点"""
+    from app.services.llm_service import llm_service
+    from app.services.model_workers import model_workers
+    llm_health = llm_service.health()
     return {
-        "status": "healthy",
+        "status": llm_health["status"],
         "service": "RAG问答系统",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "llm": llm_health,
+        "model_workers": model_workers.stats()
     }
 
@@ -0,0 +1,2 @@
+# 数据模型包
+
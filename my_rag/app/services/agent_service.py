@@ -4,8 +4,9 @@ Agent 服务（原生 Function Calling 版本）
 通过 LLM API 的 tools 参数下发工具定义，
 模型以结构化 tool_calls 返回调用意图，无需文本协议解析。
 """
+import json
 from typing import Dict, Any, List
-from app.services.agent_tools import get_agent_tools
+from app.services.agent_tools import get_agent_tools, search_documents_batch
 from app.services.llm_service import llm_service
 
 SYSTEM_PROMPT = """你是一个智能助手，可以调用工具来回答问题。
@@ -36,8 +37,10 @@ class SimpleAgent:
         Returns:
             tool 角色消息列表（与 tool_calls 一一对应）
         """
+        batched = self._batch_search_calls(tool_calls)
+
         tool_messages = []
-        for call in tool_calls:
+        for idx, call in enumerate(tool_calls):
             function_call = call.get("function", {})
             tool_name = function_call.get("name", "")
             arguments = function_call.get("arguments", "{}")
@@ -45,7 +48,9 @@ class SimpleAgent:
             print(f"🔧 执行工具: {tool_name}({arguments})")
 
             tool = self.tools.get(tool_name)
-            if tool is None:
+            if idx in batched:
+                observation = batched[idx]
+            elif tool is None:
                 observation = f"未知工具: {tool_name}，可用工具: {', '.join(self.tools.keys())}"
             else:
                 observation = tool.execute(arguments)
@@ -60,6 +65,35 @@ class SimpleAgent:
 
         return tool_messages
 
+    def _batch_search_calls(self, tool_calls: List[Dict[str, Any]]) -> Dict[int, str]:
+        """
+        同一轮有多个知识库搜索调用时合并为一次批量检索
+
+        Args:
+            tool_calls: 模型返回的 tool_calls 列表
+
+        Returns:
+            {tool_calls 下标: 搜索结果}，不足两个搜索调用时返回空字典（走单次执行）
+        """
+        indexes, queries = [], []
+        for idx, call in enumerate(tool_calls):
+            function_call = call.get("function", {})
+            if function_call.get("name") != "search_knowledge_base":
+                continue
+            try:
+                arguments = function_call.get("arguments") or "{}"
+                args = json.loads(arguments) if isinstance(arguments, str) else arguments
+                query = args.get("query") if isinstance(args, dict) else None
+            except json.JSONDecodeError:
+                query = None
+            if isinstance(query, str) and query:
+                indexes.append(idx)
+                queries.append(query)
+
+        if len(queries) < 2:
+            return {}
+        return dict(zip(indexes, search_documents_batch(queries)))
+
     def run(self, question: str, max_iterations: int = 5) -> Dict[str, Any]:
         """
         运行 Agent
@@ -4,7 +4,7 @@ Agent 工具定义（原生 Function Calling 版本）
 每个工具提供 OpenAI 兼容的 JSON Schema 参数定义，
 由 LLM API 的 tools 参数下发，模型通过 tool_calls 结构化返回调用意图。
 """
-from typing import Callable, Dict, Any, Optional, Union
+from typing import Callable, Dict, Any, List, Optional, Union
 from app.services.hybrid_search_service import hybrid_search_service
 from app.services.milvus_service import milvus_service
 import datetime
@@ -62,6 +62,16 @@ class Tool:
         except Exception as e:
             return f"工具执行失败: {str(e)}"
 
+def _format_search_result(context: str, dropped_routes: List[str]) -> str:
+    """格式化检索结果；有召回路被丢弃时注明，提示结果可能不完整"""
+    if context and context != "无相关内容":
+        result = f"找到相关文档：\n{context}"
+    else:
+        result = "未找到相关文档"
+    if dropped_routes:
+        result += f"\n（召回路 {', '.join(dropped_routes)} 超时或失败，结果可能不完整）"
+    return result
+
 def search_documents(query: str) -> str:
     """
     搜索知识库文档
@@ -73,19 +83,38 @@ def search_documents(query: str) -> str:
         搜索结果
     """
     try:
-        context = hybrid_search_service.search_context(
+        detailed = hybrid_search_service.search_context_detailed(
             query,
             top_k=3,
             use_hybrid=True
         )
-        
-        if context and context != "无相关内容":
-            return f"找到相关文档：\n{context}"
-        else:
-            return "未找到相关文档"
+        return _format_search_result(detailed["context"], detailed["dropped_routes"])
     except Exception as e:
         return f"搜索失败: {str(e)}"
 
+def search_documents_batch(queries: List[str]) -> List[str]:
+    """
+    批量搜索知识库文档（同一轮多个搜索调用合并为一次批量检索）
+
+    Args:
+        queries: 搜索查询列表
+
+    Returns:
+        与 queries 一一对应的搜索结果
+    """
+    try:
+        detailed = hybrid_search_service.search_context_batch_detailed(
+            queries,
+            top_k=3,
+            use_hybrid=True
+        )
+        return [
+            _format_search_result(context, detailed["dropped_routes"])
+            for context in detailed["contexts"]
+        ]
+    except Exception as e:
+        return [f"搜索失败: {str(e)}" for _ in queries]
+
 def calculator(expression: str) -> str:
     """
     计算数学表达式
@@ -148,13 +177,9 @@ def count_documents() -> str:
     """
     try:
         if not milvus_service.enabled:
-            return "Milvus 未连接，无法统计文档数量"
-
-        stats = milvus_service.client.get_collection_stats(
-            milvus_service.collection_name
-        )
+            return "向量库未连接，无法统计文档数量"
 
-        count = stats.get('row_count', 0)
+        count = milvus_service.count()
         return f"知识库中共有 {count} 条文档片段"
     except Exception as e:
         return f"统计失败: {str(e)}"
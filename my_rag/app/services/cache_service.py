@@ -1,58 +1,291 @@
 """
 Redis 缓存服务
 用于缓存问答结果，提升响应速度
+
+- L1：进程内 LRU（容量 + TTL），热点问题直接查字典；L2：Redis，多 worker 共享
+- 缓存键包含知识库版本号：文档入库 / 删除时递增版本号，
+  旧版本的条目不再可达（O(1) 失效，无需扫描 Redis），随 TTL 自然过期
+- 版本变化和单条删除通过 Redis pub/sub 广播，各 worker 同步本地版本号并清理 L1
+- 统计来自写入 / 读取时维护的计数器（条目数、字节数、查询数、命中数、各版本条目数），
+  L1 命中在进程内累积后随下一次 Redis 查询写入；过期条目按过期时间索引增量扣除；清空时旧版本条目由后台 SCAN + UNLINK 分批回收，
+  不再执行阻塞 Redis 的 KEYS
+- 提前刷新（可选）：命中的条目临近过期时，后台重新生成答案并续期，热点问题不会集中失效
+- 存储格式：定长二进制头部 + UTF-8 答案，超过阈值的答案 zlib 压缩；
+  格式版本写在键前缀中（rag:chat:f{版本}:），格式升级后旧条目自然不可达
 """
 import redis
 import json
 import hashlib
-from typing import Optional, Dict, Any
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, Dict, Any, List, Callable
 from app.config import settings
+from app.services.local_cache import LRUCache
+from app.services.search_filter import SearchFilter
+from app.services.semantic_cache import SemanticCache
+
+# 答案存储格式：1 字节标志位 + 4 字节写入时间（秒）+ 答案字节
+PAYLOAD_FORMAT = 1
+_PAYLOAD_HEADER = struct.Struct("<BI")
+_FLAG_ZLIB = 0x01
+
+# 读取 + 计数一次往返完成：查询数与命中数在同一脚本中原子累加
+# KEYS[1] 缓存键，KEYS[2] 统计 hash；ARGV[1] 尚未计入的 L1 命中数
+_LOOKUP_SCRIPT = """
+local value = redis.call('GET', KEYS[1])
+local hits = tonumber(ARGV[1])
+redis.call('HINCRBY', KEYS[2], 'lookups', hits + 1)
+if value then hits = hits + 1 end
+if hits > 0 then redis.call('HINCRBY', KEYS[2], 'hits', hits) end
+return {value, redis.call('PTTL', KEYS[1])}
+"""
+_KEY_VERSION = re.compile(r":v(\d+):")
+
+
+def encode_payload(answer: str, min_compress_bytes: int = 256) -> bytes:
+    """
+    编码缓存答案，长答案压缩后更小时才使用压缩结果
+    
+    Args:
+        answer: 答案
+        min_compress_bytes: 启用压缩的最小字节数
+    
+    Returns:
+        二进制负载
+    """
+    body = answer.encode('utf-8')
+    flags = 0
+    if len(body) >= min_compress_bytes:
+        compressed = zlib.compress(body, 6)
+        if len(compressed) < len(body):
+            body, flags = compressed, _FLAG_ZLIB
+    return _PAYLOAD_HEADER.pack(flags, int(time.time())) + body
+
+
+def decode_payload(data: bytes) -> str:
+    """解码缓存答案"""
+    flags, _ = _PAYLOAD_HEADER.unpack_from(data)
+    body = data[_PAYLOAD_HEADER.size:]
+    if flags & _FLAG_ZLIB:
+        body = zlib.decompress(body)
+    return body.decode('utf-8')
+
+
+def _to_str(value) -> str:
+    """客户端不解码响应，键名等文本字段按需转换"""
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
 
 class CacheService:
     """Redis 缓存服务"""
     
+    KB_VERSION_KEY = "rag:kb:version"
+    GENERATION_COUNT_KEY = "rag:kb:entries"  # hash：知识库版本 -> 该版本仍有效的条目数
+    GENERATION_KEEP = 16  # 统计中保留的历史版本数
+    INVALIDATION_CHANNEL = "rag:cache:invalidate"
+    NAMESPACE = "chat"
+    NAMESPACE_PREFIX = "rag:chat:"
+    KEY_PREFIX = f"rag:chat:f{PAYLOAD_FORMAT}:"
+    STATS_KEY = "rag:stats:chat"  # hash：entries / bytes / lookups / hits
+    EXPIRY_KEY = "rag:stats:chat:expiry"  # zset：缓存键 -> 过期时间戳
+    SIZES_KEY = "rag:stats:chat:sizes"  # hash：缓存键 -> 字节数
+    PRUNE_LOCK_KEY = "rag:stats:chat:prune"
+    PRUNE_BATCH = 1000  # 每次最多扣除的过期条目数
+    PRUNE_EVERY = 64  # 每个进程每写入多少条顺带扣除一批过期条目（不依赖统计接口被轮询）
+    PURGE_BATCH = 500  # SCAN + UNLINK 每批键数
+    REFRESH_LOCK_PREFIX = "rag:flight:refresh:"
+    
     def __init__(self):
         """初始化 Redis 连接"""
+        self.use_redis(None)
         try:
-            self.redis_client = redis.Redis(
+            client = redis.Redis(
                 host=settings.REDIS_HOST,
                 port=settings.REDIS_PORT,
                 db=0,
-                decode_responses=True,
+                decode_responses=False,  # 答案为二进制负载
                 socket_connect_timeout=5
             )
             # 测试连接
-            self.redis_client.ping()
-            self.enabled = True
+            client.ping()
+            self.use_redis(client)
             print("✅ Redis 缓存服务已启用")
         except Exception as e:
             print(f"⚠️  Redis 连接失败，缓存功能已禁用: {str(e)}")
-            self.redis_client = None
-            self.enabled = False
+        
+        # 本地版本号：Redis 不可用时只在进程内递增；订阅生效时由广播维护
+        self._local_kb_version = 0
+        self._listener_alive = False
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self._writes_since_prune = 0
+        # L1 命中不访问 Redis，计数先在进程内累积，随下一次 Redis 查询（或统计接口）一并写入
+        self._pending_l1_hits = 0
+        self._pending_lock = threading.Lock()
+        
+        # L1 进程内缓存，失效通知依赖 pub/sub
+        self.local = None
+        if settings.ANSWER_CACHE_L1_ENABLED:
+            self.local = LRUCache(settings.ANSWER_CACHE_L1_SIZE, ttl=settings.ANSWER_CACHE_L1_TTL)
+            if self.enabled:
+                threading.Thread(
+                    target=self._listen_invalidation,
+                    name="cache-invalidation",
+                    daemon=True
+                ).start()
+
+        # 语义缓存层：检索之前按问题向量相似度命中，不依赖上面的精确缓存是否可用
+        self.semantic_cache = SemanticCache()
+    
+    def use_redis(self, client: Optional[redis.Redis]):
+        """设置 Redis 客户端（None 表示禁用缓存）"""
+        self.redis_client = client
+        self.enabled = client is not None
+        self._lookup_script = client.register_script(_LOOKUP_SCRIPT) if client is not None else None
+    
+    def _take_pending_l1_hits(self) -> int:
+        """取出尚未写入 Redis 的 L1 命中数"""
+        with self._pending_lock:
+            pending, self._pending_l1_hits = self._pending_l1_hits, 0
+        return pending
+    
+    def _restore_pending_l1_hits(self, count: int):
+        """写入 Redis 失败时放回，下次再写"""
+        with self._pending_lock:
+            self._pending_l1_hits += count
+    
+    def _flush_pending_l1_hits(self):
+        """把进程内累积的 L1 命中写入统计 hash（查询数与命中数同一事务）"""
+        pending = self._take_pending_l1_hits()
+        if not pending:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.hincrby(self.STATS_KEY, "lookups", pending)
+            pipe.hincrby(self.STATS_KEY, "hits", pending)
+            pipe.execute()
+        except Exception:
+            self._restore_pending_l1_hits(pending)
+            raise
+    
+    def _listen_invalidation(self):
+        """后台线程：订阅失效广播，断线后重连并重新读取版本号"""
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.INVALIDATION_CHANNEL)
+                # 订阅之后再读版本号，期间的变化不会丢失
+                self._apply_kb_version(int(self.redis_client.get(self.KB_VERSION_KEY) or 0))
+                self._listener_alive = True
+                for message in pubsub.listen():
+                    self._handle_invalidation(message["data"])
+            except Exception as e:
+                print(f"⚠️  缓存失效订阅中断，1 秒后重连: {str(e)}")
+            self._listener_alive = False
+            time.sleep(1)
+    
+    def _handle_invalidation(self, data: str):
+        """处理失效广播：{"version": n} 或 {"key": 缓存键}"""
+        message = json.loads(data)
+        if "version" in message:
+            self._apply_kb_version(int(message["version"]))
+        elif "key" in message and self.local is not None:
+            self.local.delete(message["key"])
     
-    def _generate_cache_key(self, question: str, context: str = "") -> str:
+    def _apply_kb_version(self, version: int):
+        """更新本地版本号（只增不减），版本变化时清空 L1"""
+        if version > self._local_kb_version:
+            self._local_kb_version = version
+            if self.local is not None:
+                self.local.clear()
+    
+    def _publish_invalidation(self, message: Dict[str, Any]):
+        try:
+            self.redis_client.publish(self.INVALIDATION_CHANNEL, json.dumps(message))
+        except Exception as e:
+            print(f"⚠️  缓存失效广播失败: {str(e)}")
+    
+    def get_kb_version(self) -> int:
+        """
+        获取当前知识库版本号（订阅生效时直接取本地值，不访问 Redis）
+        
+        Returns:
+            版本号，从 0 开始单调递增
+        """
+        if not self.enabled or self._listener_alive:
+            return self._local_kb_version
+        
+        try:
+            return int(self.redis_client.get(self.KB_VERSION_KEY) or 0)
+        except Exception as e:
+            print(f"⚠️  知识库版本读取失败: {str(e)}")
+            return self._local_kb_version
+    
+    def bump_kb_version(self) -> int:
+        """
+        知识库变化（文档入库 / 删除）后调用：递增版本号，使所有缓存答案失效
+        
+        Returns:
+            新的版本号
+        """
+        self.semantic_cache.invalidate()
+        if not self.enabled:
+            self._apply_kb_version(self._local_kb_version + 1)
+            return self._local_kb_version
+        
+        try:
+            version = int(self.redis_client.incr(self.KB_VERSION_KEY))
+            # 只保留最近几个版本的条目统计
+            stale = [
+                field for field in self.redis_client.hkeys(self.GENERATION_COUNT_KEY)
+                if int(field) <= version - self.GENERATION_KEEP
+            ]
+            if stale:
+                self.redis_client.hdel(self.GENERATION_COUNT_KEY, *stale)
+            self._apply_kb_version(version)
+            self._publish_invalidation({"version": version})
+        except Exception as e:
+            print(f"⚠️  知识库版本更新失败: {str(e)}")
+        print(f"✅ 知识库版本已更新: v{self._local_kb_version}")
+        return self._local_kb_version
+    
+    def _generate_cache_key(self, question: str, context: str = "", kb_version: Optional[int] = None) -> str:
         """
         生成缓存键
         
         Args:
             question: 用户问题
             context: 上下文（可选）
+            kb_version: 知识库版本号，默认取当前版本
         
         Returns:
             缓存键
         """
+        if kb_version is None:
+            kb_version = self.get_kb_version()
         # 使用问题和上下文的哈希作为键
         content = f"{question}:{context}"
         hash_key = hashlib.md5(content.encode('utf-8')).hexdigest()
-        return f"rag:chat:{hash_key}"
+        return f"{self.KEY_PREFIX}v{kb_version}:{hash_key}"
     
-    def get_cached_answer(self, question: str, context: str = "") -> Optional[str]:
+    def get_cached_answer(
+        self,
+        question: str,
+        context: str = "",
+        kb_version: Optional[int] = None,
+        refresh: Optional[Callable[[], str]] = None
+    ) -> Optional[str]:
         """
         获取缓存的答案
         
         Args:
             question: 用户问题
             context: 上下文
+            kb_version: 知识库版本号，默认取当前版本
+            refresh: 重新生成答案的函数；开启提前刷新时，命中临近过期的条目会在后台调用
         
         Returns:
             缓存的答案，如果不存在返回 None
@@ -61,25 +294,77 @@ class CacheService:
             return None
         
         try:
-            cache_key = self._generate_cache_key(question, context)
-            cached_data = self.redis_client.get(cache_key)
+            if kb_version is None:
+                kb_version = self.get_kb_version()
+            cache_key = self._generate_cache_key(question, context, kb_version)
+            if self.local is not None:
+                answer = self.local.get(cache_key)
+                if answer is not None:
+                    with self._pending_lock:
+                        self._pending_l1_hits += 1
+                    print(f"✅ L1 缓存命中: {cache_key[:20]}...")
+                    return answer
+            
+            # 读取、查询 / 命中计数（含累积的 L1 命中）同一次往返
+            pending = self._take_pending_l1_hits()
+            try:
+                cached_data, remaining_ms = self._lookup_script(
+                    keys=[cache_key, self.STATS_KEY], args=[pending]
+                )
+            except Exception:
+                self._restore_pending_l1_hits(pending)
+                raise
             
             if cached_data:
-                data = json.loads(cached_data)
+                self.redis_hits += 1
+                answer = decode_payload(cached_data)
                 print(f"✅ 缓存命中: {cache_key[:20]}...")
-                return data.get("answer")
+                if self.local is not None:
+                    self.local.set(cache_key, answer)
+                if refresh is not None and 0 < remaining_ms < settings.CACHE_REFRESH_AHEAD_WINDOW * 1000:
+                    self._schedule_refresh(cache_key, question, context, kb_version, refresh)
+                return answer
             
+            self.redis_misses += 1
             return None
         except Exception as e:
             print(f"⚠️  缓存读取失败: {str(e)}")
             return None
     
+    def _schedule_refresh(
+        self,
+        cache_key: str,
+        question: str,
+        context: str,
+        kb_version: int,
+        refresh: Callable[[], str]
+    ):
+        """临近过期的热点条目：后台重新生成并续期，Redis 锁保证各 worker 只刷新一次"""
+        if not settings.CACHE_REFRESH_AHEAD_ENABLED:
+            return
+        lock_key = self.REFRESH_LOCK_PREFIX + cache_key
+        if not self.redis_client.set(lock_key, 1, ex=settings.SINGLE_FLIGHT_LOCK_TTL, nx=True):
+            return
+        
+        def run():
+            try:
+                answer = refresh()
+                self.set_cached_answer(question, answer, context, kb_version=kb_version)
+                print(f"🔄 缓存已提前刷新: {cache_key[:20]}...")
+            except Exception as e:
+                print(f"⚠️  缓存提前刷新失败: {str(e)}")
+            finally:
+                self.redis_client.delete(lock_key)
+        
+        threading.Thread(target=run, name="cache-refresh", daemon=True).start()
+    
     def set_cached_answer(
         self,
         question: str,
         answer: str,
         context: str = "",
-        ttl: int = 3600
+        ttl: int = 3600,
+        kb_version: Optional[int] = None
     ) -> bool:
         """
         设置缓存答案
@@ -89,6 +374,7 @@ class CacheService:
             answer: AI 答案
             context: 上下文
             ttl: 过期时间（秒），默认 1 小时
+            kb_version: 检索上下文时的知识库版本号，默认取当前版本
         
         Returns:
             是否设置成功
@@ -97,25 +383,190 @@ class CacheService:
             return False
         
         try:
-            cache_key = self._generate_cache_key(question, context)
-            cache_data = {
-                "question": question,
-                "answer": answer,
-                "context": context[:200],  # 只存储部分上下文
-                "timestamp": self._get_timestamp()
-            }
+            if kb_version is None:
+                kb_version = self.get_kb_version()
+            cache_key = self._generate_cache_key(question, context, kb_version)
+            payload = encode_payload(answer, settings.CACHE_COMPRESS_MIN_BYTES)
             
-            self.redis_client.setex(
-                cache_key,
-                ttl,
-                json.dumps(cache_data, ensure_ascii=False)
-            )
+            # 新键才计入该版本的条目数，覆盖写不重复计数
+            created = self.redis_client.set(cache_key, payload, ex=ttl, nx=True)
+            if not created:
+                self.redis_client.setex(cache_key, ttl, payload)
+            self._track_set(cache_key, len(payload), ttl, kb_version if created else None)
+            if self.local is not None:
+                self.local.set(cache_key, answer, ttl=min(ttl, self.local.ttl or ttl))
             print(f"✅ 缓存已设置: {cache_key[:20]}... (TTL: {ttl}s)")
             return True
         except Exception as e:
             print(f"⚠️  缓存写入失败: {str(e)}")
             return False
     
+    def _track_set(self, cache_key: str, size: int, ttl: int, kb_version: Optional[int]):
+        """
+        写入后更新计数器（MULTI 事务，原子生效）
+        
+        Args:
+            cache_key: 缓存键
+            size: 条目字节数
+            ttl: 过期时间（秒）
+            kb_version: 新建条目所属的知识库版本，覆盖写时为 None
+        """
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hget(self.SIZES_KEY, cache_key)
+        pipe.hset(self.SIZES_KEY, cache_key, size)
+        pipe.zadd(self.EXPIRY_KEY, {cache_key: time.time() + ttl})
+        pipe.hincrby(self.STATS_KEY, "entries", 1)
+        pipe.hincrby(self.STATS_KEY, "bytes", size)
+        if kb_version is not None:
+            pipe.hincrby(self.GENERATION_COUNT_KEY, str(kb_version), 1)
+        old_size = pipe.execute()[0]
+        
+        # 覆盖写或已过期但尚未扣除的旧条目：撤销重复计数
+        if old_size is not None:
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.hincrby(self.STATS_KEY, "entries", -1)
+            pipe.hincrby(self.STATS_KEY, "bytes", -int(old_size))
+            if kb_version is not None:
+                pipe.hincrby(self.GENERATION_COUNT_KEY, str(kb_version), -1)
+            pipe.execute()
+
+        # 写路径上分批扣除过期条目：每 PRUNE_EVERY 次写入最多扣除 PRUNE_BATCH 条，
+        # 扣除速度大于写入速度，SIZES_KEY / EXPIRY_KEY 不会无界增长
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= self.PRUNE_EVERY:
+            self._writes_since_prune = 0
+            self._prune_expired()
+    
+    def _forget_keys(self, keys: List[str], unlink: bool = True) -> int:
+        """
+        删除一批缓存键并扣除计数器
+        
+        Args:
+            keys: 缓存键列表
+            unlink: 是否删除键本身（过期条目已由 Redis 删除，只需扣除计数）
+        
+        Returns:
+            实际删除的键数量
+        """
+        if not keys:
+            return 0
+        pipe = self.redis_client.pipeline(transaction=False)
+        if unlink:
+            pipe.unlink(*keys)
+        pipe.hmget(self.SIZES_KEY, keys)
+        results = pipe.execute()
+        removed = results[0] if unlink else 0
+        
+        tracked = [(key, int(size)) for key, size in zip(keys, results[-1]) if size is not None]
+        if tracked:
+            # 按键中的版本号扣除各版本的条目数
+            generations: Dict[str, int] = {}
+            for key, _ in tracked:
+                match = _KEY_VERSION.search(_to_str(key))
+                if match:
+                    generations[match.group(1)] = generations.get(match.group(1), 0) + 1
+            pipe = self.redis_client.pipeline(transaction=True)
+            pipe.hdel(self.SIZES_KEY, *[key for key, _ in tracked])
+            pipe.zrem(self.EXPIRY_KEY, *[key for key, _ in tracked])
+            pipe.hincrby(self.STATS_KEY, "entries", -len(tracked))
+            pipe.hincrby(self.STATS_KEY, "bytes", -sum(size for _, size in tracked))
+            for version, count in generations.items():
+                pipe.hincrby(self.GENERATION_COUNT_KEY, version, -count)
+            pipe.execute()
+        return removed
+    
+    def _prune_expired(self) -> int:
+        """
+        扣除已过期条目的计数（每次最多 PRUNE_BATCH 条，多 worker 间用锁串行）
+        
+        Returns:
+            扣除的条目数
+        """
+        if not self.redis_client.set(self.PRUNE_LOCK_KEY, 1, ex=5, nx=True):
+            return 0
+        try:
+            expired = self.redis_client.zrangebyscore(
+                self.EXPIRY_KEY, "-inf", time.time(), start=0, num=self.PRUNE_BATCH
+            )
+            self._forget_keys(expired, unlink=False)
+            return len(expired)
+        finally:
+            self.redis_client.delete(self.PRUNE_LOCK_KEY)
+    
+    def purge_stale_entries(self) -> int:
+        """
+        回收旧知识库版本的缓存条目：SCAN 增量遍历，UNLINK 分批异步释放内存
+        
+        Returns:
+            删除的键数量
+        """
+        if not self.enabled:
+            return 0
+        
+        current_prefix = f"{self.KEY_PREFIX}v{self.get_kb_version()}:"
+        removed = 0
+        batch: List[str] = []
+        # 同时回收旧存储格式的条目
+        for key in self.redis_client.scan_iter(match=f"{self.NAMESPACE_PREFIX}*", count=self.PURGE_BATCH):
+            if _to_str(key).startswith(current_prefix):
+                continue
+            batch.append(key)
+            if len(batch) >= self.PURGE_BATCH:
+                removed += self._forget_keys(batch)
+                batch = []
+        removed += self._forget_keys(batch)
+        print(f"✅ 已回收 {removed} 条旧版本缓存")
+        return removed
+    
+    def get_semantic_answer(
+        self,
+        question_vector: List[float],
+        filters: Optional[SearchFilter] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        按问题向量查找相似问题的缓存答案（在检索之前调用）
+        
+        Args:
+            question_vector: 问题向量
+            filters: 检索过滤条件，不同范围的答案互不复用
+        
+        Returns:
+            {"question", "answer", "similarity"}，未命中返回 None
+        """
+        try:
+            hit = self.semantic_cache.get(question_vector, filters)
+        except Exception as e:
+            print(f"⚠️  语义缓存读取失败: {str(e)}")
+            return None
+        if hit:
+            print(f"✅ 语义缓存命中: {hit['question'][:20]}... (similarity={hit['similarity']:.4f})")
+        return hit
+    
+    def set_semantic_answer(
+        self,
+        question: str,
+        answer: str,
+        question_vector: List[float],
+        filters: Optional[SearchFilter] = None,
+        kb_version: Optional[int] = None
+    ):
+        """
+        写入语义缓存
+        
+        Args:
+            question: 用户问题
+            answer: AI 答案
+            question_vector: 问题向量
+            filters: 检索过滤条件
+            kb_version: 检索上下文时的知识库版本号，生成答案期间知识库已变化则不写入
+        """
+        if kb_version is not None and kb_version != self.get_kb_version():
+            return
+        try:
+            self.semantic_cache.set(question, answer, question_vector, filters)
+        except Exception as e:
+            print(f"⚠️  语义缓存写入失败: {str(e)}")
+    
     def delete_cache(self, question: str, context: str = "") -> bool:
         """
         删除指定缓存
@@ -132,7 +583,10 @@ class CacheService:
         
         try:
             cache_key = self._generate_cache_key(question, context)
-            result = self.redis_client.delete(cache_key)
+            result = self._forget_keys([cache_key])
+            if self.local is not None:
+                self.local.delete(cache_key)
+                self._publish_invalidation({"key": cache_key})
             return result > 0
         except Exception as e:
             print(f"⚠️  缓存删除失败: {str(e)}")
@@ -140,25 +594,61 @@ class CacheService:
     
     def clear_all_cache(self) -> int:
         """
-        清空所有 RAG 相关缓存
+        清空所有 RAG 相关缓存：递增知识库版本号，旧版本条目立即不可达，
+        其占用的内存由后台线程分批回收
         
         Returns:
-            删除的缓存数量
+            失效的缓存数量（当前版本仍有效的条目数）
+        """
+        old_version = self.get_kb_version()
+        if self.enabled:
+            try:
+                self._prune_expired()
+            except Exception as e:
+                print(f"⚠️  过期条目扣除失败: {str(e)}")
+        count = self.get_generation_counts().get(old_version, 0)
+        self.bump_kb_version()
+        if self.enabled:
+            threading.Thread(target=self._purge_in_background, name="cache-purge", daemon=True).start()
+        print(f"✅ 已清空 {count} 条缓存")
+        return count
+    
+    def _purge_in_background(self):
+        try:
+            self.purge_stale_entries()
+        except Exception as e:
+            print(f"⚠️  旧版本缓存回收失败: {str(e)}")
+    
+    def get_generation_counts(self) -> Dict[int, int]:
+        """
+        各知识库版本仍有效的缓存条目数（过期条目按批扣除，可能略有滞后）
+        
+        Returns:
+            {版本号: 条目数}
         """
         if not self.enabled:
-            return 0
+            return {}
         
         try:
-            # 查找所有 rag:chat: 开头的键
-            keys = self.redis_client.keys("rag:chat:*")
-            if keys:
-                count = self.redis_client.delete(*keys)
-                print(f"✅ 已清空 {count} 条缓存")
-                return count
-            return 0
+            counts = self.redis_client.hgetall(self.GENERATION_COUNT_KEY)
+            # 已从统计中移除的旧版本（bump_kb_version 清理）再扣除时可能出现非正数
+            return {int(version): int(count) for version, count in counts.items() if int(count) > 0}
         except Exception as e:
-            print(f"⚠️  缓存清空失败: {str(e)}")
-            return 0
+            print(f"⚠️  缓存版本统计失败: {str(e)}")
+            return {}
+    
+    def _tier_stats(self) -> Dict[str, Any]:
+        """L1 / L2 分层命中统计"""
+        total = self.redis_hits + self.redis_misses
+        return {
+            "l1": self.local.stats() if self.local is not None else {"enabled": False},
+            "l2": {
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "hit_rate": round(self.redis_hits / total, 4) if total else 0.0
+            },
+            "invalidation_listener": self._listener_alive
+        }
     
     def get_cache_stats(self) -> Dict[str, Any]:
         """
@@ -170,33 +660,46 @@ class CacheService:
         if not self.enabled:
             return {
                 "enabled": False,
-                "message": "Redis 缓存未启用"
+                "message": "Redis 缓存未启用",
+                "kb_version": self._local_kb_version,
+                "semantic_cache": self.semantic_cache.stats()
             }
         
         try:
-            # 获取所有 RAG 缓存键
-            keys = self.redis_client.keys("rag:chat:*")
+            self._prune_expired()
+            self._flush_pending_l1_hits()
+            counters = {_to_str(k): int(v) for k, v in self.redis_client.hgetall(self.STATS_KEY).items()}
+            lookups = counters.get("lookups", 0)
+            hits = counters.get("hits", 0)
             
             # 获取 Redis 信息
             info = self.redis_client.info()
             
             return {
                 "enabled": True,
-                "total_keys": len(keys),
+                "total_keys": counters.get("entries", 0),
+                "namespaces": {
+                    self.NAMESPACE: {
+                        "entries": counters.get("entries", 0),
+                        "bytes": counters.get("bytes", 0),
+                        "hits": hits,
+                        "misses": lookups - hits,
+                        "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+                    }
+                },
+                "kb_version": self.get_kb_version(),
+                "entries_per_generation": self.get_generation_counts(),
                 "memory_used": info.get("used_memory_human", "N/A"),
                 "connected_clients": info.get("connected_clients", 0),
-                "uptime_days": info.get("uptime_in_days", 0)
+                "uptime_days": info.get("uptime_in_days", 0),
+                "tiers": self._tier_stats(),
+                "semantic_cache": self.semantic_cache.stats()
             }
         except Exception as e:
             return {
                 "enabled": False,
                 "error": str(e)
             }
-    
-    def _get_timestamp(self) -> str:
-        """获取当前时间戳"""
-        from datetime import datetime
-        return datetime.now().isoformat()
 
 # 创建全局实例
 cache_service = CacheService()
@@ -0,0 +1,153 @@
+"""
+检索候选记录
+多路召回 → RRF 融合 → Rerank 全程以稳定的 (document_id, chunk_id) 作为候选键，
+避免反复对长文本做哈希；有旧数据（缺 chunk_id）参与的融合退回按内容取键。
+
+- CandidateSet：数组化的候选集合（召回结果引用列表 + NumPy 分数 / 排序数组），
+  融合阶段不为每个候选分配对象、不拷贝召回结果
+- Candidate：__slots__ 视图对象，仅在下游真正访问某个候选时才创建
+"""
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Union
+
+import numpy as np
+
+
+def candidate_key(hit: Dict[str, Any], by_content: bool = False) -> Hashable:
+    """
+    候选键：默认 (document_id, chunk_id)
+
+    旧数据（如 chunk_id 字段上线前写入的 Milvus 行）缺 chunk_id，而 ES 行有，
+    同一片段在两路中的键会不一致、RRF 分数被拆开。因此只要本次融合的任一路
+    有候选缺 chunk_id，调用方就对所有候选改用 (document_id, 内容) 作为键。
+
+    Args:
+        hit: 召回结果（Milvus / ES 格式化后的字典或 Candidate）
+        by_content: 是否按 (document_id, 内容) 取键
+    """
+    document_id = hit.get("document_id")
+    chunk_id = hit.get("chunk_id")
+    if by_content or chunk_id is None:
+        return (document_id, hit.get("content", ""))
+    return (document_id, chunk_id)
+
+
+def needs_content_key(*routes: List[Dict[str, Any]]) -> bool:
+    """各路召回中是否有缺 chunk_id 的候选（此时整次融合按内容取键）"""
+    return any(
+        hit.get("chunk_id") is None
+        for results in routes for hit in results
+        if hit.get("content")
+    )
+
+
+class Candidate:
+    """
+    紧凑候选记录
+
+    hit 为首次召回到该候选的原始结果，other 为另一路召回到的同一候选（用于补齐
+    distance / score 等字段）；支持 dict 风格只读访问（get / [] / in）以兼容下游
+    """
+
+    __slots__ = ("key", "hit", "other", "fused_score", "rerank_score")
+
+    def __init__(self, key: Hashable, hit: Dict[str, Any]):
+        self.key = key
+        self.hit = hit
+        self.other: Optional[Dict[str, Any]] = None
+        self.fused_score: Optional[float] = None
+        self.rerank_score: Optional[float] = None
+
+    @property
+    def content(self) -> str:
+        return self.hit.get("content", "")
+
+    def get(self, name: str, default: Any = None) -> Any:
+        if name == "fused_score":
+            value = self.fused_score
+        elif name == "rerank_score":
+            value = self.rerank_score
+        else:
+            value = self.hit.get(name)
+            if value is None and self.other is not None:
+                value = self.other.get(name)
+        return default if value is None else value
+
+    def __getitem__(self, name: str) -> Any:
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为普通字典，作为对外输出（首路召回的字段优先）"""
+        row = dict(self.other) if self.other is not None else {}
+        row.update(self.hit)
+        if self.fused_score is not None:
+            row["fused_score"] = self.fused_score
+        if self.rerank_score is not None:
+            row["rerank_score"] = self.rerank_score
+        return row
+
+    def __repr__(self) -> str:
+        return f"Candidate({self.to_dict()!r})"
+
+
+class CandidateSet:
+    """
+    RRF 融合后的候选集合（按 fused_score 降序）
+
+    hits[i] 为候选 i 首次被召回的结果，others 仅记录两路重叠的候选；
+    order 为按分数降序的候选下标；ranks[r, i] 为候选 i 在第 r 路召回中的名次
+    （从 1 开始，0 表示该路未召回，只含有结果的路）。
+    序列协议（len / [] / 迭代 / 切片）返回 Candidate 视图。
+    """
+
+    __slots__ = ("keys", "hits", "others", "scores", "order", "ranks")
+
+    def __init__(
+        self,
+        keys: List[Hashable],
+        hits: List[Dict[str, Any]],
+        others: Dict[int, Dict[str, Any]],
+        scores: np.ndarray,
+        order: np.ndarray,
+        ranks: Optional[np.ndarray] = None
+    ):
+        self.keys = keys
+        self.hits = hits
+        self.others = others
+        self.scores = scores
+        self.order = order
+        self.ranks = ranks if ranks is not None else np.zeros((0, len(hits)), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _view(self, pos: int) -> Candidate:
+        candidate = Candidate(self.keys[pos], self.hits[pos])
+        candidate.other = self.others.get(pos)
+        candidate.fused_score = float(self.scores[pos])
+        return candidate
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Candidate, List[Candidate]]:
+        if isinstance(i, slice):
+            return [self._view(pos) for pos in self.order[i].tolist()]
+        return self._view(int(self.order[i]))
+
+    def __iter__(self) -> Iterator[Candidate]:
+        for pos in self.order.tolist():
+            yield self._view(pos)
+
+    def top_agreed(self) -> bool:
+        """排序第一的候选是否在至少两路召回中都排第一"""
+        if len(self.order) == 0 or self.ranks.shape[0] < 2:
+            return False
+        return bool((self.ranks[:, int(self.order[0])] == 1).all())
+
+    def contents(self) -> List[str]:
+        """按排序返回候选内容（供 rerank 直接使用，不创建视图对象）"""
+        hits = self.hits
+        return [hits[pos].get("content", "") for pos in self.order.tolist()]
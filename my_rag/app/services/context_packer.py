@@ -0,0 +1,213 @@
+"""
+上下文打包
+检索结果拼进提示词之前按 token 预算打包：提示词 token 数同时决定智谱计费和生成延迟
+
+- 计数：本地分词器（CONTEXT_TOKENIZER 指定 HF 分词器名或路径），未配置或加载失败时按字符估算
+- 排序：有 rerank 分数时按分数降序装入，低分片段优先被截断 / 丢弃
+- 去重：相邻分块有重叠，已装入的句子不再重复装入
+- 截断：预算不足时按句子截断最后一个片段，剩余预算过小则丢弃
+"""
+import math
+import re
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.services.embedding_cache import normalize_text
+
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;\n]*|[。！？!?；;\n]+")
+_CJK_RE = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+EMPTY_CONTEXT = "无相关内容"
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句末标点和换行切句，保留标点"""
+    return _SENTENCE_RE.findall(text)
+
+
+class TokenCounter:
+    """
+    token 计数器
+
+    配置了分词器时用本地 HF 分词器精确计数；否则估算：
+    中日韩字符（含全角标点）每字 1 token，英文 / 数字按每 4 个字符 1 token，其余符号每个 1 token
+    """
+
+    def __init__(self, tokenizer_name: str = ""):
+        self.tokenizer = None
+        self.name = "estimate"
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, trust_remote_code=True)
+                self.name = tokenizer_name
+                print(f"✅ 上下文分词器加载完成: {tokenizer_name}")
+            except Exception as e:
+                print(f"⚠️  上下文分词器加载失败，按字符估算 token: {str(e)}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        cjk = len(_CJK_RE.findall(text))
+        rest = _CJK_RE.sub(" ", text)
+        tokens = cjk
+        for word in _WORD_RE.findall(rest):
+            tokens += math.ceil(len(word) / 4) if word[0].isalnum() or word[0] == "_" else 1
+        return tokens
+
+
+class ContextPacker:
+    """按 token 预算打包检索结果"""
+
+    SEPARATOR = "\n\n"
+    MIN_DEDUP_CHARS = 8  # 短于该长度的句子（如“是的。”）不参与去重
+
+    def __init__(self):
+        self.enabled = settings.CONTEXT_PACKING_ENABLED
+        self.budget = settings.CONTEXT_TOKEN_BUDGET
+        self.min_chunk_tokens = settings.CONTEXT_MIN_CHUNK_TOKENS
+        self.counter = TokenCounter(settings.CONTEXT_TOKENIZER)
+        self.packs = 0
+        self.tokens_used = 0
+        self.tokens_saved = 0
+        self.chunks_trimmed = 0
+        self.chunks_dropped = 0
+        self.sentences_deduped = 0
+
+    @staticmethod
+    def _header(index: int) -> str:
+        return f"[片段{index}] "
+
+    def _fit_sentences(self, sentences: List[str], budget: int) -> str:
+        """取能放进 budget 的最长句子前缀；首句就放不下时按字符截断"""
+        kept = []
+        used = 0
+        for sentence in sentences:
+            cost = self.counter.count(sentence)
+            if used + cost > budget:
+                break
+            kept.append(sentence)
+            used += cost
+        if kept:
+            return "".join(kept).strip()
+
+        # 二分查找首句能保留的最长字符前缀
+        first = sentences[0]
+        low, high = 0, len(first)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.counter.count(first[:mid]) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        return first[:low].strip()
+
+    def pack(self, results: List[Dict[str, Any]], budget: Optional[int] = None) -> Dict[str, Any]:
+        """
+        打包检索结果
+
+        Args:
+            results: 检索结果（含 content，可选 rerank_score）
+            budget: token 预算，默认读配置
+
+        Returns:
+            {"text": 上下文文本, "tokens": 实际 token 数, "budget": 预算,
+             "raw_tokens": 不打包时的 token 数, "chunks": 装入的结果下标（按装入顺序）,
+             "trimmed": 被截断的下标, "dropped": 被丢弃的下标, "deduped_sentences": 去重的句子数}
+        """
+        budget = self.budget if budget is None else budget
+        # 有 rerank 分数的按分数降序，无分数的保持检索顺序并排在后面（sorted 稳定）
+        order = sorted(
+            range(len(results)),
+            key=lambda i: -results[i]['rerank_score']
+            if results[i].get('rerank_score') is not None else math.inf
+        )
+
+        parts: List[str] = []
+        chunks: List[int] = []
+        trimmed: List[int] = []
+        dropped: List[int] = []
+        seen = set()
+        deduped = 0
+        used = 0
+        raw_tokens = 0
+        separator_cost = self.counter.count(self.SEPARATOR)
+
+        for i in order:
+            content = (results[i].get('content') or '').strip()
+            raw_tokens += self.counter.count(content)
+            sentences = []
+            for sentence in split_sentences(content):
+                key = normalize_text(sentence)
+                if len(key) >= self.MIN_DEDUP_CHARS and key in seen:
+                    deduped += 1
+                    continue
+                sentences.append(sentence)
+            if not "".join(sentences).strip():
+                dropped.append(i)
+                continue
+
+            header = self._header(len(parts) + 1)
+            overhead = self.counter.count(header) + (separator_cost if parts else 0)
+            body = "".join(sentences).strip()
+            cost = overhead + self.counter.count(body)
+            if used + cost > budget:
+                remaining = budget - used - overhead
+                if remaining < self.min_chunk_tokens:
+                    dropped.append(i)
+                    continue
+                body = self._fit_sentences(sentences, remaining)
+                if not body:
+                    dropped.append(i)
+                    continue
+                trimmed.append(i)
+                cost = overhead + self.counter.count(body)
+
+            parts.append(header + body)
+            chunks.append(i)
+            used += cost
+            for sentence in split_sentences(body):
+                key = normalize_text(sentence)
+                if len(key) >= self.MIN_DEDUP_CHARS:
+                    seen.add(key)
+
+        text = self.SEPARATOR.join(parts) if parts else EMPTY_CONTEXT
+        tokens = self.counter.count(text) if parts else 0
+
+        self.packs += 1
+        self.tokens_used += tokens
+        self.tokens_saved += max(0, raw_tokens - tokens)
+        self.chunks_trimmed += len(trimmed)
+        self.chunks_dropped += len(dropped)
+        self.sentences_deduped += deduped
+        return {
+            "text": text,
+            "tokens": tokens,
+            "budget": budget,
+            "raw_tokens": raw_tokens,
+            "chunks": chunks,
+            "trimmed": trimmed,
+            "dropped": dropped,
+            "deduped_sentences": deduped
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "tokenizer": self.counter.name,
+            "budget": self.budget,
+            "packs": self.packs,
+            "avg_tokens": round(self.tokens_used / self.packs, 1) if self.packs else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "chunks_trimmed": self.chunks_trimmed,
+            "chunks_dropped": self.chunks_dropped,
+            "sentences_deduped": self.sentences_deduped
+        }
+
+
+# 创建全局实例
+context_packer = ContextPacker()
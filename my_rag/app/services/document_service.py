@@ -2,7 +2,7 @@
 文档处理服务（加载、切分、向量化）
 """
 import os
-from typing import List
+from typing import List, Optional
 from pathlib import Path
 import PyPDF2
 from app.services.milvus_service import milvus_service
@@ -84,7 +84,14 @@ class DocumentService:
         except Exception as e:
             raise Exception(f"TXT读取失败: {str(e)}")
     
-    def process_and_index(self, file_path: str, document_id: int, db: Session):
+    def process_and_index(
+        self,
+        file_path: str,
+        document_id: int,
+        db: Session,
+        tenant_id: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ):
         """
         处理文档并索引到 Milvus 和 Elasticsearch
         
@@ -92,6 +99,8 @@ class DocumentService:
             file_path: 文件路径
             document_id: 文档ID
             db: 数据库会话
+            tenant_id: 租户ID（默认读配置）
+            tags: 文档标签，用于检索过滤
         """
         # 更新文档状态为处理中
         doc = db.query(Document).filter(Document.id == document_id).first()
@@ -113,15 +122,23 @@ class DocumentService:
             chunks = self.split_text(content)
             
             # 1. 插入到 Milvus（向量检索）
-            metadatas = [{"document_id": document_id} for _ in chunks]
+            tenant_id = tenant_id or settings.DEFAULT_TENANT_ID
+            metadatas = [
+                {"document_id": document_id, "chunk_id": idx, "tenant_id": tenant_id, "tags": tags or []}
+                for idx in range(len(chunks))
+            ]
             milvus_service.insert_chunks(chunks, metadatas)
             
             # 2. 插入到 Elasticsearch（关键词检索）
             from app.services.elasticsearch_service import es_service
             if es_service.enabled:
-                es_count = es_service.index_documents_bulk(chunks, document_id)
+                es_count = es_service.index_documents_bulk(chunks, document_id, tenant_id, tags)
                 print(f"✅ ES 索引完成: {es_count} 条")
             
+            # 3. 知识库已变化，递增版本号使缓存答案失效
+            from app.services.cache_service import cache_service
+            cache_service.bump_kb_version()
+            
             # 更新文档状态和块数量
             if doc:
                 doc.chunk_count = len(chunks)
@@ -136,6 +153,27 @@ class DocumentService:
                 doc.status = "failed"
                 db.commit()
             raise Exception(f"文档处理失败: {str(e)}")
+    
+    def delete_from_index(self, document_id: int) -> int:
+        """
+        从 Milvus 和 Elasticsearch 中删除文档的所有块
+        
+        Args:
+            document_id: 文档ID
+        
+        Returns:
+            删除的向量数量
+        """
+        deleted = milvus_service.delete_by_document_id(document_id)
+        
+        from app.services.elasticsearch_service import es_service
+        if es_service.enabled:
+            es_service.delete_by_document_id(document_id)
+        
+        # 知识库已变化，递增版本号使缓存答案失效
+        from app.services.cache_service import cache_service
+        cache_service.bump_kb_version()
+        return deleted
 
 # 创建全局实例
 document_service = DocumentService()
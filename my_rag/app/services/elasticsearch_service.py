@@ -5,6 +5,7 @@ Elasticsearch 服务
 from typing import List, Dict, Any, Optional
 from elasticsearch import Elasticsearch
 from app.config import settings
+from app.services.search_filter import SearchFilter
 
 class ElasticsearchService:
     """Elasticsearch 关键词检索服务"""
@@ -16,7 +17,7 @@ class ElasticsearchService:
             self.es_client = Elasticsearch(
                 hosts=[f"http://{settings.ES_HOST}:{settings.ES_PORT}"],
                 verify_certs=False,
-                request_timeout=30,
+                request_timeout=settings.ES_REQUEST_TIMEOUT,
                 # 兼容性设置：使用 v8 API
                 headers={"Accept": "application/vnd.elasticsearch+json; compatible-with=8"}
             )
@@ -57,6 +58,12 @@ class ElasticsearchService:
                             "chunk_id": {
                                 "type": "integer"
                             },
+                            "tenant_id": {
+                                "type": "keyword"
+                            },
+                            "tags": {
+                                "type": "keyword"
+                            },
                             "created_at": {
                                 "type": "date"
                             }
@@ -128,7 +135,9 @@ class ElasticsearchService:
     def index_documents_bulk(
         self,
         chunks: List[str],
-        document_id: int
+        document_id: int,
+        tenant_id: Optional[str] = None,
+        tags: Optional[List[str]] = None
     ) -> int:
         """
         批量索引文档
@@ -136,6 +145,8 @@ class ElasticsearchService:
         Args:
             chunks: 文档块列表
             document_id: 文档ID
+            tenant_id: 租户ID（默认读配置）
+            tags: 文档标签
         
         Returns:
             成功索引的数量
@@ -158,6 +169,8 @@ class ElasticsearchService:
                     "content": chunk,
                     "document_id": document_id,
                     "chunk_id": idx,
+                    "tenant_id": tenant_id or settings.DEFAULT_TENANT_ID,
+                    "tags": tags or [],
                     "created_at": self._get_timestamp()
                 })
             
@@ -178,7 +191,9 @@ class ElasticsearchService:
     def search(
         self,
         query: str,
-        top_k: int = 5
+        top_k: int = 5,
+        filters: Optional[SearchFilter] = None,
+        request_timeout: Optional[float] = None
     ) -> List[Dict[str, Any]]:
         """
         关键词搜索（BM25）
@@ -186,6 +201,8 @@ class ElasticsearchService:
         Args:
             query: 查询文本
             top_k: 返回结果数量
+            filters: 过滤条件，作为 bool.filter 子句下推（不影响 BM25 打分）
+            request_timeout: 本次请求超时（秒），默认使用客户端配置
         
         Returns:
             搜索结果列表
@@ -194,39 +211,102 @@ class ElasticsearchService:
             return []
         
         try:
-            # BM25 搜索
-            search_body = {
-                "query": {
-                    "match": {
-                        "content": {
-                            "query": query,
-                            "operator": "or"
-                        }
-                    }
-                },
-                "size": top_k,
-                "_source": ["content", "document_id", "chunk_id"]
-            }
-            
-            response = self.es_client.search(
+            client = self.es_client
+            if request_timeout is not None:
+                client = client.options(request_timeout=request_timeout)
+            response = client.search(
                 index=self.index_name,
-                body=search_body
+                body=self._build_search_body(query, top_k, filters)
             )
-            
-            # 格式化结果
-            results = []
-            for hit in response['hits']['hits']:
-                results.append({
-                    "content": hit['_source']['content'],
-                    "score": hit['_score'],
-                    "document_id": hit['_source'].get('document_id'),
-                    "chunk_id": hit['_source'].get('chunk_id')
-                })
-            
-            return results
+            return self._format_hits(response)
         except Exception as e:
             print(f"❌ ES 搜索失败: {str(e)}")
             return []
+
+    def msearch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filters: Optional[SearchFilter] = None,
+        request_timeout: Optional[float] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量关键词搜索：N 个查询合并为一次 _msearch 请求
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的结果数量
+            filters: 过滤条件（对所有查询生效）
+            request_timeout: 本次请求超时（秒），默认使用客户端配置
+
+        Returns:
+            与 queries 一一对应的搜索结果列表（单个查询失败时为空列表）
+        """
+        if not self.enabled or not queries:
+            return [[] for _ in queries]
+
+        try:
+            searches: List[Dict[str, Any]] = []
+            for query in queries:
+                searches.append({"index": self.index_name})
+                searches.append(self._build_search_body(query, top_k, filters))
+
+            client = self.es_client
+            if request_timeout is not None:
+                client = client.options(request_timeout=request_timeout)
+            response = client.msearch(searches=searches)
+
+            results = []
+            for item in response['responses']:
+                if 'error' in item:
+                    print(f"❌ ES 批量搜索子查询失败: {item['error']}")
+                    results.append([])
+                else:
+                    results.append(self._format_hits(item))
+            return results
+        except Exception as e:
+            print(f"❌ ES 批量搜索失败: {str(e)}")
+            return [[] for _ in queries]
+
+    def _build_search_body(
+        self,
+        query: str,
+        top_k: int,
+        filters: Optional[SearchFilter] = None
+    ) -> Dict[str, Any]:
+        """构造 BM25 查询体"""
+        match_query = {
+            "match": {
+                "content": {
+                    "query": query,
+                    "operator": "or"
+                }
+            }
+        }
+        if filters:
+            match_query = {
+                "bool": {
+                    "must": [match_query],
+                    "filter": filters.to_es_filter()
+                }
+            }
+        return {
+            "query": match_query,
+            "size": top_k,
+            "_source": ["content", "document_id", "chunk_id"]
+        }
+
+    def _format_hits(self, response: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """格式化搜索响应"""
+        results = []
+        for hit in response['hits']['hits']:
+            results.append({
+                "content": hit['_source']['content'],
+                "score": hit['_score'],
+                "document_id": hit['_source'].get('document_id'),
+                "chunk_id": hit['_source'].get('chunk_id')
+            })
+        return results
     
     def delete_by_document_id(self, document_id: int) -> int:
         """
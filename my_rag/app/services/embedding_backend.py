@@ -0,0 +1,251 @@
+"""
+向量模型推理后端
+- torch：PyTorch SentenceTransformer（参考实现）
+- onnx：导出的 ONNX Runtime 计算图
+- onnx-int8：动态 int8 量化后的 ONNX 计算图（CPU 上延迟和内存约减半）
+
+所有后端统一输出 L2 归一化的 float32 向量，非 torch 后端加载后与参考实现
+做余弦一致性校验，不达标则回退到 torch 后端。
+
+ONNX 依赖可选：pip install -r requirements-onnx.txt
+"""
+import os
+from contextlib import contextmanager
+from typing import Callable, List
+
+import numpy as np
+
+from app.config import settings
+
+MODEL_NAME = 'bge-small-zh-v1.5'
+
+# 一致性校验样本（中英混合，覆盖长短句）
+VALIDATION_TEXTS = [
+    "什么是检索增强生成？",
+    "Milvus 是一个开源的向量数据库，支持海量向量的相似度检索。",
+    "How does hybrid search combine BM25 and dense retrieval?",
+    "今天天气很好",
+    "Python 是一种解释型、面向对象、动态数据类型的高级程序设计语言，由 Guido van Rossum 于 1989 年底发明。",
+]
+
+
+def resolve_model_path() -> str:
+    """优先使用本地模型路径，避免网络下载"""
+    local_model_path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+        'models', MODEL_NAME
+    )
+    if os.path.exists(local_model_path):
+        print(f"✅ 使用本地嵌入模型: {local_model_path}")
+        return local_model_path
+    print("⚠️  本地模型不存在，尝试从 Hugging Face 下载")
+    return f'BAAI/{MODEL_NAME}'
+
+
+@contextmanager
+def _file_lock(path: str):
+    """跨进程文件锁（多个 uvicorn worker 同时首次加载时只有一个生成模型文件）"""
+    with open(path, 'a') as f:
+        try:
+            import fcntl
+        except ImportError:
+            # Windows 无 flock：只依赖临时文件 + 原子替换，最坏情况重复生成
+            yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_once(path: str, build: Callable[[str], None]):
+    """
+    模型文件不存在时生成：先写临时文件再 os.replace，多进程间用文件锁串行，
+    其它进程不会读到写了一半的文件
+
+    Args:
+        path: 目标文件路径
+        build: 生成函数，参数为临时文件路径
+    """
+    if os.path.exists(path):
+        return
+    with _file_lock(path + '.lock'):
+        if os.path.exists(path):
+            return  # 等锁期间已由其它进程生成
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            build(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+class TorchEmbeddingBackend:
+    """PyTorch SentenceTransformer 后端"""
+
+    name = "torch"
+
+    def __init__(self, model_path: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(
+            model_path,
+            device='cpu',
+            trust_remote_code=True
+        )
+        self.tokenizer = self.model.tokenizer
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """编码文本列表，返回 [n, dim] 的归一化 float32 矩阵"""
+        vectors = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class OnnxEmbeddingBackend:
+    """ONNX Runtime 后端（可选动态 int8 量化）"""
+
+    def __init__(self, model_path: str, quantize: bool = False):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.name = "onnx-int8" if quantize else "onnx"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+
+        onnx_dir = settings.EMBEDDING_ONNX_DIR or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            'models', f'{MODEL_NAME}-onnx'
+        )
+        os.makedirs(onnx_dir, exist_ok=True)
+        fp32_path = os.path.join(onnx_dir, 'model.onnx')
+        int8_path = os.path.join(onnx_dir, 'model-int8.onnx')
+
+        build_once(fp32_path, lambda tmp_path: self._export(model_path, tmp_path))
+        onnx_path = fp32_path
+        if quantize:
+            build_once(int8_path, lambda tmp_path: self._quantize(fp32_path, tmp_path))
+            onnx_path = int8_path
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if settings.EMBEDDING_ONNX_THREADS > 0:
+            options.intra_op_num_threads = settings.EMBEDDING_ONNX_THREADS
+        self.session = ort.InferenceSession(
+            onnx_path,
+            sess_options=options,
+            providers=['CPUExecutionProvider']
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        print(f"✅ ONNX 向量模型加载完成: {onnx_path}")
+
+    def _export(self, model_path: str, onnx_path: str):
+        """从 HF 权重导出 ONNX 计算图（仅首次）"""
+        import torch
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(model_path)
+        model.eval()
+        dummy = self.tokenizer(["导出样例"], return_tensors='pt')
+        input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+        dynamic_axes = {name: {0: 'batch', 1: 'seq'} for name in input_names}
+        dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'seq'}
+
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (dummy['input_ids'], dummy['attention_mask'], dummy['token_type_ids']),
+                onnx_path,
+                input_names=input_names,
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=14
+            )
+        print(f"✅ 已导出 ONNX 模型: {onnx_path}")
+
+    @staticmethod
+    def _quantize(fp32_path: str, int8_path: str):
+        """动态 int8 量化（仅首次）"""
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"✅ 已生成 int8 量化模型: {int8_path}")
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """编码文本列表，返回 [n, dim] 的归一化 float32 矩阵（BGE 使用 CLS 池化）"""
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            features = self.tokenizer(
+                texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=512,
+                return_tensors='np'
+            )
+            feed = {k: v.astype(np.int64) for k, v in features.items() if k in self._input_names}
+            last_hidden_state = self.session.run(None, feed)[0]
+            outputs.append(last_hidden_state[:, 0])
+        return _l2_normalize(np.concatenate(outputs).astype(np.float32))
+
+
+def validate_backend(backend, reference, texts: List[str] = VALIDATION_TEXTS) -> float:
+    """
+    与参考后端逐条比较余弦相似度
+
+    Returns:
+        最小余弦相似度
+    """
+    got = backend.encode(texts)
+    expected = reference.encode(texts)
+    return float(np.min(np.sum(got * expected, axis=1)))
+
+
+def load_embedding_backend(name: str = None):
+    """
+    按配置加载向量模型后端
+
+    Args:
+        name: torch / onnx / onnx-int8，默认读配置
+
+    Returns:
+        后端实例；非 torch 后端加载或校验失败时回退到 torch
+    """
+    name = (name or settings.EMBEDDING_BACKEND).lower()
+    model_path = resolve_model_path()
+
+    if name == "torch":
+        return TorchEmbeddingBackend(model_path)
+
+    if name not in ("onnx", "onnx-int8"):
+        print(f"⚠️  未知的向量模型后端 {name}，使用 torch")
+        return TorchEmbeddingBackend(model_path)
+
+    try:
+        backend = OnnxEmbeddingBackend(model_path, quantize=(name == "onnx-int8"))
+    except Exception as e:
+        print(f"⚠️  {name} 后端加载失败，回退到 torch: {e}")
+        return TorchEmbeddingBackend(model_path)
+
+    if settings.EMBEDDING_BACKEND_VALIDATE:
+        reference = TorchEmbeddingBackend(model_path)
+        min_cosine = validate_backend(backend, reference)
+        if min_cosine < settings.EMBEDDING_VALIDATION_MIN_COSINE:
+            print(
+                f"⚠️  {name} 后端与参考实现偏差过大 (min cosine={min_cosine:.4f} < "
+                f"{settings.EMBEDDING_VALIDATION_MIN_COSINE})，回退到 torch"
+            )
+            return reference
+        print(f"✅ {name} 后端一致性校验通过 (min cosine={min_cosine:.4f})")
+        del reference
+
+    return backend
@@ -0,0 +1,150 @@
+"""
+查询向量缓存
+L1：进程内 LRU；L2（可选）：Redis，存储紧凑的 float32 字节串
+
+缓存键 = 模型标识 + 归一化文本，重复查询直接跳过模型前向计算
+"""
+import hashlib
+import re
+import unicodedata
+from array import array
+from typing import Any, Dict, List, Optional
+
+import redis
+
+from app.config import settings
+from app.services.local_cache import LRUCache
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """归一化查询文本：NFKC（全角转半角等）+ 折叠空白"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """两级查询向量缓存"""
+
+    KEY_PREFIX = "rag:emb:"
+
+    def __init__(self, model_id: str):
+        """
+        Args:
+            model_id: 向量模型标识，模型或维度变化时缓存自动失效
+        """
+        self.model_id = model_id
+        self.enabled = settings.EMBEDDING_CACHE_ENABLED
+        self.local = LRUCache(settings.EMBEDDING_CACHE_SIZE)
+        self.ttl = settings.EMBEDDING_CACHE_TTL
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+        # Redis 二级缓存（可选），连接失败时仅使用进程内缓存
+        self.redis_client = None
+        if self.enabled and settings.EMBEDDING_CACHE_REDIS_ENABLED:
+            try:
+                client = redis.Redis(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=settings.REDIS_DB,
+                    decode_responses=False,
+                    socket_connect_timeout=5
+                )
+                client.ping()
+                self.redis_client = client
+                print("✅ 向量缓存 Redis 二级缓存已启用")
+            except Exception as e:
+                print(f"⚠️  向量缓存 Redis 连接失败，仅使用进程内缓存: {str(e)}")
+
+    def _make_key(self, text: str) -> str:
+        """生成缓存键"""
+        content = f"{self.model_id}\x00{normalize_text(text)}"
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """
+        读取缓存向量
+
+        Args:
+            text: 查询文本
+
+        Returns:
+            向量列表，未命中返回 None
+        """
+        if not self.enabled:
+            return None
+
+        key = self._make_key(text)
+        vec = self.local.get(key)
+        if vec is not None:
+            return list(vec)
+
+        if self.redis_client is None:
+            return None
+
+        try:
+            raw = self.redis_client.get(self.KEY_PREFIX + key)
+        except Exception as e:
+            print(f"⚠️  向量缓存读取失败: {str(e)}")
+            return None
+
+        if raw is None:
+            self.redis_misses += 1
+            return None
+
+        self.redis_hits += 1
+        vec = array('f')
+        vec.frombytes(raw)
+        vec = vec.tolist()
+        self.local.set(key, tuple(vec))
+        return vec
+
+    def set(self, text: str, vec: List[float]):
+        """
+        写入缓存向量
+
+        Args:
+            text: 查询文本
+            vec: 向量
+        """
+        if not self.enabled:
+            return
+
+        key = self._make_key(text)
+        self.local.set(key, tuple(vec))
+
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.setex(self.KEY_PREFIX + key, self.ttl, array('f', vec).tobytes())
+        except Exception as e:
+            print(f"⚠️  向量缓存写入失败: {str(e)}")
+
+    def clear(self) -> int:
+        """清空进程内缓存（Redis 条目依赖 TTL 过期）"""
+        return self.local.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计：命中 = L1 命中 + L2 命中，未命中 = 两级均未命中"""
+        local_stats = self.local.stats()
+        hits = local_stats["hits"] + self.redis_hits
+        if self.redis_client is not None:
+            misses = self.redis_misses
+        else:
+            misses = local_stats["misses"]
+        total = hits + misses
+        return {
+            "enabled": self.enabled,
+            "model_id": self.model_id,
+            "hits": hits,
+            "misses": misses,
+            "evictions": local_stats["evictions"],
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "local": local_stats,
+            "redis": {
+                "enabled": self.redis_client is not None,
+                "hits": self.redis_hits,
+                "misses": self.redis_misses
+            }
+        }
@@ -2,16 +2,32 @@
 混合检索服务
 结合向量检索（Milvus）和关键词检索（Elasticsearch）
 
-流水线：多路召回（扩量）→ RRF 融合 → Rerank 精排 → 阈值过滤 → 截断 TopK
+流水线：多路召回（扩量，并行 + 单路超时）→ RRF 融合 → 级联精排（RRF 提前退出 / 向量粗筛
+→ Cross-Encoder）→ 阈值过滤 → 截断 TopK
 """
-from typing import List, Dict, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, List, Dict, Any, Hashable, Optional, Tuple, Union
 
+import numpy as np
+
+from app.services.candidate import Candidate, CandidateSet, candidate_key, needs_content_key
+from app.services.context_packer import EMPTY_CONTEXT, context_packer
 from app.services.milvus_service import milvus_service
 from app.services.elasticsearch_service import es_service
+from app.services.rerank_cascade import RerankCascade
 from app.services.rerank_service import rerank_service
+from app.services.search_filter import SearchFilter
 from app.config import settings
 
 
+def _as_dict(result: Union[Candidate, Dict[str, Any]]) -> Dict[str, Any]:
+    """候选记录转为对外输出的字典（rerank_score 由精排阶段重新写入）"""
+    row = result.to_dict() if isinstance(result, Candidate) else dict(result)
+    row.pop('rerank_score', None)
+    return row
+
+
 class HybridSearchService:
     """混合检索服务"""
 
@@ -19,6 +35,71 @@ class HybridSearchService:
         self.milvus = milvus_service
         self.es = es_service
         self.rerank = rerank_service
+        # 多路召回线程池：各路并行，召回延迟取决于最慢一路（且不超过其超时）
+        self._recall_pool = ThreadPoolExecutor(
+            max_workers=settings.RECALL_POOL_SIZE,
+            thread_name_prefix="recall"
+        )
+
+    def _run_routes(
+        self,
+        routes: Dict[str, Tuple[Callable[[], Any], float]],
+        empty: Callable[[], Any],
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        并行执行多路召回，每路有独立的超时
+
+        Args:
+            routes: {路名: (召回函数, 超时毫秒)}
+            empty: 某路超时或失败时的替代结果工厂
+
+        Returns:
+            (各路结果, 元信息)；元信息含每路状态 / 耗时，以及被丢弃的路名列表
+        """
+        start = time.perf_counter()
+        meta: Dict[str, Any] = {"routes": {}, "dropped_routes": []}
+
+        if not settings.RECALL_PARALLEL_ENABLED:
+            results = {}
+            for name, (func, _) in routes.items():
+                route_start = time.perf_counter()
+                results[name] = func()
+                meta["routes"][name] = {
+                    "status": "ok",
+                    "latency_ms": round((time.perf_counter() - route_start) * 1000, 1)
+                }
+            return results, meta
+
+        futures = {
+            name: (self._recall_pool.submit(func), timeout_ms)
+            for name, (func, timeout_ms) in routes.items()
+        }
+
+        results = {}
+        for name, (future, timeout_ms) in futures.items():
+            # 超时从统一起点算起，先等的路不会挤占后等的路的时间
+            remaining = max(0.0, timeout_ms / 1000 - (time.perf_counter() - start))
+            try:
+                results[name] = future.result(timeout=remaining)
+                status = "ok"
+            except FutureTimeoutError:
+                results[name] = empty()
+                status = "timeout"
+            except Exception as e:
+                print(f"⚠️  召回路 {name} 失败: {e}")
+                results[name] = empty()
+                status = "error"
+
+            meta["routes"][name] = {
+                "status": status,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 1)
+            }
+            if status != "ok":
+                meta["dropped_routes"].append(name)
+
+        if meta["dropped_routes"]:
+            print(f"⏱️  召回路被丢弃: {meta['dropped_routes']}，使用已返回的结果融合")
+        return results, meta
 
     def hybrid_search(
         self,
@@ -26,6 +107,9 @@ class HybridSearchService:
         top_k: int = 5,
         vector_weight: Optional[float] = None,
         keyword_weight: Optional[float] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        cascade: Optional[RerankCascade] = None,
     ) -> List[Dict[str, Any]]:
         """
         混合检索：向量 + 关键词 → RRF 融合 → Rerank 精排
@@ -35,64 +119,313 @@ class HybridSearchService:
             top_k: 最终返回结果数
             vector_weight: 向量检索权重（默认读配置）
             keyword_weight: 关键词检索权重（默认读配置）
+            search_params: 向量检索的索引参数（如 {"ef": 128}），覆盖配置值
+            filters: 过滤条件（文档 ID / 租户 / 标签），两路召回均在服务端过滤
+            cascade: 级联精排参数（粗筛数 / 跳过精排的 RRF 分差），默认读配置
 
         Returns:
             精排后的结果列表
         """
+        return self.hybrid_search_detailed(
+            query,
+            top_k=top_k,
+            vector_weight=vector_weight,
+            keyword_weight=keyword_weight,
+            search_params=search_params,
+            filters=filters,
+            cascade=cascade,
+        )["results"]
+
+    def hybrid_search_detailed(
+        self,
+        query: str,
+        top_k: int = 5,
+        vector_weight: Optional[float] = None,
+        keyword_weight: Optional[float] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        cascade: Optional[RerankCascade] = None,
+    ) -> Dict[str, Any]:
+        """
+        混合检索（带元信息），参数同 hybrid_search
+
+        Returns:
+            {"results": 精排结果, "meta": {"routes": 各路状态与耗时, "dropped_routes": 超时/失败的路,
+                                          "rerank": 精排各级执行情况}}
+        """
         if vector_weight is None:
             vector_weight = settings.VECTOR_WEIGHT
         if keyword_weight is None:
             keyword_weight = settings.KEYWORD_WEIGHT
 
-        # 1. 多路召回（扩量：用 RECALL_TOP_K，而非 top_k*2）
+        # 1. 多路召回（扩量：用 RECALL_TOP_K，而非 top_k*2；并行 + 单路超时）
         recall_k = settings.RECALL_TOP_K
-        vector_results = self.milvus.search(query, top_k=recall_k)
-        keyword_results = []
+        vector_timeout = settings.VECTOR_RECALL_TIMEOUT_MS
+        keyword_timeout = settings.KEYWORD_RECALL_TIMEOUT_MS
+        routes = {
+            "vector": (
+                lambda: self.milvus.search(
+                    query, top_k=recall_k, search_params=search_params, filters=filters,
+                    timeout=vector_timeout / 1000
+                ),
+                vector_timeout,
+            )
+        }
         if self.es.enabled:
-            keyword_results = self.es.search(query, top_k=recall_k)
+            routes["keyword"] = (
+                lambda: self.es.search(
+                    query, top_k=recall_k, filters=filters, request_timeout=keyword_timeout / 1000
+                ),
+                keyword_timeout,
+            )
+        recalled, meta = self._run_routes(routes, empty=list)
 
         # 2. RRF 融合
         fused_results = self._reciprocal_rank_fusion(
-            vector_results,
-            keyword_results,
+            recalled.get("vector", []),
+            recalled.get("keyword", []),
             vector_weight,
             keyword_weight,
         )
 
-        # 3. Rerank 精排 + 截断（rerank 内部含阈值过滤）
-        return self._finalize(query, fused_results, top_k)
+        # 3. 级联精排 + 截断（rerank 内部含阈值过滤）
+        results = self._finalize(query, fused_results, top_k, cascade=cascade, meta=meta)
+        return {"results": results, "meta": meta}
+
+    def hybrid_search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        vector_weight: Optional[float] = None,
+        keyword_weight: Optional[float] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        批量混合检索：N 个查询共用一次向量批量检索和一次 ES _msearch
+
+        Args:
+            queries: 查询文本列表
+            其余参数同 hybrid_search
+
+        Returns:
+            与 queries 一一对应的精排结果列表
+        """
+        return self.hybrid_search_batch_detailed(
+            queries,
+            top_k=top_k,
+            vector_weight=vector_weight,
+            keyword_weight=keyword_weight,
+            search_params=search_params,
+            filters=filters,
+        )["results"]
+
+    def hybrid_search_batch_detailed(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        vector_weight: Optional[float] = None,
+        keyword_weight: Optional[float] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+    ) -> Dict[str, Any]:
+        """
+        批量混合检索（带元信息），参数同 hybrid_search_batch
+
+        超时随查询数放宽：单查询超时 + (N-1) × RECALL_BATCH_TIMEOUT_PER_QUERY_MS，
+        并下推到 Milvus / ES，超时的请求在服务端放弃，不会一直占用召回线程
+
+        Returns:
+            {"results": 与 queries 一一对应的精排结果, "meta": {"routes", "dropped_routes"}}
+        """
+        if not queries:
+            return {"results": [], "meta": {"routes": {}, "dropped_routes": []}}
+        if vector_weight is None:
+            vector_weight = settings.VECTOR_WEIGHT
+        if keyword_weight is None:
+            keyword_weight = settings.KEYWORD_WEIGHT
+
+        recall_k = settings.RECALL_TOP_K
+        extra_timeout = settings.RECALL_BATCH_TIMEOUT_PER_QUERY_MS * (len(queries) - 1)
+        vector_timeout = settings.VECTOR_RECALL_TIMEOUT_MS + extra_timeout
+        keyword_timeout = settings.KEYWORD_RECALL_TIMEOUT_MS + extra_timeout
+        routes = {
+            "vector": (
+                lambda: self.milvus.search_batch(
+                    queries, top_k=recall_k, search_params=search_params, filters=filters,
+                    timeout=vector_timeout / 1000
+                ),
+                vector_timeout,
+            )
+        }
+        if self.es.enabled:
+            routes["keyword"] = (
+                lambda: self.es.msearch(
+                    queries, top_k=recall_k, filters=filters, request_timeout=keyword_timeout / 1000
+                ),
+                keyword_timeout,
+            )
+        recalled, meta = self._run_routes(routes, empty=lambda: [[] for _ in queries])
+        vector_batches = recalled["vector"]
+        keyword_batches = recalled.get("keyword") or [[] for _ in queries]
+
+        results = []
+        for query, vector_results, keyword_results in zip(queries, vector_batches, keyword_batches):
+            fused_results = self._reciprocal_rank_fusion(
+                vector_results,
+                keyword_results,
+                vector_weight,
+                keyword_weight,
+            )
+            results.append(self._finalize(query, fused_results, top_k))
+        return {"results": results, "meta": meta}
 
     def _finalize(
         self,
         query: str,
-        candidates: List[Dict[str, Any]],
+        candidates: Union[CandidateSet, List[Dict[str, Any]]],
         top_k: int,
+        cascade: Optional[RerankCascade] = None,
+        meta: Optional[Dict[str, Any]] = None,
     ) -> List[Dict[str, Any]]:
         """
-        对候选结果做 Rerank 精排或直接截断
-
-        - 开启 rerank 且模型可用：Cross-Encoder 精排 + 概率阈值过滤
+        对候选结果做级联精排或直接截断
+
+        - 开启 rerank 且模型可用：
+          1. 两路召回都把同一候选排第一、RRF 分差达到阈值，且其向量相似度不低于
+             VECTOR_DISTANCE_THRESHOLD：按 RRF 顺序返回（向量相似度低于该下限的候选同样剔除），
+             不调用 Cross-Encoder
+          2. 候选数超过粗筛数：按 bi-encoder 余弦相似度保留前 shortlist 个（保持 RRF 顺序）
+          3. Cross-Encoder 精排 + 概率阈值过滤
         - 否则：直接截断 top_k（RRF 分数无量纲，不做阈值过滤）
+
+        Args:
+            cascade: 级联精排参数，默认读配置
+            meta: 传入时写入 meta["rerank"]（执行的阶段、候选数、粗筛数、RRF 分差、是否提前退出）
         """
         if not candidates:
             return []
 
-        if self.rerank.enabled and self.rerank.model is not None:
-            docs = [r.get('content', '') for r in candidates]
-            reranked = self.rerank.rerank(query, docs, top_k=top_k)
-
-            # 合并原始元信息（document_id 等），保留 rerank_score
-            meta_by_content = {r.get('content', ''): r for r in candidates}
-            merged: List[Dict[str, Any]] = []
-            for item in reranked:
-                base = meta_by_content.get(item['content'], {})
-                row = {k: v for k, v in base.items() if k != 'rerank_score'}
-                row['content'] = item['content']
-                row['rerank_score'] = item['rerank_score']
-                merged.append(row)
-            return merged
-
-        return candidates[:top_k]
+        cascade = cascade or RerankCascade()
+        report: Dict[str, Any] = {
+            "stages": ["rrf" if isinstance(candidates, CandidateSet) else "vector"],
+            "candidates": len(candidates),
+        }
+        if meta is not None:
+            meta["rerank"] = report
+
+        if not (self.rerank.enabled and self.rerank.model is not None):
+            return [_as_dict(r) for r in candidates[:top_k]]
+
+        positions: Optional[List[int]] = None
+        if cascade.enabled:
+            margin = self._rrf_margin(candidates)
+            if margin is not None:
+                report["rrf_margin"] = round(margin, 4)
+                floor = settings.VECTOR_DISTANCE_THRESHOLD
+                if 0 < cascade.skip_margin <= margin and candidates[0].get('distance', 0.0) >= floor:
+                    # RRF 结果足够确定：省掉 Cross-Encoder；没有精排概率阈值，用向量相似度兜底
+                    report["early_exit"] = True
+                    kept: List[Dict[str, Any]] = []
+                    for candidate in candidates:
+                        if candidate.get('distance', floor) >= floor:
+                            kept.append(_as_dict(candidate))
+                            if len(kept) == top_k:
+                                break
+                    return kept
+            if 0 < cascade.shortlist < len(candidates):
+                positions = self._shortlist(query, candidates, cascade.shortlist)
+                if positions is not None:
+                    report["stages"].append("bi_encoder")
+                    report["shortlist"] = len(positions)
+
+        if positions is None:
+            if isinstance(candidates, CandidateSet):
+                docs = candidates.contents()
+            else:
+                docs = [r.get('content', '') for r in candidates]
+            positions = list(range(len(candidates)))
+        else:
+            docs = [candidates[pos].get('content', '') for pos in positions]
+        report["stages"].append("cross_encoder")
+        reranked = self.rerank.rerank(query, docs, top_k=top_k)
+
+        # 按 rerank 返回的候选下标合并原始元信息（document_id 等），保留 rerank_score
+        by_content = None
+        merged: List[Dict[str, Any]] = []
+        for item in reranked:
+            idx = item.get('index')
+            if idx is not None:
+                base = candidates[positions[idx]]
+            else:
+                # 兼容不返回下标的 rerank 实现
+                if by_content is None:
+                    by_content = {candidates[pos].get('content', ''): candidates[pos] for pos in positions}
+                base = by_content.get(item['content'], {})
+            row = _as_dict(base)
+            row['content'] = item['content']
+            row['rerank_score'] = item['rerank_score']
+            merged.append(row)
+        return merged
+
+    @staticmethod
+    def _rrf_margin(candidates: Union[CandidateSet, List[Dict[str, Any]]]) -> Optional[float]:
+        """
+        RRF 第一名领先第二名的相对分差 (s1 - s2) / s1
+
+        只有两路召回都把该候选排在第一时才有意义；两路第一名不一致、单路召回
+        （含另一路超时）、纯向量路径或候选不足两个时返回 None
+        """
+        if not isinstance(candidates, CandidateSet) or len(candidates) < 2:
+            return None
+        if not candidates.top_agreed():
+            return None
+        first, second = candidates.order[:2].tolist()
+        top = float(candidates.scores[first])
+        if top <= 0:
+            return None
+        return (top - float(candidates.scores[second])) / top
+
+    def _shortlist(
+        self,
+        query: str,
+        candidates: Union[CandidateSet, List[Dict[str, Any]]],
+        size: int,
+    ) -> Optional[List[int]]:
+        """
+        bi-encoder 粗筛：按查询与候选的余弦相似度保留前 size 个
+
+        向量召回到的候选直接复用 Milvus 返回的 COSINE distance；仅关键词召回的候选
+        用向量模型批量编码后计算。编码失败返回 None（全部候选进入 Cross-Encoder）。
+
+        Returns:
+            保留候选在 candidates 中的下标（升序，即保持 RRF 顺序）
+        """
+        similarities = np.empty(len(candidates), dtype=np.float64)
+        missing: List[int] = []
+        for pos, candidate in enumerate(candidates):
+            distance = candidate.get('distance')
+            if distance is None:
+                missing.append(pos)
+            else:
+                similarities[pos] = distance
+
+        if missing:
+            try:
+                query_vec = np.asarray(self.milvus.get_embedding(query), dtype=np.float64)
+                doc_vecs = np.asarray(
+                    self.milvus.get_embeddings([candidates[pos].get('content', '') for pos in missing]),
+                    dtype=np.float64
+                )
+            except Exception as e:
+                print(f"⚠️  精排粗筛编码失败，全部候选进入 Cross-Encoder: {e}")
+                return None
+            norms = np.linalg.norm(doc_vecs, axis=1) * np.linalg.norm(query_vec)
+            similarities[missing] = doc_vecs @ query_vec / np.maximum(norms, 1e-12)
+
+        keep = np.argpartition(-similarities, size - 1)[:size]
+        keep.sort()
+        return keep.tolist()
 
     def _reciprocal_rank_fusion(
         self,
@@ -101,10 +434,15 @@ class HybridSearchService:
         vector_weight: float = 0.6,
         keyword_weight: float = 0.4,
         k: int = 60,
-    ) -> List[Dict[str, Any]]:
+    ) -> CandidateSet:
         """
         RRF（Reciprocal Rank Fusion）算法融合结果
 
+        候选以 (document_id, chunk_id) 为键去重（任一路有缺 chunk_id 的旧数据时，
+        两路统一按 (document_id, 内容) 去重），每路召回转换为候选下标数组，
+        用 NumPy 一次性累加各路的 weight / (k + rank) 并排序；结果为数组化的
+        CandidateSet，只引用召回结果、不逐条拷贝。
+
         Args:
             vector_results: 向量检索结果
             keyword_results: 关键词检索结果
@@ -113,45 +451,63 @@ class HybridSearchService:
             k: RRF 平滑常数
 
         Returns:
-            融合后的结果（按 fused_score 降序）
+            融合后的候选集合（按 fused_score 降序）
         """
-        scores: Dict[str, float] = {}
-        contents: Dict[str, Dict[str, Any]] = {}
-
-        # 处理向量检索结果
-        for rank, result in enumerate(vector_results, 1):
-            content = result.get('content', '')
-            if content:
-                rrf_score = vector_weight / (k + rank)
-                scores[content] = scores.get(content, 0) + rrf_score
-                contents[content] = result
-
-        # 处理关键词检索结果
-        for rank, result in enumerate(keyword_results, 1):
-            content = result.get('content', '')
-            if content:
-                rrf_score = keyword_weight / (k + rank)
-                scores[content] = scores.get(content, 0) + rrf_score
-                if content not in contents:
-                    contents[content] = result
-
-        # 按分数排序
-        sorted_contents = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-        # 构建最终结果
-        fused_results: List[Dict[str, Any]] = []
-        for content, score in sorted_contents:
-            result = contents[content].copy()
-            result['fused_score'] = score
-            fused_results.append(result)
-
-        return fused_results
+        index: Dict[Hashable, int] = {}
+        keys: List[Hashable] = []
+        hits: List[Dict[str, Any]] = []
+        others: Dict[int, Dict[str, Any]] = {}
+        positions: List[int] = []
+        contributions: List[np.ndarray] = []
+        route_ranks: List[Tuple[List[int], List[int]]] = []
+        # 任一路有缺 chunk_id 的旧数据：两路统一按 (document_id, 内容) 取键，避免同一片段被拆成两个候选
+        by_content = needs_content_key(vector_results or [], keyword_results or [])
+
+        for results, weight in ((vector_results, vector_weight), (keyword_results, keyword_weight)):
+            if not results:
+                continue
+            valid_ranks: List[int] = []
+            for rank, result in enumerate(results, 1):
+                if not result.get('content'):
+                    continue
+                key = candidate_key(result, by_content)
+                pos = index.get(key)
+                if pos is None:
+                    pos = index[key] = len(hits)
+                    keys.append(key)
+                    hits.append(result)
+                elif pos not in others and result is not hits[pos]:
+                    others[pos] = result
+                positions.append(pos)
+                valid_ranks.append(rank)
+            contributions.append(weight / (k + np.asarray(valid_ranks, dtype=np.float64)))
+            route_ranks.append((positions[len(positions) - len(valid_ranks):], valid_ranks))
+
+        if not hits:
+            return CandidateSet([], [], {}, np.zeros(0), np.zeros(0, dtype=np.int64))
+
+        # 各路贡献按候选下标累加（bincount 为向量化的 scatter-add），再按分数降序
+        scores = np.bincount(
+            np.asarray(positions, dtype=np.int64),
+            weights=np.concatenate(contributions),
+            minlength=len(hits)
+        )
+        order = np.argsort(-scores, kind='stable')
+        # 每路名次（供级联精排判断两路第一名是否一致）；同一路重复命中保留最靠前的名次
+        missing = np.iinfo(np.int64).max
+        ranks = np.full((len(route_ranks), len(hits)), missing, dtype=np.int64)
+        for r, (route_positions, valid_ranks) in enumerate(route_ranks):
+            np.minimum.at(ranks[r], route_positions, valid_ranks)
+        ranks[ranks == missing] = 0
+        return CandidateSet(keys, hits, others, scores, order, ranks)
 
     def search_context(
         self,
         query: str,
         top_k: int = 3,
         use_hybrid: bool = True,
+        filters: Optional[SearchFilter] = None,
+        cascade: Optional[RerankCascade] = None,
     ) -> str:
         """
         检索并返回拼接的上下文文本
@@ -160,25 +516,121 @@ class HybridSearchService:
             query: 查询文本
             top_k: 最终返回结果数
             use_hybrid: 是否使用混合检索
+            filters: 过滤条件（文档 ID / 租户 / 标签）
+            cascade: 级联精排参数，默认读配置
 
         Returns:
             拼接后的上下文文本
         """
+        return self.search_context_detailed(
+            query, top_k=top_k, use_hybrid=use_hybrid, filters=filters, cascade=cascade
+        )["context"]
+
+    def search_context_detailed(
+        self,
+        query: str,
+        top_k: int = 3,
+        use_hybrid: bool = True,
+        filters: Optional[SearchFilter] = None,
+        cascade: Optional[RerankCascade] = None,
+    ) -> Dict[str, Any]:
+        """
+        检索上下文（带元信息），参数同 search_context
+
+        Returns:
+            {"context": 拼接后的上下文文本, "dropped_routes": 超时/失败被丢弃的召回路}
+        """
+        dropped: List[str] = []
         if use_hybrid and self.es.enabled:
             # 混合检索：召回扩量 → RRF → Rerank
-            results = self.hybrid_search(query, top_k=top_k)
-            print(f"🔍 混合检索: 返回 {len(results)} 条结果")
+            detailed = self.hybrid_search_detailed(query, top_k=top_k, filters=filters, cascade=cascade)
+            results = detailed["results"]
+            dropped = detailed["meta"]["dropped_routes"]
+            stages = detailed["meta"].get("rerank", {}).get("stages", [])
+            print(
+                f"🔍 混合检索: 返回 {len(results)} 条结果, 精排阶段 {'→'.join(stages)}"
+                + (f" (丢弃召回路: {dropped})" if dropped else "")
+            )
         else:
             # 纯向量召回（扩量）→ rerank / 阈值过滤
             recall_k = settings.RECALL_TOP_K
-            raw = self.milvus.search(query, top_k=recall_k)
-            results = self._vector_finalize(query, raw, top_k)
+            raw = self.milvus.search(query, top_k=recall_k, filters=filters)
+            results = self._vector_finalize(query, raw, top_k, cascade=cascade)
             print(f"🔍 向量检索: 返回 {len(results)} 条结果")
 
+        return {"context": self._format_context(results), "dropped_routes": dropped}
+
+    def search_context_batch(
+        self,
+        queries: List[str],
+        top_k: int = 3,
+        use_hybrid: bool = True,
+        filters: Optional[SearchFilter] = None,
+    ) -> List[str]:
+        """
+        批量检索并返回拼接的上下文文本
+
+        Args:
+            queries: 查询文本列表
+            其余参数同 search_context
+
+        Returns:
+            与 queries 一一对应的上下文文本列表
+        """
+        return self.search_context_batch_detailed(
+            queries, top_k=top_k, use_hybrid=use_hybrid, filters=filters
+        )["contexts"]
+
+    def search_context_batch_detailed(
+        self,
+        queries: List[str],
+        top_k: int = 3,
+        use_hybrid: bool = True,
+        filters: Optional[SearchFilter] = None,
+    ) -> Dict[str, Any]:
+        """
+        批量检索上下文（带元信息），参数同 search_context_batch
+
+        Returns:
+            {"contexts": 与 queries 一一对应的上下文文本, "dropped_routes": 超时/失败被丢弃的召回路}
+        """
+        if not queries:
+            return {"contexts": [], "dropped_routes": []}
+
+        dropped: List[str] = []
+        if use_hybrid and self.es.enabled:
+            detailed = self.hybrid_search_batch_detailed(queries, top_k=top_k, filters=filters)
+            batches = detailed["results"]
+            dropped = detailed["meta"]["dropped_routes"]
+        else:
+            raw_batches = self.milvus.search_batch(queries, top_k=settings.RECALL_TOP_K, filters=filters)
+            batches = [
+                self._vector_finalize(query, raw, top_k)
+                for query, raw in zip(queries, raw_batches)
+            ]
+        print(
+            f"🔍 批量检索: {len(queries)} 个查询"
+            + (f" (丢弃召回路: {dropped})" if dropped else "")
+        )
+
+        return {
+            "contexts": [self._format_context(results) for results in batches],
+            "dropped_routes": dropped
+        }
+
+    def _format_context(self, results: List[Dict[str, Any]]) -> str:
+        """拼接上下文（开启打包时按 token 预算装入，低分片段先被截断 / 丢弃，重叠句子去重）"""
         if not results:
-            return "无相关内容"
+            return EMPTY_CONTEXT
+
+        if context_packer.enabled:
+            packed = context_packer.pack(results)
+            print(
+                f"📦 上下文打包: {len(packed['chunks'])}/{len(results)} 个片段, "
+                f"{packed['tokens']}/{packed['budget']} tokens (原 {packed['raw_tokens']})"
+            )
+            return packed["text"]
 
-        # 拼接上下文
         context_parts = []
         for idx, result in enumerate(results, 1):
             content = result.get('content', '')
@@ -191,18 +643,19 @@ class HybridSearchService:
         query: str,
         candidates: List[Dict[str, Any]],
         top_k: int,
+        cascade: Optional[RerankCascade] = None,
     ) -> List[Dict[str, Any]]:
         """
         纯向量路径收尾：rerank 或 COSINE 阈值过滤
 
-        - 开启 rerank：Cross-Encoder 精排 + 概率阈值（复用 _finalize）
+        - 开启 rerank：（按 distance 粗筛后）Cross-Encoder 精排 + 概率阈值（复用 _finalize）
         - 否则：按 COSINE distance 阈值过滤（方案3，distance 越大越相似）
         """
         if not candidates:
             return []
 
         if self.rerank.enabled and self.rerank.model is not None:
-            return self._finalize(query, candidates, top_k)
+            return self._finalize(query, candidates, top_k, cascade=cascade)
 
         # 无 rerank：COSINE 相似度阈值过滤
         filtered = [
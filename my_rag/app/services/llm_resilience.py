@@ -0,0 +1,305 @@
+"""
+LLM 调用容错
+- 重试：可重试错误（超时、连接错误、429、5xx）按带抖动的指数退避重试
+- 对冲（可选，仅异步接口）：首个请求超过近期延迟分位数仍未返回时，并行发出第二个请求，取先返回者
+- 熔断：滑动时间窗内错误率超过阈值后快速失败，冷却期后放行一个探测请求，成功则恢复
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from app.config import settings
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，请求未发出"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """超时、连接错误、限流和服务端错误可重试；其它 4xx（鉴权、参数错误）不可重试"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+class LatencyTracker:
+    """最近若干次成功调用的延迟，用于计算对冲阈值"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """第 p 百分位延迟（秒），样本不足 20 个时返回 None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 20:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * p / 100))
+        return samples[index]
+
+
+class CircuitBreaker:
+    """
+    熔断器（线程安全，同步 / 异步调用共用）
+
+    - closed：正常放行，记录滑动时间窗内的成功 / 失败
+    - open：错误率超过阈值后进入，冷却期内所有请求快速失败
+    - half_open：冷却期结束后只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(
+        self,
+        failure_rate: float,
+        min_requests: int,
+        window: float,
+        cooldown: float
+    ):
+        """
+        Args:
+            failure_rate: 打开熔断的错误率阈值（0~1）
+            min_requests: 时间窗内请求数达到该值才计算错误率
+            window: 滑动时间窗（秒）
+            cooldown: 打开后的冷却时间（秒）
+        """
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.opened_count = 0
+
+    def _trim(self, now: float):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def allow(self) -> bool:
+        """请求发出前调用，返回是否放行"""
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self._state = "half_open"
+                self._probe_in_flight = False
+            if self._state == "half_open":
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == "half_open":
+                self._state = "closed"
+                self._outcomes.clear()
+            self._outcomes.append((now, True))
+            self._trim(now)
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._state == "half_open":
+                self._open(now)
+                return
+            self._outcomes.append((now, False))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (
+                self._state == "closed"
+                and len(self._outcomes) >= self.min_requests
+                and failures / len(self._outcomes) >= self.failure_rate
+            ):
+                self._open(now)
+
+    def release(self):
+        """探测请求被取消（未得到结果）时释放探测名额"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _open(self, now: float):
+        self._state = "open"
+        self._opened_at = now
+        self._probe_in_flight = False
+        self.opened_count += 1
+        print(f"🔌 LLM 熔断器打开，{self.cooldown:.0f}s 内快速失败")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return self._state
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            total = len(self._outcomes)
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+        return {
+            "state": self.state,
+            "window_requests": total,
+            "window_failures": failures,
+            "failure_rate": round(failures / total, 4) if total else 0.0,
+            "opened_count": self.opened_count,
+            "rejected": self.rejected
+        }
+
+
+class ResilientCaller:
+    """按重试 / 对冲 / 熔断策略执行 LLM 调用"""
+
+    def __init__(self):
+        self.max_attempts = max(1, settings.LLM_RETRY_MAX_ATTEMPTS)
+        self.base_delay = settings.LLM_RETRY_BASE_DELAY
+        self.max_delay = settings.LLM_RETRY_MAX_DELAY
+        self.hedge_enabled = settings.LLM_HEDGE_ENABLED
+        self.hedge_percentile = settings.LLM_HEDGE_PERCENTILE
+        self.hedge_min_delay = settings.LLM_HEDGE_MIN_DELAY
+        self.breaker = CircuitBreaker(
+            failure_rate=settings.LLM_BREAKER_FAILURE_RATE,
+            min_requests=settings.LLM_BREAKER_MIN_REQUESTS,
+            window=settings.LLM_BREAKER_WINDOW,
+            cooldown=settings.LLM_BREAKER_COOLDOWN
+        )
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def before_attempt(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM 服务熔断中，请稍后重试")
+
+    def record(self, error: Optional[BaseException], elapsed: float = 0.0):
+        """记录一次尝试的结果；不可重试的错误（如参数错误）说明上游可用，按成功计入熔断统计"""
+        if error is None:
+            self.breaker.record_success()
+            self.latency.record(elapsed)
+        elif is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        if attempt + 1 >= self.max_attempts or not is_retryable(error):
+            return False
+        self.retries += 1
+        return True
+
+    def call(self, fn: Callable[[], T]) -> T:
+        """同步调用：重试 + 熔断"""
+        attempt = 0
+        while True:
+            self.before_attempt()
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self.record(e)
+                if not self.should_retry(e, attempt):
+                    raise
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.record(None, time.monotonic() - start)
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """异步调用：重试 + 熔断 + 可选对冲"""
+        attempt = 0
+        while True:
+            self.before_attempt()
+            try:
+                return await self._attempt(fn)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record(None, time.monotonic() - start)
+        return result
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        threshold = self.latency.percentile(self.hedge_percentile)
+        return None if threshold is None else max(self.hedge_min_delay, threshold)
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(self._timed(fn))
+        if delay is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        # 首个请求慢于近期延迟分位数：发出对冲请求，取先成功者
+        if not self.breaker.allow():
+            return await primary
+        self.hedges += 1
+        hedge = asyncio.ensure_future(self._timed(fn))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(95)
+        return {
+            "breaker": self.breaker.stats(),
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+        }
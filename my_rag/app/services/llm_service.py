@@ -1,20 +1,161 @@
 """
 LLM 服务统一接口
-支持云端 API 和本地 GPU 模型自动切换
+支持云端 API 和本地 OpenAI 兼容端点（vLLM / Ollama / 离线模拟服务）自动切换
 """
-import requests
-import os
-from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+
 from app.config import settings
+from app.services.llm_resilience import CircuitOpenError, ResilientCaller
+
+NO_CONTEXT_ANSWER = "❌ 未检索到与问题相关的知识库内容"
+
+
+def build_context_prompt(question: str, context: str) -> str:
+    """基于检索上下文的问答提示词"""
+    return f"""基于以下上下文，精准回答问题，答案必须来自上下文，不要编造内容：
+
+上下文：
+{context}
+
+问题：{question}
+
+请基于上下文回答，如果上下文中没有相关信息，请说明无法回答。"""
+
+
+def has_context(context: str) -> bool:
+    return bool(context) and context.strip() != "无相关内容"
+
+
+def degraded_answer(context: str, max_chars: int = 800) -> str:
+    """LLM 熔断时的降级回答：直接返回检索到的上下文摘录"""
+    if not has_context(context):
+        return NO_CONTEXT_ANSWER
+    excerpt = context if len(context) <= max_chars else context[:max_chars] + "…"
+    return f"⚠️ 大模型服务暂时不可用，以下是知识库中与问题相关的内容：\n\n{excerpt}"
+
+
+def _h2_available() -> bool:
+    """HTTP/2 需要可选依赖 h2（pip install httpx[http2]）"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        print("⚠️  未安装 h2，LLM 客户端使用 HTTP/1.1 keep-alive")
+        return False
 
 
 class CloudLLMService:
-    """云端 LLM 服务（智谱AI）"""
+    """
+    云端 LLM 服务（智谱AI）
+
+    长连接池复用 TLS 连接（可选 HTTP/2）；同步接口（线程池 / Agent 调用）与
+    异步接口（FastAPI 处理函数直接 await）各用一个客户端，并发数分别由信号量限制；
+    所有调用经 ResilientCaller 重试 / 熔断，异步非流式调用可选对冲
+    """
+    
+    provider = "智谱AI"
     
     def __init__(self):
         self.api_key = settings.ZHIPU_API_KEY
         self.api_url = settings.ZHIPU_API_URL
         self.model = settings.ZHIPU_MODEL
+        self.http2 = settings.LLM_HTTP2 and _h2_available()
+        self.limits = httpx.Limits(
+            max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_POOL_KEEPALIVE_EXPIRY
+        )
+        # read 为两次读取之间的超时，流式输出时即相邻 token 的最大间隔
+        self.timeout = httpx.Timeout(settings.LLM_READ_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT)
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._semaphore = threading.BoundedSemaphore(settings.LLM_MAX_CONCURRENCY)
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+        self._client_lock = threading.Lock()
+        self.resilience = ResilientCaller()
+    
+    @property
+    def client(self) -> httpx.Client:
+        """同步客户端（懒加载，进程内共享连接池）"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = httpx.Client(
+                        http2=self.http2, limits=self.limits, timeout=self.timeout
+                    )
+        return self._client
+    
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """异步客户端（懒加载，需在事件循环中首次使用）"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                http2=self.http2, limits=self.limits, timeout=self.timeout
+            )
+            self._async_semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        return self._async_client
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+    
+    def _payload(self, messages: List[Dict[str, Any]], temperature: float, **extra) -> Dict[str, Any]:
+        return {"model": self.model, "messages": messages, "temperature": temperature, **extra}
+    
+    @staticmethod
+    def _parse_stream_line(line: str) -> Optional[str]:
+        """
+        解析一行 SSE：每个事件为 "data: {...}"，以 "data: [DONE]" 结束
+        
+        Returns:
+            增量文本；非数据行返回 ""，结束标记返回 None
+        """
+        if not line or not line.startswith("data:"):
+            return ""
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return None
+        choices = json.loads(payload).get("choices") or []
+        return (choices[0].get("delta", {}).get("content") or "") if choices else ""
+    
+    def _post(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        def once() -> Dict[str, Any]:
+            with self._semaphore:
+                response = self.client.post(self.api_url, headers=self._headers(), json=data)
+            response.raise_for_status()
+            return response.json()
+        
+        try:
+            result = self.resilience.call(once)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"{self.provider} API调用失败: {str(e)}")
+        return result["choices"][0]["message"]
+    
+    async def _apost(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        async def once() -> Dict[str, Any]:
+            client = self.async_client
+            async with self._async_semaphore:
+                response = await client.post(self.api_url, headers=self._headers(), json=data)
+            response.raise_for_status()
+            return response.json()
+        
+        try:
+            result = await self.resilience.acall(once)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"{self.provider} API调用失败: {str(e)}")
+        return result["choices"][0]["message"]
     
     def chat(self, prompt: str, temperature: float = 0.1) -> str:
         """
@@ -27,29 +168,105 @@ class CloudLLMService:
         Returns:
             AI生成的回答文本
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        data = self._payload([{"role": "user", "content": prompt}], temperature)
+        return self._post(data)["content"]
+    
+    async def achat(self, prompt: str, temperature: float = 0.1) -> str:
+        """
+        调用智谱AI API生成回答（异步，不占用线程）
         
-        data = {
-            "model": self.model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature
-        }
+        Args:
+            prompt: 输入提示词
+            temperature: 温度参数，控制随机性
         
-        try:
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        except Exception as e:
-            raise Exception(f"智谱AI API调用失败: {str(e)}")
+        Returns:
+            AI生成的回答文本
+        """
+        data = self._payload([{"role": "user", "content": prompt}], temperature)
+        return (await self._apost(data))["content"]
+    
+    def chat_stream(self, prompt: str, temperature: float = 0.1) -> Iterator[str]:
+        """
+        流式调用智谱AI API（stream=True），逐段返回生成的文本
+        
+        Args:
+            prompt: 输入提示词
+            temperature: 温度参数，控制随机性
+        
+        Yields:
+            增量文本片段
+        """
+        data = self._payload([{"role": "user", "content": prompt}], temperature, stream=True)
+        attempt = 0
+        while True:
+            self.resilience.before_attempt()
+            started = False
+            try:
+                with self._semaphore, self.client.stream(
+                    "POST", self.api_url, headers=self._headers(), json=data
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        delta = self._parse_stream_line(line)
+                        if delta is None:
+                            break
+                        if delta:
+                            started = True
+                            yield delta
+                self.resilience.breaker.record_success()
+                return
+            except GeneratorExit:
+                self.resilience.breaker.release()
+                raise
+            except Exception as e:
+                self.resilience.record(e)
+                # 已输出部分内容后不再重试，避免客户端收到重复文本
+                if started or not self.resilience.should_retry(e, attempt):
+                    raise Exception(f"{self.provider} API调用失败: {str(e)}")
+            time.sleep(self.resilience.backoff(attempt))
+            attempt += 1
+    
+    async def achat_stream(self, prompt: str, temperature: float = 0.1) -> AsyncIterator[str]:
+        """
+        流式调用智谱AI API（异步）
+        
+        Args:
+            prompt: 输入提示词
+            temperature: 温度参数，控制随机性
+        
+        Yields:
+            增量文本片段
+        """
+        data = self._payload([{"role": "user", "content": prompt}], temperature, stream=True)
+        attempt = 0
+        while True:
+            self.resilience.before_attempt()
+            started = False
+            try:
+                client = self.async_client
+                async with self._async_semaphore:
+                    async with client.stream(
+                        "POST", self.api_url, headers=self._headers(), json=data
+                    ) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            delta = self._parse_stream_line(line)
+                            if delta is None:
+                                break
+                            if delta:
+                                started = True
+                                yield delta
+                self.resilience.breaker.record_success()
+                return
+            except (GeneratorExit, asyncio.CancelledError):
+                self.resilience.breaker.release()
+                raise
+            except Exception as e:
+                self.resilience.record(e)
+                if started or not self.resilience.should_retry(e, attempt):
+                    raise Exception(f"{self.provider} API调用失败: {str(e)}")
+            await asyncio.sleep(self.resilience.backoff(attempt))
+            attempt += 1
     
     def chat_with_context(self, question: str, context: str) -> str:
         """
@@ -62,19 +279,43 @@ class CloudLLMService:
         Returns:
             AI生成的回答
         """
-        if not context or context.strip() == "无相关内容":
-            return "❌ 未检索到与问题相关的知识库内容"
+        if not has_context(context):
+            return NO_CONTEXT_ANSWER
 
-        prompt = f"""基于以下上下文，精准回答问题，答案必须来自上下文，不要编造内容：
+        return self.chat(build_context_prompt(question, context), temperature=0.1)
 
-上下文：
-{context}
+    async def achat_with_context(self, question: str, context: str) -> str:
+        """基于检索到的上下文回答问题（异步）"""
+        if not has_context(context):
+            return NO_CONTEXT_ANSWER
 
-问题：{question}
+        return await self.achat(build_context_prompt(question, context), temperature=0.1)
 
-请基于上下文回答，如果上下文中没有相关信息，请说明无法回答。"""
+    def chat_with_context_stream(self, question: str, context: str) -> Iterator[str]:
+        """
+        基于检索到的上下文流式回答问题
 
-        return self.chat(prompt, temperature=0.1)
+        Args:
+            question: 用户问题
+            context: 检索到的上下文
+
+        Yields:
+            增量文本片段
+        """
+        if not has_context(context):
+            yield NO_CONTEXT_ANSWER
+            return
+
+        yield from self.chat_stream(build_context_prompt(question, context), temperature=0.1)
+
+    async def achat_with_context_stream(self, question: str, context: str) -> AsyncIterator[str]:
+        """基于检索到的上下文流式回答问题（异步）"""
+        if not has_context(context):
+            yield NO_CONTEXT_ANSWER
+            return
+
+        async for delta in self.achat_stream(build_context_prompt(question, context), temperature=0.1):
+            yield delta
 
     def chat_with_tools(
         self,
@@ -93,45 +334,31 @@ class CloudLLMService:
         Returns:
             模型返回的 message 对象（含 content 和 tool_calls 字段）
         """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        data = self._payload(messages, temperature, tools=tools, tool_choice="auto")
+        return self._post(data)
 
-        data = {
-            "model": self.model,
-            "messages": messages,
-            "temperature": temperature,
-            "tools": tools,
-            "tool_choice": "auto"
-        }
-
-        try:
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=data,
-                timeout=60
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result["choices"][0]["message"]
-        except Exception as e:
-            raise Exception(f"智谱AI API调用失败: {str(e)}")
+    async def aclose(self):
+        """关闭连接池（应用退出时调用）"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
 
 
 class LLMService:
     """
     LLM 服务统一接口
-    根据配置自动选择云端 API 或本地 GPU 模型
+    根据配置自动选择云端 API 或本地 OpenAI 兼容端点（vLLM / Ollama / 模拟服务）
     """
     
     def __init__(self):
         # 检查是否使用本地 LLM
-        self.use_local = os.getenv('USE_LOCAL_LLM', 'false').lower() == 'true'
+        self.use_local = settings.USE_LOCAL_LLM
         
         if self.use_local:
-            print("🚀 使用本地 GPU 模型")
+            print("🚀 使用本地 LLM（OpenAI 兼容端点）")
             from app.services.local_llm_service import get_local_llm_service
             self.backend = get_local_llm_service()
         else:
@@ -164,6 +391,58 @@ class LLMService:
         """
         return self.backend.chat_with_context(question, context)
 
+    def chat_with_context_stream(self, question: str, context: str) -> Iterator[str]:
+        """
+        基于检索到的上下文流式回答问题（统一接口）
+        后端不支持流式输出时，生成完整回答后一次性返回
+
+        Args:
+            question: 用户问题
+            context: 检索到的上下文
+
+        Yields:
+            增量文本片段
+        """
+        if hasattr(self.backend, 'chat_with_context_stream'):
+            yield from self.backend.chat_with_context_stream(question, context)
+        else:
+            yield self.backend.chat_with_context(question, context)
+
+    async def achat(self, prompt: str, temperature: float = 0.1) -> str:
+        """
+        生成回答（异步统一接口）
+        后端无异步实现时（如本地模型）在线程中执行同步接口
+
+        Args:
+            prompt: 输入提示词
+            temperature: 温度参数
+
+        Returns:
+            AI生成的回答文本
+        """
+        if hasattr(self.backend, 'achat'):
+            return await self.backend.achat(prompt, temperature)
+        return await asyncio.to_thread(self.backend.chat, prompt, temperature)
+
+    async def achat_with_context(self, question: str, context: str) -> str:
+        """基于检索到的上下文回答问题（异步统一接口）"""
+        if hasattr(self.backend, 'achat_with_context'):
+            return await self.backend.achat_with_context(question, context)
+        return await asyncio.to_thread(self.backend.chat_with_context, question, context)
+
+    async def achat_with_context_stream(self, question: str, context: str) -> AsyncIterator[str]:
+        """基于检索到的上下文流式回答问题（异步统一接口）"""
+        if hasattr(self.backend, 'achat_with_context_stream'):
+            async for delta in self.backend.achat_with_context_stream(question, context):
+                yield delta
+        else:
+            yield await asyncio.to_thread(self.backend.chat_with_context, question, context)
+
+    async def aclose(self):
+        """释放后端连接池"""
+        if hasattr(self.backend, 'aclose'):
+            await self.backend.aclose()
+
     def chat_with_tools(
         self,
         messages: List[Dict[str, Any]],
@@ -191,11 +470,23 @@ class LLMService:
             )
         return self.backend.chat_with_tools(messages, tools, temperature)
     
+    def health(self) -> Dict[str, Any]:
+        """LLM 后端健康状态（熔断器状态、重试 / 对冲计数、近期延迟）"""
+        resilience = getattr(self.backend, 'resilience', None)
+        if resilience is None:
+            return {"status": "healthy", "backend": type(self.backend).__name__}
+        stats = resilience.stats()
+        return {
+            "status": "healthy" if stats["breaker"]["state"] == "closed" else "degraded",
+            "backend": type(self.backend).__name__,
+            **stats
+        }
+
     def get_model_info(self) -> dict:
         """获取模型信息"""
         if self.use_local and hasattr(self.backend, 'get_model_info'):
             return {
-                "type": "local_gpu",
+                "type": "local",
                 **self.backend.get_model_info()
             }
         else:
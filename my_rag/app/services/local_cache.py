@@ -0,0 +1,80 @@
+"""
+进程内 LRU 缓存
+容量有界、可选 TTL，并维护命中 / 未命中 / 淘汰计数，供各类本地缓存复用
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存（容量 + 可选 TTL 双重约束）"""
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        """
+        Args:
+            max_size: 最大条目数，超出后淘汰最久未使用的条目
+            ttl: 条目存活时间（秒），None 表示不过期
+        """
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取条目，命中时移到队尾；过期条目视为未命中"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """写入条目，超出容量时淘汰最久未使用的条目"""
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        """删除指定条目"""
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self) -> int:
+        """清空所有条目，返回清除数量"""
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            return count
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计信息"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
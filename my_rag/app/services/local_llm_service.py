@@ -0,0 +1,55 @@
+"""
+本地 / 自托管 LLM 服务（OpenAI 兼容协议）
+对接任意提供 /v1/chat/completions 的推理服务：vLLM、Ollama、LM Studio、llama.cpp server，
+以及离线压测用的模拟服务 scripts/mock_llm_server.py
+
+与云端后端协议相同（含流式输出和 Function Calling），复用其连接池、流式解析、重试与熔断，
+只替换端点、模型名和鉴权
+"""
+import threading
+from typing import Any, Dict, Optional
+
+from app.config import settings
+from app.services.llm_service import CloudLLMService
+
+
+class LocalLLMService(CloudLLMService):
+    """OpenAI 兼容端点的 LLM 服务"""
+
+    provider = "本地 LLM"
+
+    def __init__(self):
+        super().__init__()
+        self.base_url = settings.LOCAL_LLM_BASE_URL.rstrip('/')
+        self.api_url = f"{self.base_url}/chat/completions"
+        self.api_key = settings.LOCAL_LLM_API_KEY
+        self.model = settings.LOCAL_LLM_MODEL
+
+    def _headers(self) -> Dict[str, str]:
+        # 多数自托管服务不校验 key，未配置时不发送 Authorization
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def get_model_info(self) -> Dict[str, Any]:
+        return {
+            "provider": "openai_compatible",
+            "base_url": self.base_url,
+            "model": self.model
+        }
+
+
+_instance: Optional[LocalLLMService] = None
+_instance_lock = threading.Lock()
+
+
+def get_local_llm_service() -> LocalLLMService:
+    """获取本地 LLM 服务单例"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = LocalLLMService()
+                print(f"✅ 本地 LLM 端点: {_instance.api_url} (模型 {_instance.model})")
+    return _instance
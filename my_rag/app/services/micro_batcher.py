@@ -0,0 +1,153 @@
+"""
+动态微批
+并发请求各自只编码一个查询、精排一个查询的候选，模型始终看不到大批次。
+微批器把一个小时间窗内（几毫秒，且不超过批大小上限）到达的请求合并为一次前向计算，
+再把结果分发回各自等待的 Future。
+
+- 调用方为同步线程（FastAPI 线程池），submit 阻塞等待本请求的结果
+- 前向计算期间到达的请求自然积累成下一批
+- 导出批大小、等待时间和队列深度
+- 等待结果有超时；批处理抛出任何异常（含 BaseException）都会分发给本批调用方，批处理线程不退出
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services.model_workers import model_workers
+
+
+class MicroBatcher:
+    """按时间窗 + 批大小合并并发请求"""
+
+    def __init__(
+        self,
+        name: str,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        concurrency: int = 1,
+        timeout: Optional[float] = None
+    ):
+        """
+        Args:
+            name: 名称（日志 / 指标）
+            batch_fn: 批处理函数，输入请求列表，返回一一对应的结果列表
+            max_batch_size: 每批请求数上限
+            max_wait_ms: 收到首个请求后最多再等待的时间（毫秒）
+            concurrency: 同时执行的批数（推理进程池有多个进程时可大于 1）
+            timeout: 等待单个请求结果的上限（秒），默认与推理等待上限 MODEL_WORKERS_TIMEOUT 一致
+        """
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.concurrency = max(1, concurrency)
+        self.timeout = settings.MODEL_WORKERS_TIMEOUT if timeout is None else timeout
+        self._queue: "queue.Queue[Tuple[Any, Future, float]]" = queue.Queue()
+        self._collect_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+        self.max_queue_depth = 0
+        self.timeouts = 0
+
+    def _start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            for i in range(self.concurrency):
+                threading.Thread(
+                    target=self._run, name=f"batch-{self.name}-{i}", daemon=True
+                ).start()
+            self._started = True
+
+    def submit(self, item: Any) -> Any:
+        """
+        提交一个请求并等待结果；批处理抛出的异常原样抛给本批所有调用方
+
+        Raises:
+            TimeoutError: 超过 timeout 仍未得到结果（尚未开始执行的请求会被取消）
+        """
+        if not self._started:
+            self._start()
+        future: Future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._stats_lock:
+                self.timeouts += 1
+            raise TimeoutError(f"{self.name} 微批等待超时 ({self.timeout}s)")
+
+    def _collect(self) -> List[Tuple[Any, Future, float]]:
+        """取首个请求后在时间窗内继续收集，直到批满或超时"""
+        with self._collect_lock:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            return batch
+
+    def _run(self):
+        while True:
+            # 已超时取消的请求不再计算；其余标记为执行中，之后不可取消
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"批处理结果数 {len(results)} 与请求数 {len(batch)} 不一致")
+            except BaseException as e:
+                # 含 BaseException：线程若因此退出，之后所有调用方都会永远等待
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+
+            waits = [started - enqueued for _, _, enqueued in batch]
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.total_wait += sum(waits)
+                self.max_wait_seen = max(self.max_wait_seen, max(waits))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+                "batches": self.batches,
+                "requests": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "avg_wait_ms": round(self.total_wait / self.items * 1000, 2) if self.items else 0.0,
+                "max_wait_seen_ms": round(self.max_wait_seen * 1000, 2),
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "timeouts": self.timeouts
+            }
+
+
+def batching_concurrency() -> int:
+    """批执行并发数：启用推理进程池时与进程数一致，否则 1（进程内模型本身已占满线程）"""
+    return model_workers.stats()["workers"] if model_workers.enabled else 1
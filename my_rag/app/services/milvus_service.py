@@ -3,52 +3,62 @@ Milvus向量数据库服务
 """
 import warnings
 warnings.filterwarnings('ignore')
-import os
-from typing import List, Optional
-from sentence_transformers import SentenceTransformer
-from pymilvus import MilvusClient
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 from app.config import settings
+from app.services.embedding_backend import MODEL_NAME, load_embedding_backend
+from app.services.micro_batcher import MicroBatcher, batching_concurrency
+from app.services.model_workers import PooledEmbeddingBackend, model_workers
+from app.services.embedding_cache import EmbeddingCache
+from app.services.search_filter import SearchFilter
+from app.services.vector_store import create_vector_store
 
 class MilvusService:
-    """Milvus向量数据库服务封装"""
+    """
+    向量检索服务封装
+
+    存储后端由 VECTOR_STORE 决定：Milvus（默认）或进程内向量引擎（见 vector_store）
+    """
     
     def __init__(self):
         self.collection_name = settings.MILVUS_COLLECTION_NAME
         self.vector_dim = settings.VECTOR_DIM
         self.top_k = settings.TOP_K
 
-        # 初始化向量模型（延迟加载，避免服务启动时加载）
-        self._embedding_model = None
+        # 初始化向量模型后端（延迟加载，避免服务启动时加载）
+        self._embedding_backend = None
 
-        # Milvus 连接失败时降级运行（向量检索不可用），不阻塞服务启动
-        self.enabled = True
-        try:
-            self.client = MilvusClient(f"tcp://{settings.MILVUS_HOST}:{settings.MILVUS_PORT}")
-        except Exception as e:
-            self.enabled = False
-            self.client = None
-            print(f"⚠️  Milvus 连接失败，向量检索功能不可用: {str(e)}")
+        # 查询向量缓存（模型标识含后端和维度，配置变化时旧缓存自然失效）；
+        # 后端加载后按实际生效的后端改写（onnx 加载 / 校验失败会回退到 torch）
+        self.embedding_cache = EmbeddingCache(
+            model_id=f"{MODEL_NAME}:{settings.EMBEDDING_BACKEND}:{self.vector_dim}"
+        )
+
+        # 查询编码微批：并发请求的单条查询合并为一次前向计算
+        self.embedding_batcher: Optional[MicroBatcher] = None
+        if settings.MICRO_BATCH_ENABLED:
+            self.embedding_batcher = MicroBatcher(
+                "embedding",
+                self._encode_queries,
+                max_batch_size=settings.EMBEDDING_MICRO_BATCH_MAX,
+                max_wait_ms=settings.MICRO_BATCH_WAIT_MS,
+                concurrency=batching_concurrency()
+            )
+
+        # 存储后端连接失败时降级运行（auto 模式改用本地引擎），不阻塞服务启动
+        self.store = create_vector_store(self.collection_name, self.vector_dim)
+        self.enabled = self.store is not None
+        self.client = getattr(self.store, "client", None)  # Milvus 后端的原生客户端
     
     @property
-    def embedding_model(self):
-        """延迟加载向量模型"""
-        if self._embedding_model is None:
-            # 优先使用本地模型路径，避免网络下载
-            local_model_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'models', 'bge-small-zh-v1.5')
-
-            if os.path.exists(local_model_path):
-                print(f"✅ 使用本地嵌入模型: {local_model_path}")
-                model_path = local_model_path
-            else:
-                print("⚠️  本地模型不存在，尝试从 Hugging Face 下载")
-                model_path = 'BAAI/bge-small-zh-v1.5'
-
-            self._embedding_model = SentenceTransformer(
-                model_path,
-                device='cpu',
-                trust_remote_code=True
-            )
-        return self._embedding_model
+    def embedding_backend(self):
+        """延迟加载向量模型后端（torch / onnx / onnx-int8；启用推理进程池时为代理）"""
+        if self._embedding_backend is None:
+            backend = PooledEmbeddingBackend() if model_workers.enabled else load_embedding_backend()
+            # 不同后端的向量有细微差异，缓存键按实际生效的后端区分
+            self.embedding_cache.model_id = f"{MODEL_NAME}:{backend.name}:{self.vector_dim}"
+            self._embedding_backend = backend
+        return self._embedding_backend
     
     def force_align_dim(self, vec: List[float], target_dim: int = None) -> List[float]:
         """
@@ -73,7 +83,7 @@ class MilvusService:
     
     def get_embedding(self, text: str) -> List[float]:
         """
-        生成文本向量
+        生成文本向量（查询路径，先查向量缓存）
         
         Args:
             text: 输入文本
@@ -81,90 +91,269 @@ class MilvusService:
         Returns:
             向量列表
         """
-        vec = self.embedding_model.encode(text, normalize_embeddings=True).tolist()
-        return self.force_align_dim(vec)
+        _ = self.embedding_backend  # 先确定实际后端，缓存键依赖它
+        cached = self.embedding_cache.get(text)
+        if cached is not None:
+            return cached
+
+        if self.embedding_batcher is not None:
+            vec = self.embedding_batcher.submit(text)
+        else:
+            vec = self._encode_queries([text])[0]
+        self.embedding_cache.set(text, vec)
+        return vec
+
+    def _encode_queries(self, texts: List[str]) -> List[List[float]]:
+        """一次前向编码多条查询（微批的批处理函数）"""
+        encoded = self.embedding_backend.encode(texts, batch_size=len(texts))
+        return [self.force_align_dim(vec.tolist()) for vec in encoded]
+
+    def get_query_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量生成查询向量：先查向量缓存，未命中的查询合并为一次前向计算
+
+        Args:
+            texts: 查询文本列表
+
+        Returns:
+            向量列表（与 texts 一一对应）
+        """
+        _ = self.embedding_backend  # 先确定实际后端，缓存键依赖它
+        vectors: List[Optional[List[float]]] = [self.embedding_cache.get(t) for t in texts]
+        missing = [i for i, vec in enumerate(vectors) if vec is None]
+        if missing:
+            encoded = self.get_embeddings([texts[i] for i in missing])
+            for i, vec in zip(missing, encoded):
+                vectors[i] = vec
+                self.embedding_cache.set(texts[i], vec)
+        return vectors
+
+    def get_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        """
+        批量生成文本向量
+
+        先按长度排序再分批编码，同一批内文本长度接近，减少 padding 浪费；
+        结果按输入顺序返回。
+
+        Args:
+            texts: 输入文本列表
+            batch_size: 每次前向编码的文本数，默认使用配置值
+
+        Returns:
+            向量列表（与 texts 一一对应）
+        """
+        if not texts:
+            return []
+        if batch_size is None:
+            batch_size = settings.EMBEDDING_BATCH_SIZE
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            encoded = self.embedding_backend.encode(
+                [texts[i] for i in batch_idx],
+                batch_size=len(batch_idx)
+            )
+            for i, vec in zip(batch_idx, encoded):
+                vectors[i] = self.force_align_dim(vec.tolist())
+        return vectors
     
     def create_collection_if_not_exists(self):
         """创建集合（如果不存在）"""
-        if not self.client.has_collection(self.collection_name):
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                dimension=self.vector_dim,
-                auto_id=True,
-                vector_field_name="vector"
-            )
-            print(f"✅ 创建Milvus集合：{self.collection_name}")
+        self.store.ensure_collection()
     
     def drop_collection(self):
         """删除集合"""
-        if self.client.has_collection(self.collection_name):
-            self.client.drop_collection(self.collection_name)
-            print(f"✅ 删除Milvus集合：{self.collection_name}")
+        self.store.drop_collection()
+
+    def delete_by_document_id(self, document_id: int) -> int:
+        """
+        删除指定文档的所有向量
+
+        Args:
+            document_id: 文档ID
+
+        Returns:
+            删除的数量
+        """
+        if not self.enabled:
+            return 0
+        deleted = self.store.delete_by_document_id(document_id)
+        print(f"✅ 删除向量: document_id={document_id}, {deleted} 条")
+        return deleted
+
+    def count(self) -> int:
+        """向量库中的文档片段数量"""
+        return self.store.count() if self.enabled else 0
     
     def insert_chunks(self, chunks: List[str], metadatas: Optional[List[dict]] = None):
         """
         插入文本块到Milvus
-        
+
+        按 MILVUS_INSERT_BATCH_SIZE 分批流水线处理：当前批写入 Milvus 的同时编码下一批，
+        任意时刻最多只有两批数据驻留内存，峰值内存与文档大小无关。
+        任一批失败时按 document_id 删除已写入的批次再抛出，不留下半个文档。
+
         Args:
             chunks: 文本块列表
             metadatas: 可选的元数据列表（如文档ID等）
         """
+        if not self.enabled:
+            raise Exception("向量库不可用，无法写入")
         self.create_collection_if_not_exists()
-        
-        data = []
-        for idx, chunk in enumerate(chunks):
-            vec = self.get_embedding(chunk)
-            item = {"content": chunk, "vector": vec}
-            if metadatas and idx < len(metadatas):
-                item.update(metadatas[idx])
-            data.append(item)
-        
-        self.client.insert(
-            collection_name=self.collection_name,
-            data=data
-        )
-        print(f"✅ 成功插入 {len(chunks)} 条数据到Milvus")
+
+        insert_batch_size = max(1, settings.MILVUS_INSERT_BATCH_SIZE)
+        pending = None  # 上一批尚未完成的写入
+        document_ids = set()  # 已提交写入的文档，失败时回滚
+
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                for start in range(0, len(chunks), insert_batch_size):
+                    batch = chunks[start:start + insert_batch_size]
+                    vectors = self.get_embeddings(batch)
+
+                    data = []
+                    for offset, (chunk, vec) in enumerate(zip(batch, vectors)):
+                        idx = start + offset
+                        item = {
+                            "content": chunk,
+                            "vector": vec,
+                            "document_id": 0,
+                            "chunk_id": idx,
+                            "tenant_id": settings.DEFAULT_TENANT_ID,
+                            "tags": []
+                        }
+                        if metadatas and idx < len(metadatas):
+                            item.update(metadatas[idx])
+                        data.append(item)
+
+                    # 等待上一批写完再提交，保证同时在途的写入只有一批
+                    if pending is not None:
+                        pending.result()
+                    document_ids.update(item["document_id"] for item in data)
+                    pending = executor.submit(self.store.insert, data)
+
+                if pending is not None:
+                    pending.result()
+        except Exception:
+            # 退出 with 时在途的写入已结束，此时删除不会与写入交错
+            self._rollback_insert(document_ids)
+            raise
+
+        print(f"✅ 成功插入 {len(chunks)} 条数据到向量库 ({self.store.backend})")
     
-    def search(self, query: str, top_k: Optional[int] = None) -> List[dict]:
+    def _rollback_insert(self, document_ids):
+        """删除写入失败的文档已写入的批次（document_id 为 0 的未归属数据无法区分，不删除）"""
+        for document_id in document_ids:
+            if not document_id:
+                print("⚠️  写入失败的数据未指定 document_id，无法回滚已写入的批次")
+                continue
+            try:
+                self.delete_by_document_id(document_id)
+            except Exception as e:
+                print(f"⚠️  回滚文档 {document_id} 的向量失败: {e}")
+
+    def search(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        timeout: Optional[float] = None
+    ) -> List[dict]:
         """
         相似度检索
         
         Args:
             query: 查询文本
             top_k: 返回top k个结果，默认使用配置值
+            search_params: 本次检索的索引参数（如 {"ef": 128}、{"nprobe": 32}），覆盖配置值
+            filters: 过滤条件，下推到存储后端（Milvus 为标量过滤表达式）
+            timeout: 检索超时（秒），超时后放弃本次检索
         
         Returns:
-            检索结果列表，每个结果包含content和distance
+            检索结果列表，每个结果包含content、distance、document_id、chunk_id
         """
         if top_k is None:
             top_k = self.top_k
+        if not self.enabled:
+            return []
         
         query_vec = self.get_embedding(query)
         
         try:
-            results = self.client.search(
-                collection_name=self.collection_name,
-                data=[query_vec],
+            results = self.store.search(
+                [query_vec],
                 limit=top_k,
-                search_params={"metric_type": "COSINE"},
-                output_fields=["content"]
+                search_params=search_params,
+                filters=filters,
+                output_fields=["content", "document_id", "chunk_id"],
+                timeout=timeout
             )
-            
-            # 格式化结果 - MilvusClient返回格式：results[0]是第一个查询的结果列表
-            hits = []
-            if results and len(results) > 0 and len(results[0]) > 0:
-                for hit in results[0]:
-                    # MilvusClient返回的格式：hit是字典，包含"id", "distance", "entity"等
-                    entity = hit.get("entity", {})
-                    hits.append({
-                        "content": entity.get("content", ""),
-                        "distance": hit.get("distance", 0.0)
-                    })
-            
-            return hits
+            # 返回格式与 MilvusClient 一致：results[0]是第一个查询的结果列表
+            return self._format_hits(results[0]) if results else []
         except Exception as e:
-            print(f"Milvus搜索错误: {str(e)}")
+            print(f"向量检索错误: {str(e)}")
             return []
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: Optional[int] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        timeout: Optional[float] = None
+    ) -> List[List[dict]]:
+        """
+        批量相似度检索：N 个查询一次前向编码 + 一次向量库检索
+
+        Args:
+            queries: 查询文本列表
+            top_k: 每个查询返回的结果数，默认使用配置值
+            search_params: 本次检索的索引参数，覆盖配置值
+            filters: 过滤条件（对所有查询生效）
+            timeout: 检索超时（秒），超时后放弃本次检索
+
+        Returns:
+            与 queries 一一对应的检索结果列表
+        """
+        if not queries:
+            return []
+        if top_k is None:
+            top_k = self.top_k
+        if not self.enabled:
+            return [[] for _ in queries]
+
+        query_vecs = self.get_query_embeddings(queries)
+
+        try:
+            results = self.store.search(
+                query_vecs,
+                limit=top_k,
+                search_params=search_params,
+                filters=filters,
+                output_fields=["content", "document_id", "chunk_id"],
+                timeout=timeout
+            )
+            return [self._format_hits(hits) for hits in results]
+        except Exception as e:
+            print(f"向量批量检索错误: {str(e)}")
+            return [[] for _ in queries]
+
+    def _format_hits(self, hits: List[dict]) -> List[dict]:
+        """格式化单个查询的命中结果"""
+        formatted = []
+        for hit in hits or []:
+            # MilvusClient返回的格式：hit是字典，包含"id", "distance", "entity"等
+            entity = hit.get("entity", {})
+            formatted.append({
+                "content": entity.get("content", ""),
+                "distance": hit.get("distance", 0.0),
+                "document_id": entity.get("document_id"),
+                "chunk_id": entity.get("chunk_id")
+            })
+        return formatted
     
     def search_context(self, query: str, top_k: Optional[int] = None) -> str:
         """
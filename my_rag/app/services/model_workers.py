@@ -0,0 +1,475 @@
+"""
+模型推理进程池
+向量编码和 Cross-Encoder 精排的 CPU 计算移出 API 进程：
+- 每个推理进程启动时加载一次模型，torch 线程数按 物理核数 / 进程数 设置，避免线程超订
+- 本地模式（MODEL_WORKERS_ADDRESS 为空）：每个 API 进程自带一个进程池
+- 共享模式：推理进程池作为独立服务运行（python -m app.services.model_workers），
+  多个 uvicorn worker 通过本地 socket 连接同一个池，扩容 uvicorn 不再成倍占用模型内存
+- 共享服务不可达时退回进程内推理
+- 推理进程异常退出（OOM / 段错误）导致进程池损坏时，重建进程池并重试一次；
+  等待超时的任务会被取消（尚未开始的不再执行），超时与其它错误分开计数
+- 共享服务会反序列化收到的消息：必须配置非默认的 MODEL_WORKERS_AUTHKEY，
+  推荐 Unix socket（权限 0600），TCP 只允许监听 / 连接回环地址
+
+API 进程只在线程中等待结果，模型计算不再占用事件循环和 GIL
+"""
+import ipaddress
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from app.config import settings
+
+# 推理进程内为 True：进程内直接用模型，不再转发到进程池
+_IN_WORKER = False
+_embedding_backend = None
+
+# 早期版本的公开默认密钥，视同未配置
+_LEGACY_AUTHKEY = "rag-model-workers"
+
+
+def physical_cores() -> int:
+    """物理核数（超线程不计）；无法识别时按逻辑核数的一半估算"""
+    try:
+        import psutil
+
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    except ImportError:
+        pass
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            blocks = f.read().strip().split("\n\n")
+        ids = set()
+        for block in blocks:
+            fields = dict(
+                (k.strip(), v.strip()) for k, _, v in (line.partition(":") for line in block.splitlines())
+            )
+            if "core id" in fields:
+                ids.add((fields.get("physical id"), fields["core id"]))
+        if ids:
+            return len(ids)
+    except OSError:
+        pass
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def pool_shape(workers: int = 0, threads: int = 0, cores: Optional[int] = None) -> Tuple[int, int]:
+    """
+    计算进程数和每进程线程数，使 进程数 × 线程数 ≈ 物理核数
+
+    Args:
+        workers: 进程数，0 表示自动
+        threads: 每进程 torch 线程数，0 表示自动
+        cores: 物理核数，默认自动识别
+
+    Returns:
+        (进程数, 每进程线程数)
+    """
+    cores = cores or physical_cores()
+    if workers <= 0 and threads <= 0:
+        workers = max(1, cores // 2)
+    if workers <= 0:
+        workers = max(1, cores // threads)
+    if threads <= 0:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """"host:port" 解析为 TCP 地址，其余视为 Unix socket 路径"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def check_address(address: str) -> Union[str, Tuple[str, int]]:
+    """
+    解析并校验共享推理服务地址：TCP 地址必须是回环地址
+
+    Raises:
+        ValueError: 非回环的 TCP 地址（服务端会反序列化消息，不能暴露到网络）
+    """
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        host = parsed[0].strip("[]")
+        if host != "localhost":
+            try:
+                loopback = ipaddress.ip_address(host).is_loopback
+            except ValueError:
+                loopback = False
+            if not loopback:
+                raise ValueError(f"共享推理服务只允许回环地址或 Unix socket，拒绝 {address}")
+    return parsed
+
+
+def shared_authkey() -> bytes:
+    """
+    共享推理服务的连接密钥
+
+    Raises:
+        ValueError: 未配置或仍为旧的公开默认值
+    """
+    key = settings.MODEL_WORKERS_AUTHKEY
+    if not key or key == _LEGACY_AUTHKEY:
+        raise ValueError("请配置 MODEL_WORKERS_AUTHKEY（随机长串，不能为空或旧默认值）")
+    return key.encode("utf-8")
+
+
+# ---------- 推理进程内执行的任务 ----------
+
+def _init_worker(threads: int, preload: bool):
+    """推理进程初始化：限制线程数，预加载模型"""
+    global _IN_WORKER
+    _IN_WORKER = True
+    if settings.EMBEDDING_ONNX_THREADS <= 0:
+        settings.EMBEDDING_ONNX_THREADS = threads
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    except Exception:
+        pass
+    if preload:
+        try:
+            _embed(["预热"], 1)
+            if settings.RERANK_ENABLED:
+                from app.services.rerank_service import rerank_service
+
+                _ = rerank_service.model
+        except Exception as e:
+            print(f"⚠️  推理进程 {os.getpid()} 预加载模型失败: {e}")
+
+
+def _embed(texts: List[str], batch_size: int) -> np.ndarray:
+    _embed_backend_name()  # 确保已加载
+    return _embedding_backend.encode(texts, batch_size=batch_size)
+
+
+def _embed_backend_name() -> str:
+    """推理进程中实际生效的向量模型后端（onnx 可能回退到 torch）"""
+    global _embedding_backend
+    if _embedding_backend is None:
+        from app.services.embedding_backend import load_embedding_backend
+
+        _embedding_backend = load_embedding_backend()
+    return _embedding_backend.name
+
+
+def _rerank_logits(requests: List[Tuple[str, List[str]]]) -> List[np.ndarray]:
+    from app.services.rerank_service import rerank_service
+
+    if isinstance(rerank_service._model, PooledCrossEncoder):
+        # 进程池不可用、退回进程内推理：代理换成真实模型
+        rerank_service._model = None
+    if rerank_service.model is None:
+        raise RuntimeError("推理进程中 rerank 模型不可用")
+    return rerank_service.score_logits_many(requests)
+
+
+TASKS: Dict[str, Callable[..., Any]] = {
+    "embed": _embed,
+    "embed_backend": _embed_backend_name,
+    "rerank_logits": _rerank_logits,
+}
+
+
+def _run_task(op: str, *args) -> Any:
+    return TASKS[op](*args)
+
+
+# ---------- 共享模式：推理服务端 / 客户端 ----------
+
+class ModelWorkerServer:
+    """推理进程池服务：本地 socket 上接收任务，转交进程池执行"""
+
+    def __init__(self, address: str, executor=None):
+        """
+        Args:
+            address: Unix socket 路径或回环地址 "host:port"
+            executor: 任务执行器，默认按配置创建推理进程池
+
+        Raises:
+            ValueError: 密钥未配置或地址不是回环地址 / Unix socket
+        """
+        self.authkey = shared_authkey()
+        self.address = check_address(address)
+        self.executor = executor or _create_executor()
+        self.listener = None
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            # socket 文件创建即为 0600，只有本用户可连接
+            old_umask = os.umask(0o177)
+            try:
+                self.listener = Listener(self.address, authkey=self.authkey)
+            finally:
+                os.umask(old_umask)
+            os.chmod(self.address, 0o600)
+        else:
+            self.listener = Listener(self.address, authkey=self.authkey)
+        print(f"✅ 推理进程池服务已启动: {self.address}")
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break  # listener 已关闭
+            except Exception as e:
+                print(f"⚠️  推理服务连接失败: {e}")
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        """一个连接上顺序处理请求（客户端用多个连接实现并发）"""
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(("ok", self._run(op, *args)))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+    def _run(self, op: str, *args) -> Any:
+        executor = self.executor
+        try:
+            return executor.submit(_run_task, op, *args).result()
+        except BrokenProcessPool:
+            # 推理进程异常退出：重建进程池后重试一次（并发请求只重建一次）
+            with self._lock:
+                if self.executor is executor:
+                    print("⚠️  推理进程异常退出，重建进程池")
+                    executor.shutdown(wait=False)
+                    self.executor = _create_executor()
+            return self.executor.submit(_run_task, op, *args).result()
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.close()
+
+
+class _RemoteExecutor:
+    """共享推理服务的客户端：每个 I/O 线程持有一个连接"""
+
+    def __init__(self, address: str, connections: int):
+        self.authkey = shared_authkey()
+        self.address = check_address(address)
+        self._local = threading.local()
+        self._io_pool = ThreadPoolExecutor(max_workers=connections, thread_name_prefix="model-io")
+
+    def connect(self):
+        return Client(self.address, authkey=self.authkey)
+
+    def _call(self, op: str, *args) -> Any:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        try:
+            conn.send((op, args))
+            status, result = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if status != "ok":
+            raise RuntimeError(f"推理服务执行失败: {result}")
+        return result
+
+    def submit(self, fn, op: str, *args) -> Future:
+        """与 ProcessPoolExecutor.submit 同签名；fn（_run_task）在服务端执行"""
+        return self._io_pool.submit(self._call, op, *args)
+
+    def shutdown(self, wait: bool = True):
+        self._io_pool.shutdown(wait=wait)
+
+
+def _create_executor() -> ProcessPoolExecutor:
+    workers, threads = pool_shape(settings.MODEL_WORKERS, settings.MODEL_WORKER_THREADS)
+    print(f"🚀 启动推理进程池: {workers} 个进程 × {threads} 线程")
+    # spawn：不继承父进程的 torch 线程池和事件循环状态
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(threads, settings.MODEL_WORKERS_PRELOAD)
+    )
+
+
+class ModelWorkerPool:
+    """API 进程侧的推理入口：本地进程池或共享推理服务"""
+
+    def __init__(self):
+        self.address = settings.MODEL_WORKERS_ADDRESS
+        self.timeout = settings.MODEL_WORKERS_TIMEOUT
+        self._executor = None
+        self._lock = threading.Lock()
+        self._failed = False
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.MODEL_WORKERS_ENABLED and not _IN_WORKER and not self._failed
+
+    @property
+    def mode(self) -> str:
+        if not self.enabled:
+            return "in_process"
+        return "shared" if self.address else "local"
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.address:
+                        remote = _RemoteExecutor(self.address, settings.MODEL_WORKERS_CONNECTIONS)
+                        remote.connect().close()  # 启动时探测，不可达则抛出
+                        self._executor = remote
+                        print(f"✅ 已连接共享推理服务: {self.address}")
+                    else:
+                        self._executor = _create_executor()
+        return self._executor
+
+    def call(self, op: str, *args) -> Any:
+        """
+        在推理进程中执行任务并等待结果
+
+        Args:
+            op: 任务名（embed / rerank_logits）
+            args: 任务参数（需可 pickle）
+        """
+        if self._failed:
+            return _run_task(op, *args)
+        try:
+            executor = self._get_executor()
+        except Exception as e:
+            # 共享推理服务不可达：退回进程内推理
+            print(f"⚠️  推理进程池不可用，退回进程内推理: {e}")
+            self._failed = True
+            return _run_task(op, *args)
+
+        self.calls += 1
+        try:
+            try:
+                return self._submit(executor, op, *args)
+            except BrokenProcessPool:
+                # 推理进程被杀（OOM / 段错误）后整个进程池不可用：重建后重试一次
+                return self._submit(self._rebuild(executor), op, *args)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+
+    def _submit(self, executor, op: str, *args) -> Any:
+        future = executor.submit(_run_task, op, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 尚未开始的任务不再执行，避免继续加重卡住的推理进程；已在执行的无法中断
+            future.cancel()
+            raise
+
+    def _rebuild(self, broken):
+        """替换损坏的进程池；并发调用只重建一次"""
+        with self._lock:
+            if self._executor is broken:
+                print("⚠️  推理进程异常退出，重建进程池")
+                broken.shutdown(wait=False)
+                self._executor = None
+                self.restarts += 1
+        return self._get_executor()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        workers, threads = pool_shape(settings.MODEL_WORKERS, settings.MODEL_WORKER_THREADS)
+        return {
+            "mode": self.mode,
+            "address": self.address or None,
+            "workers": workers,
+            "threads_per_worker": threads,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts
+        }
+
+
+class PooledEmbeddingBackend:
+    """向量模型后端代理：编码在推理进程中执行"""
+
+    def __init__(self):
+        self._name: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        """推理进程中实际生效的后端名（用于向量缓存键）"""
+        if self._name is None:
+            self._name = model_workers.call("embed_backend")
+        return self._name
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return model_workers.call("embed", texts, batch_size)
+
+
+class PooledCrossEncoder:
+    """Cross-Encoder 代理：推理进程内做分桶批处理，返回 logit"""
+
+    def predict(self, pairs: List[Tuple[str, str]], batch_size: int = 32) -> np.ndarray:
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        # 相邻且 query 相同的对归为一组，推理进程内每个 query 只分词一次
+        requests: List[Tuple[str, List[str]]] = []
+        for query, doc in pairs:
+            if not requests or requests[-1][0] != query:
+                requests.append((query, []))
+            requests[-1][1].append(doc)
+        return np.concatenate(model_workers.call("rerank_logits", requests))
+
+
+# 创建全局实例
+model_workers = ModelWorkerPool()
+
+
+def serve():
+    """运行共享推理服务（阻塞）"""
+    if not settings.MODEL_WORKERS_ADDRESS:
+        raise SystemExit("请先配置 MODEL_WORKERS_ADDRESS（如 /run/rag/models.sock 或 127.0.0.1:8765）")
+    try:
+        server = ModelWorkerServer(settings.MODEL_WORKERS_ADDRESS)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+        server.executor.shutdown()
+
+
+if __name__ == "__main__":
+    # 共享推理服务：python -m app.services.model_workers
+    # 经包路径导入后再启动，推理进程 pickle 的任务函数指向 app.services.model_workers 而非 __main__
+    from app.services.model_workers import serve as _serve
+
+    _serve()
@@ -0,0 +1,58 @@
+"""
+精排级联参数
+RRF 融合后的候选分两级精排：
+1. 提前退出：向量和关键词两路都把同一候选排在第一、RRF 第一名相对第二名的
+   分差达到阈值，且其向量相似度不低于 VECTOR_DISTANCE_THRESHOLD 时，直接按 RRF
+   顺序返回，跳过 Cross-Encoder
+2. 粗筛：用 bi-encoder 余弦相似度（向量召回的 distance 直接复用，仅关键词召回的候选
+   用向量模型批量编码）把候选缩到 shortlist 条，只有这些候选进入 Cross-Encoder
+
+默认值读配置，每个请求可单独覆盖
+"""
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+
+class RerankCascade:
+    """精排级联参数"""
+
+    def __init__(
+        self,
+        shortlist: Optional[int] = None,
+        skip_margin: Optional[float] = None,
+        enabled: Optional[bool] = None
+    ):
+        """
+        Args:
+            shortlist: 粗筛后进入 Cross-Encoder 的候选数，0 表示不粗筛
+            skip_margin: RRF 第一名与第二名的相对分差阈值（0~1），达到则跳过 Cross-Encoder，0 表示不跳过
+            enabled: 是否启用级联，关闭时全部候选直接进入 Cross-Encoder
+        """
+        self.enabled = settings.RERANK_CASCADE_ENABLED if enabled is None else enabled
+        self.shortlist = settings.RERANK_CASCADE_SHORTLIST if shortlist is None else max(0, int(shortlist))
+        self.skip_margin = settings.RERANK_SKIP_MARGIN if skip_margin is None else float(skip_margin)
+
+    @classmethod
+    def build(
+        cls,
+        shortlist: Optional[int] = None,
+        skip_margin: Optional[float] = None
+    ) -> Optional["RerankCascade"]:
+        """构造请求级参数，全部为空时返回 None（使用配置默认值）"""
+        if shortlist is None and skip_margin is None:
+            return None
+        return cls(shortlist, skip_margin)
+
+    def key(self) -> str:
+        """参数标识（用于请求合并键，参数不同的请求不共享结果）"""
+        if not self.enabled:
+            return "off"
+        return f"s{self.shortlist}:m{self.skip_margin:g}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "shortlist": self.shortlist,
+            "skip_margin": self.skip_margin
+        }
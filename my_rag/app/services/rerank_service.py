@@ -7,12 +7,34 @@ Rerank 精排服务
 与 Embedding（Bi-Encoder）的区别：
 - Embedding：query 和 doc 分别编码，再算余弦，快但粗
 - Rerank：query 和 doc 拼接后过 Cross-Encoder，成对精算，慢但准
+
+打分按长度分桶批处理：
+- 预分词：query 只分词一次，每对只截断到实际需要的 token 数（query 另有上限）
+- 分桶：按长度排序后切批，一批内的填充长度由最长的一对决定，长片段不再拖累整批
+- 批大小：每批 token 数 ≈ 实测吞吐 × 单批延迟预算（RERANK_BATCH_LATENCY_MS）
+- sigmoid、阈值过滤和 top-k（argpartition）全部向量化
+
+打分缓存：同一 query、同一片段、同一模型的 logit 是确定的，按
+(归一化 query 指纹, 片段内容指纹) 缓存在进程内 LRU 中（模型标识折入 query 指纹），
+每次只对未命中的候选过模型再合并结果
+
+微批：并发请求的未命中候选在几毫秒的时间窗内合并，多个查询的 (query, doc) 对一起分桶打分
 """
+import hashlib
+import inspect
 import os
 import math
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
 
 from app.config import settings
+from app.services.embedding_cache import normalize_text
+from app.services.local_cache import LRUCache
+from app.services.micro_batcher import MicroBatcher, batching_concurrency
+from app.services.model_workers import PooledCrossEncoder, model_workers
 
 
 def _sigmoid(x: float) -> float:
@@ -24,18 +46,109 @@ def _sigmoid(x: float) -> float:
     return z / (1.0 + z)
 
 
+def _sigmoid_array(x: np.ndarray) -> np.ndarray:
+    """向量化的数值稳定 sigmoid"""
+    z = np.exp(-np.abs(x))
+    return np.where(x >= 0, 1.0 / (1.0 + z), z / (1.0 + z))
+
+
+def _identity(x):
+    return x
+
+
+def _raw_logit_kwargs(model) -> Dict[str, Any]:
+    """
+    CrossEncoder.predict 对单标签模型默认再套一层 sigmoid；传入恒等激活，
+    使其与分桶路径一样返回原始 logit（参数名随 sentence-transformers 版本不同）
+    """
+    try:
+        params = inspect.signature(model.predict).parameters
+    except (TypeError, ValueError):
+        return {}
+    for name in ("activation_fn", "activation_fct"):
+        if name in params:
+            return {name: _identity}
+    return {}
+
+
+def plan_batches(lengths: np.ndarray, token_budget: int, max_batch_size: int) -> List[np.ndarray]:
+    """
+    按长度分桶切批
+
+    Args:
+        lengths: 每对的 token 数
+        token_budget: 每批填充后的 token 数上限（批大小 × 批内最长）；单对超出时独占一批
+        max_batch_size: 每批条数上限
+
+    Returns:
+        每批的下标数组（批内长度升序）
+    """
+    order = np.argsort(lengths, kind='stable')
+    batches = []
+    start = 0
+    n = len(order)
+    while start < n:
+        end = start + 1
+        # 升序排列，加入第 end 个后填充长度即为它的长度
+        while (
+            end < n
+            and end - start < max_batch_size
+            and int(lengths[order[end]]) * (end - start + 1) <= token_budget
+        ):
+            end += 1
+        batches.append(order[start:end])
+        start = end
+    return batches
+
+
+def select_top_k(probs: np.ndarray, top_k: int, threshold: float) -> np.ndarray:
+    """阈值过滤后取概率最高的 top_k 个下标（降序，同分按原顺序）"""
+    keep = np.flatnonzero(probs >= threshold)
+    if len(keep) > top_k:
+        keep = np.sort(keep[np.argpartition(-probs[keep], top_k - 1)[:top_k]])
+    return keep[np.argsort(-probs[keep], kind='stable')]
+
+
 class RerankService:
     """Cross-Encoder 精排服务"""
 
     def __init__(self):
         self.enabled = settings.RERANK_ENABLED
+        self.max_length = settings.RERANK_MAX_LENGTH
+        self.max_query_tokens = settings.RERANK_MAX_QUERY_TOKENS
+        self.max_batch_size = settings.RERANK_MAX_BATCH_SIZE
+        self.batch_latency = settings.RERANK_BATCH_LATENCY_MS / 1000
         self._model = None
         self._load_error = None
+        # 截断长度影响 logit，一并计入模型标识
+        self.model_id = f"{settings.RERANK_MODEL}:{self.max_length}:{self.max_query_tokens}"
+        self.score_cache_enabled = settings.RERANK_CACHE_ENABLED
+        self.score_cache = LRUCache(settings.RERANK_CACHE_SIZE)
+        self.batcher: Optional[MicroBatcher] = None
+        if settings.MICRO_BATCH_ENABLED:
+            self.batcher = MicroBatcher(
+                "rerank",
+                self.score_logits_many,
+                max_batch_size=settings.RERANK_MICRO_BATCH_MAX,
+                max_wait_ms=settings.MICRO_BATCH_WAIT_MS,
+                concurrency=batching_concurrency()
+            )
+        # 实测吞吐（token/秒，指数滑动平均），用于由延迟预算换算每批 token 数
+        self._tokens_per_sec: Optional[float] = None
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.pairs = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
 
     @property
     def model(self):
         """延迟加载 rerank 模型，失败时降级为 None"""
         if self._model is None and self._load_error is None:
+            if model_workers.enabled:
+                # 模型在推理进程中加载，API 进程只持有代理
+                self._model = PooledCrossEncoder()
+                return self._model
             try:
                 from sentence_transformers import CrossEncoder
 
@@ -51,7 +164,7 @@ class RerankService:
                     print(f"⚠️  本地 rerank 模型不存在，尝试下载: {settings.RERANK_MODEL}")
                     model_path = settings.RERANK_MODEL
 
-                self._model = CrossEncoder(model_path, max_length=512)
+                self._model = CrossEncoder(model_path, max_length=self.max_length)
                 print("✅ Rerank 模型加载完成")
             except Exception as e:
                 self._load_error = str(e)
@@ -75,44 +188,162 @@ class RerankService:
             score_threshold: 概率阈值 0~1，低于此值丢弃（默认读配置）
 
         Returns:
-            精排结果，每项含 content 和 rerank_score（0~1 概率）
+            精排结果，每项含 content、rerank_score（0~1 概率）和 index（在 docs 中的下标）
         """
         if not docs:
             return []
 
         # 模型不可用 → 降级，原序返回（不截断，交给上层 _finalize 处理）
         if not self.enabled or self.model is None:
-            return [{"content": d, "rerank_score": 0.0} for d in docs]
+            return [{"content": d, "rerank_score": 0.0, "index": i} for i, d in enumerate(docs)]
 
         top_k = top_k or settings.RERANK_TOP_K
         if score_threshold is None:
             score_threshold = settings.RERANK_SCORE_THRESHOLD
 
         try:
-            # Cross-Encoder 成对打分
-            pairs = [(query, doc) for doc in docs]
-            logits = self.model.predict(pairs)
-
-            # BGE-reranker 输出 logit，转 sigmoid 概率，便于设阈值
-            probs = [_sigmoid(float(s)) for s in logits]
+            # Cross-Encoder 成对打分；BGE-reranker 输出 logit，转 sigmoid 概率，便于设阈值
+            probs = _sigmoid_array(self.cached_logits(query, docs))
 
-            # 按概率降序
-            ranked = sorted(zip(docs, probs), key=lambda x: x[1], reverse=True)
-
-            # 阈值过滤 + 截断 top_k
-            results: List[Dict[str, Any]] = []
-            for doc, prob in ranked:
-                if prob < score_threshold:
-                    continue
-                results.append({"content": doc, "rerank_score": prob})
-                if len(results) >= top_k:
-                    break
+            # 阈值过滤 + top_k（降序）
+            results = [
+                {"content": docs[idx], "rerank_score": float(probs[idx]), "index": int(idx)}
+                for idx in select_top_k(probs, top_k, score_threshold)
+            ]
 
             print(f"🎯 Rerank 精排: {len(docs)} → {len(results)} 条 (阈值={score_threshold})")
             return results
         except Exception as e:
             print(f"⚠️  Rerank 打分失败，降级为原始顺序: {e}")
-            return [{"content": d, "rerank_score": 0.0} for d in docs]
+            return [{"content": d, "rerank_score": 0.0, "index": i} for i, d in enumerate(docs)]
+
+
+    def batch_token_budget(self) -> int:
+        """每批填充后的 token 数上限：实测吞吐 × 延迟预算；尚无测量时用 RERANK_BATCH_TOKENS"""
+        if self._tokens_per_sec is None:
+            return settings.RERANK_BATCH_TOKENS
+        return max(self.max_length, int(self._tokens_per_sec * self.batch_latency))
+
+    def cached_logits(self, query: str, docs: List[str]) -> np.ndarray:
+        """
+        带缓存的成对打分：命中的候选直接取缓存，只对未命中的候选打分后合并
+
+        Returns:
+            与 docs 对齐的 logit 数组
+        """
+        if not self.score_cache_enabled:
+            return self._score(query, docs)
+
+        query_key = hashlib.md5(f"{self.model_id}\x00{normalize_text(query)}".encode('utf-8')).digest()
+        keys = [(query_key, hashlib.md5(doc.encode('utf-8')).digest()) for doc in docs]
+        logits = np.empty(len(docs), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = self.score_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                logits[i] = cached
+
+        if missing:
+            scored = self._score(query, [docs[i] for i in missing])
+            logits[missing] = scored
+            for i, logit in zip(missing, scored):
+                self.score_cache.set(keys[i], float(logit))
+        return logits
+
+    def _score(self, query: str, docs: List[str]) -> np.ndarray:
+        """打分入口：开启微批时与并发请求合并为一次前向计算"""
+        if self.batcher is not None:
+            return self.batcher.submit((query, docs))
+        return self.score_logits(query, docs)
+
+    def score_logits(self, query: str, docs: List[str]) -> np.ndarray:
+        """对 (query, doc) 成对打分，返回与 docs 对齐的 logit 数组"""
+        return self.score_logits_many([(query, docs)])[0]
+
+    def score_logits_many(self, requests: List[Tuple[str, List[str]]]) -> List[np.ndarray]:
+        """
+        多个查询的候选一起打分（微批的批处理函数）
+
+        模型暴露分词器和底层 HF 模型时走预分词 + 长度分桶；否则退回 CrossEncoder.predict
+
+        Args:
+            requests: [(query, docs), ...]
+
+        Returns:
+            与 requests 一一对应的 logit 数组
+        """
+        sizes = [len(docs) for _, docs in requests]
+        splits = np.cumsum(sizes)[:-1]
+        model = self.model
+        tokenizer = getattr(model, 'tokenizer', None)
+        hf_model = getattr(model, 'model', None)
+        if tokenizer is None or hf_model is None:
+            pairs = [(query, doc) for query, docs in requests for doc in docs]
+            logits = model.predict(pairs, batch_size=self.max_batch_size, **_raw_logit_kwargs(model))
+            return np.split(np.asarray(logits, dtype=np.float32).reshape(-1), splits)
+
+        # 预分词：每个 query 只分词一次，所有 doc 一次批量分词；每对只保留放得下的 token
+        special = tokenizer.num_special_tokens_to_add(pair=True)
+        query_ids = [
+            ids[:self.max_query_tokens]
+            for ids in tokenizer([query for query, _ in requests], add_special_tokens=False)['input_ids']
+        ]
+        owners = [qi for qi, size in enumerate(sizes) for _ in range(size)]
+        doc_ids = tokenizer([doc for _, docs in requests for doc in docs], add_special_tokens=False)['input_ids']
+        pairs = [
+            (query_ids[qi], ids[:max(1, self.max_length - special - len(query_ids[qi]))])
+            for qi, ids in zip(owners, doc_ids)
+        ]
+        lengths = np.array([len(q) + len(d) + special for q, d in pairs], dtype=np.int64)
+
+        logits = np.empty(len(pairs), dtype=np.float32)
+        for batch in plan_batches(lengths, self.batch_token_budget(), self.max_batch_size):
+            start = time.perf_counter()
+            logits[batch] = self._forward(tokenizer, hf_model, [pairs[i] for i in batch])
+            self._observe(
+                len(batch), int(lengths[batch].sum()), int(lengths[batch].max()) * len(batch),
+                time.perf_counter() - start
+            )
+        return np.split(logits, splits)
+
+    @staticmethod
+    def _forward(tokenizer, hf_model, pairs: List[Tuple[List[int], List[int]]]) -> np.ndarray:
+        """一批已截断的 (query, doc) token 序列过 Cross-Encoder，返回 logit"""
+        import torch
+
+        features = [
+            tokenizer.prepare_for_model(query_ids, doc_ids, add_special_tokens=True, truncation=False)
+            for query_ids, doc_ids in pairs
+        ]
+        inputs = tokenizer.pad(features, padding=True, return_tensors='pt')
+        device = next(hf_model.parameters()).device
+        with torch.inference_mode():
+            output = hf_model(**{name: tensor.to(device) for name, tensor in inputs.items()})
+        return output.logits.reshape(-1).float().cpu().numpy()
+
+    def _observe(self, pairs: int, real_tokens: int, padded_tokens: int, elapsed: float):
+        with self._stats_lock:
+            self.batches += 1
+            self.pairs += pairs
+            self.real_tokens += real_tokens
+            self.padded_tokens += padded_tokens
+            if elapsed > 0:
+                rate = padded_tokens / elapsed
+                self._tokens_per_sec = rate if self._tokens_per_sec is None else 0.8 * self._tokens_per_sec + 0.2 * rate
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "batches": self.batches,
+            "pairs": self.pairs,
+            "padding_efficiency": round(self.real_tokens / self.padded_tokens, 4) if self.padded_tokens else 1.0,
+            "tokens_per_sec": round(self._tokens_per_sec, 1) if self._tokens_per_sec else None,
+            "batch_token_budget": self.batch_token_budget(),
+            "score_cache": {"enabled": self.score_cache_enabled, **self.score_cache.stats()},
+            "micro_batch": self.batcher.stats() if self.batcher is not None else None
+        }
 
 
 # 全局实例
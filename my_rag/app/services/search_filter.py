@@ -0,0 +1,75 @@
+"""
+检索过滤条件
+同一份过滤条件分别下推到 Milvus（标量过滤表达式 / partition key）和
+Elasticsearch（bool.filter 子句），两路召回都在服务端缩小范围
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+
+class SearchFilter:
+    """按文档 ID、租户、标签过滤检索范围"""
+
+    def __init__(
+        self,
+        document_ids: Optional[List[int]] = None,
+        tenant_id: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ):
+        """
+        Args:
+            document_ids: 只在这些文档中检索
+            tenant_id: 租户 ID（Milvus 中为 partition key）
+            tags: 命中任一标签即可
+        """
+        self.document_ids = [int(d) for d in document_ids] if document_ids else []
+        self.tenant_id = tenant_id or None
+        self.tags = list(tags) if tags else []
+
+    @classmethod
+    def build(
+        cls,
+        document_ids: Optional[List[int]] = None,
+        tenant_id: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> Optional["SearchFilter"]:
+        """构造过滤条件，全部为空时返回 None（不过滤）"""
+        search_filter = cls(document_ids, tenant_id, tags)
+        return None if search_filter.is_empty() else search_filter
+
+    def is_empty(self) -> bool:
+        return not (self.document_ids or self.tenant_id or self.tags)
+
+    def to_milvus_expr(self) -> str:
+        """
+        转换为 Milvus 过滤表达式
+
+        Returns:
+            如 'document_id in [1, 2] and tenant_id == "t1" and array_contains_any(tags, ["a"])'
+        """
+        clauses = []
+        if self.document_ids:
+            clauses.append(f"document_id in {json.dumps(self.document_ids)}")
+        if self.tenant_id:
+            clauses.append(f"tenant_id == {json.dumps(self.tenant_id, ensure_ascii=False)}")
+        if self.tags:
+            clauses.append(f"array_contains_any(tags, {json.dumps(self.tags, ensure_ascii=False)})")
+        return " and ".join(clauses)
+
+    def to_es_filter(self) -> List[Dict[str, Any]]:
+        """转换为 Elasticsearch bool.filter 子句列表（不参与打分，可缓存）"""
+        clauses: List[Dict[str, Any]] = []
+        if self.document_ids:
+            clauses.append({"terms": {"document_id": self.document_ids}})
+        if self.tenant_id:
+            clauses.append({"term": {"tenant_id": self.tenant_id}})
+        if self.tags:
+            clauses.append({"terms": {"tags": self.tags}})
+        return clauses
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "document_ids": self.document_ids,
+            "tenant_id": self.tenant_id,
+            "tags": self.tags
+        }
@@ -0,0 +1,225 @@
+"""
+语义答案缓存
+按问题向量相似度查找历史问答，在检索之前命中，换种说法的重复问题直接返回答案，
+跳过召回、精排和 LLM 调用。
+
+- 索引：每个检索范围（过滤条件）一个进程内向量引擎（LocalVectorStore，纯内存）
+- 共享：条目追加写入 Redis 列表，各 worker 查找前按偏移量增量同步
+- 失效：知识库变化时递增代际号，旧代际的条目全部不可达，各 worker 下次查找时自动重建
+"""
+import hashlib
+import json
+import struct
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+from app.config import settings
+from app.services.search_filter import SearchFilter
+from app.services.vector_store import LocalVectorStore
+
+# 条目编码：4 字节头部长度 + JSON 头部 + float32 向量
+_HEADER_LEN = struct.Struct("<I")
+
+
+class SemanticCache:
+    """基于问题向量相似度的答案缓存"""
+
+    KEY_PREFIX = "rag:sem:"
+    GEN_KEY = "rag:sem:gen"
+
+    def __init__(self):
+        self.enabled = settings.SEMANTIC_CACHE_ENABLED
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD
+        self.max_entries = settings.SEMANTIC_CACHE_MAX_ENTRIES
+        self.ttl = settings.CACHE_TTL
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._offset = 0  # 已从 Redis 同步的条目数
+        self._stores: Dict[str, LocalVectorStore] = {}
+        self._entries: List[Dict[str, Any]] = []
+
+        # Redis 共享（可选），连接失败时仅在进程内缓存
+        self.redis_client = None
+        if self.enabled and settings.SEMANTIC_CACHE_REDIS_ENABLED:
+            try:
+                client = redis.Redis(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=settings.REDIS_DB,
+                    decode_responses=False,
+                    socket_connect_timeout=5
+                )
+                client.ping()
+                self.redis_client = client
+                print("✅ 语义缓存 Redis 共享已启用")
+            except Exception as e:
+                print(f"⚠️  语义缓存 Redis 连接失败，仅使用进程内缓存: {str(e)}")
+
+    @staticmethod
+    def scope_of(filters: Optional[SearchFilter]) -> str:
+        """检索范围标识：不同过滤条件下的答案互不复用"""
+        if filters is None or filters.is_empty():
+            return "all"
+        raw = json.dumps(filters.to_dict(), sort_keys=True, ensure_ascii=False)
+        return hashlib.md5(raw.encode('utf-8')).hexdigest()[:16]
+
+    def _list_key(self, generation: int) -> str:
+        return f"{self.KEY_PREFIX}entries:{generation}"
+
+    # ---------- 进程内索引 ----------
+
+    def _reset(self, generation: int):
+        self._generation = generation
+        self._offset = 0
+        self._stores = {}
+        self._entries = []
+
+    def _add_local(self, header: Dict[str, Any], vector: List[float]):
+        store = self._stores.get(header["s"])
+        if store is None:
+            store = self._stores[header["s"]] = LocalVectorStore(None, len(vector))
+        store.insert([{"vector": vector, "content": header["q"], "document_id": 0,
+                       "chunk_id": len(self._entries)}])
+        self._entries.append(header)
+
+    @staticmethod
+    def _encode(header: Dict[str, Any], vector: List[float]) -> bytes:
+        raw = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        return _HEADER_LEN.pack(len(raw)) + raw + array('f', vector).tobytes()
+
+    @staticmethod
+    def _decode(data: bytes) -> Tuple[Dict[str, Any], List[float]]:
+        (size,) = _HEADER_LEN.unpack_from(data)
+        header = json.loads(data[_HEADER_LEN.size:_HEADER_LEN.size + size].decode('utf-8'))
+        vector = array('f')
+        vector.frombytes(data[_HEADER_LEN.size + size:])
+        return header, vector.tolist()
+
+    def _sync(self):
+        """从 Redis 增量拉取其它 worker 写入的条目；代际变化时重建索引"""
+        if self.redis_client is None:
+            return
+        pipe = self.redis_client.pipeline()
+        pipe.get(self.GEN_KEY)
+        pipe.lrange(self._list_key(self._generation), self._offset, -1)
+        raw_generation, items = pipe.execute()
+
+        generation = int(raw_generation or 0)
+        if generation != self._generation:
+            self._reset(generation)
+            items = self.redis_client.lrange(self._list_key(generation), 0, -1)
+        for data in items:
+            self._add_local(*self._decode(data))
+        self._offset += len(items)
+
+    # ---------- 读写 ----------
+
+    def get(self, vector: List[float], filters: Optional[SearchFilter] = None) -> Optional[Dict[str, Any]]:
+        """
+        查找相似问题的缓存答案
+
+        Args:
+            vector: 问题向量
+            filters: 检索过滤条件
+
+        Returns:
+            {"question", "answer", "similarity"}，未命中返回 None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            try:
+                self._sync()
+            except Exception as e:
+                print(f"⚠️  语义缓存同步失败: {str(e)}")
+
+            store = self._stores.get(self.scope_of(filters))
+            hits = store.search([vector], limit=1, output_fields=["chunk_id"])[0] if store else []
+            if hits and hits[0]["distance"] >= self.threshold:
+                entry = self._entries[hits[0]["entity"]["chunk_id"]]
+                if time.time() - entry["t"] <= self.ttl:
+                    self.hits += 1
+                    return {"question": entry["q"], "answer": entry["a"], "similarity": hits[0]["distance"]}
+
+        self.misses += 1
+        return None
+
+    def set(
+        self,
+        question: str,
+        answer: str,
+        vector: List[float],
+        filters: Optional[SearchFilter] = None
+    ):
+        """
+        写入问答条目
+
+        Args:
+            question: 用户问题
+            answer: 答案
+            vector: 问题向量
+            filters: 检索过滤条件
+        """
+        if not self.enabled:
+            return
+
+        header = {"q": question, "a": answer, "s": self.scope_of(filters), "t": time.time()}
+        with self._lock:
+            # 条目数达到上限时整体翻代，保证内存有界
+            if len(self._entries) >= self.max_entries:
+                self._invalidate_locked()
+
+            if self.redis_client is None:
+                self._add_local(header, vector)
+                return
+            try:
+                key = self._list_key(self._generation)
+                pipe = self.redis_client.pipeline()
+                pipe.rpush(key, self._encode(header, vector))
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+                # 通过同步读回自己写入的条目，保持偏移量与 Redis 列表一致
+                self._sync()
+            except Exception as e:
+                print(f"⚠️  语义缓存写入失败: {str(e)}")
+
+    def _invalidate_locked(self):
+        old_key = self._list_key(self._generation)
+        if self.redis_client is None:
+            self._reset(self._generation + 1)
+            return
+        try:
+            generation = int(self.redis_client.incr(self.GEN_KEY))
+            self.redis_client.delete(old_key)
+        except Exception as e:
+            print(f"⚠️  语义缓存失效失败: {str(e)}")
+            generation = self._generation + 1
+        self._reset(generation)
+
+    def invalidate(self):
+        """知识库变化时调用：递增代际号，所有旧条目失效"""
+        with self._lock:
+            self._invalidate_locked()
+        print(f"✅ 语义缓存已失效 (generation={self._generation})")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "generation": self._generation,
+            "entries": len(self._entries),
+            "scopes": len(self._stores),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "redis": self.redis_client is not None
+        }
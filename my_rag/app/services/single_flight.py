@@ -0,0 +1,216 @@
+"""
+单飞请求合并（single-flight）
+同一问题（归一化后）同时只计算一次，其余请求等待并共享结果，避免缓存击穿时
+每个请求各自检索 + 调用 LLM
+
+- 进程内：同一个键的并发请求共享一个 asyncio.Future；计算者的请求被取消（如客户端断开）时
+  不把取消传给等待者，由等待者重新选出计算者
+- 跨 worker：Redis 短期锁（SET NX EX）选出唯一计算者，结果写入短期结果键，
+  其它 worker 轮询等待；计算者失败或超时后等待者自行计算
+- Redis 访问走 redis.asyncio，不阻塞事件循环；释放锁用 Lua 脚本比较令牌后删除（原子操作）
+"""
+import asyncio
+import hashlib
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import redis
+import redis.asyncio
+
+from app.config import settings
+from app.services.embedding_cache import normalize_text
+
+
+# 计算者被取消时写入共享 Future 的标记，等待者据此重新竞争计算者
+_ABANDONED = object()
+
+# 只删除自己持有的锁：GET 与 DEL 在 Redis 内原子执行，锁过期后被其它 worker 获取时不会误删
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """进程内 + 跨 worker 的请求合并"""
+
+    KEY_PREFIX = "rag:flight:"
+    POLL_INTERVAL = 0.05  # 跨 worker 等待时的轮询间隔（秒）
+
+    def __init__(self):
+        self.enabled = settings.SINGLE_FLIGHT_ENABLED
+        self.lock_ttl = settings.SINGLE_FLIGHT_LOCK_TTL
+        self.wait_timeout = settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+        self.result_ttl = max(1, self.lock_ttl // 3)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.coalesced_local = 0
+        self.coalesced_remote = 0
+        self.fallbacks = 0
+        self.handoffs = 0
+
+        # 跨 worker 合并依赖 Redis，连接失败时仅做进程内合并
+        self.redis_client: Optional[redis.asyncio.Redis] = None
+        if self.enabled:
+            options = dict(
+                host=settings.REDIS_HOST,
+                port=settings.REDIS_PORT,
+                db=settings.REDIS_DB,
+                decode_responses=True,
+                socket_connect_timeout=5
+            )
+            try:
+                # 启动时用同步客户端探测一次；请求路径上使用异步客户端
+                probe = redis.Redis(**options)
+                probe.ping()
+                probe.close()
+                self.use_redis(redis.asyncio.Redis(**options))
+            except Exception as e:
+                print(f"⚠️  单飞合并 Redis 连接失败，仅合并进程内请求: {str(e)}")
+
+    def use_redis(self, client: Optional[redis.asyncio.Redis]):
+        """设置跨 worker 合并使用的异步 Redis 客户端（None 表示仅合并进程内请求）"""
+        self.redis_client = client
+        self._release_script = client.register_script(_RELEASE_SCRIPT) if client is not None else None
+
+    @staticmethod
+    def make_key(question: str, scope: str = "all", kb_version: int = 0) -> str:
+        """
+        生成合并键：归一化问题 + 检索范围 + 知识库版本
+
+        Args:
+            question: 用户问题
+            scope: 检索范围标识
+            kb_version: 知识库版本号
+        """
+        content = f"{kb_version}\x00{scope}\x00{normalize_text(question)}"
+        return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        """
+        执行计算，同一键的并发调用只计算一次
+
+        Args:
+            key: 合并键
+            fn: 计算函数（返回协程），结果为字符串
+
+        Returns:
+            计算结果；计算者抛出异常时，进程内等待者收到同一异常
+        """
+        if not self.enabled:
+            return await fn()
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced_local += 1
+            while future is not None:
+                result = await asyncio.shield(future)
+                if result is not _ABANDONED:
+                    return result
+                # 计算者被取消：第一个醒来的等待者成为新的计算者，其余继续等待它
+                future = self._inflight.get(key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_across_workers(key, fn)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 无等待者时不报 "exception was never retrieved"
+            raise
+        except BaseException:
+            # 取消只属于计算者自己的请求，不传给等待者
+            self.handoffs += 1
+            future.set_result(_ABANDONED)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _run_across_workers(self, key: str, fn: Callable[[], Awaitable[str]]) -> str:
+        if self.redis_client is None:
+            self.leaders += 1
+            return await fn()
+
+        lock_key = f"{self.KEY_PREFIX}lock:{key}"
+        result_key = f"{self.KEY_PREFIX}result:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis_client.set(lock_key, token, nx=True, ex=self.lock_ttl)
+        except Exception as e:
+            print(f"⚠️  单飞锁获取失败: {str(e)}")
+            acquired = True
+            token = None
+
+        if acquired:
+            self.leaders += 1
+            try:
+                result = await fn()
+                if token is not None:
+                    try:
+                        await self.redis_client.setex(result_key, self.result_ttl, result)
+                    except Exception as e:
+                        print(f"⚠️  单飞结果写入失败: {str(e)}")
+                return result
+            finally:
+                if token is not None:
+                    await self._release(lock_key, token)
+
+        result = await self._wait_for_leader(lock_key, result_key)
+        if result is not None:
+            self.coalesced_remote += 1
+            return result
+        # 计算者失败或超时：自行计算
+        self.fallbacks += 1
+        return await fn()
+
+    async def _wait_for_leader(self, lock_key: str, result_key: str) -> Optional[str]:
+        """轮询其它 worker 的计算结果，锁释放但无结果时返回 None"""
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.POLL_INTERVAL)
+            try:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.get(result_key)
+                    pipe.exists(lock_key)
+                    result, locked = await pipe.execute()
+            except Exception as e:
+                print(f"⚠️  单飞等待失败: {str(e)}")
+                return None
+            if result is not None:
+                return result
+            if not locked:
+                return None
+        return None
+
+    async def _release(self, lock_key: str, token: str):
+        """只释放自己持有的锁（锁已过期被他人获取时不误删）"""
+        try:
+            await self._release_script(keys=[lock_key], args=[token])
+        except Exception as e:
+            print(f"⚠️  单飞锁释放失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "redis": self.redis_client is not None,
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced_local": self.coalesced_local,
+            "coalesced_remote": self.coalesced_remote,
+            "fallbacks": self.fallbacks,
+            "handoffs": self.handoffs
+        }
+
+    async def aclose(self):
+        """关闭 Redis 连接"""
+        if self.redis_client is not None:
+            await self.redis_client.aclose()
+
+
+# 创建全局实例
+single_flight = SingleFlight()
@@ -0,0 +1,589 @@
+"""
+向量存储后端
+- MilvusVectorStore：Milvus 服务端（生产默认）
+- LocalVectorStore：进程内向量引擎（NumPy memmap + 精确 top-k，可选 IVF 粗量化），
+  用于 Milvus 不可达时降级、CI / 边缘部署的零依赖本地模式，以及性能基线
+
+两种后端的检索结果格式一致（与 MilvusClient.search 相同）：
+每个查询一个列表，元素为 {"id", "distance", "entity": {...}}，distance 为 COSINE 相似度
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+from app.config import settings
+from app.services.search_filter import SearchFilter
+
+# Milvus schema 中标量字段的上限（VARCHAR 按 UTF-8 字节计），写入前需校验
+TENANT_ID_MAX_LENGTH = 64
+TAGS_MAX_CAPACITY = 32
+TAG_MAX_LENGTH = 64
+
+# 各索引类型的默认构建参数
+DEFAULT_INDEX_PARAMS: Dict[str, Dict[str, Any]] = {
+    "HNSW": {"M": 16, "efConstruction": 200},
+    "IVF_FLAT": {"nlist": 1024},
+    "IVF_PQ": {"nlist": 1024, "m": 48, "nbits": 8},  # m 需整除向量维度（384 / 48 = 8）
+    "DISKANN": {},
+}
+
+# 各索引类型的默认检索参数（召回率与延迟的权衡点）
+DEFAULT_SEARCH_PARAMS: Dict[str, Dict[str, Any]] = {
+    "HNSW": {"ef": 64},
+    "IVF_FLAT": {"nprobe": 16},
+    "IVF_PQ": {"nprobe": 16},
+    "DISKANN": {"search_list": 100},
+}
+
+
+def _load_json_params(raw: str, name: str) -> Dict[str, Any]:
+    """解析 JSON 格式的参数配置，非法时返回空字典"""
+    if not raw:
+        return {}
+    try:
+        params = json.loads(raw)
+        if isinstance(params, dict):
+            return params
+        print(f"⚠️  {name} 必须是 JSON 对象，已忽略: {raw}")
+    except json.JSONDecodeError as e:
+        print(f"⚠️  {name} 解析失败，已忽略: {e}")
+    return {}
+
+
+class VectorStore:
+    """向量存储接口"""
+
+    backend = "base"
+
+    def ensure_collection(self):
+        """创建集合（如果不存在）"""
+        raise NotImplementedError
+
+    def drop_collection(self):
+        """删除集合"""
+        raise NotImplementedError
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        """写入一批数据，每行含 vector 及标量字段"""
+        raise NotImplementedError
+
+    def search(
+        self,
+        vectors: List[List[float]],
+        limit: int,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        output_fields: Optional[List[str]] = None,
+        timeout: Optional[float] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """批量检索，返回每个查询向量的命中列表"""
+        raise NotImplementedError
+
+    def delete_by_document_id(self, document_id: int) -> int:
+        """删除指定文档的所有块"""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """集合中的条目数"""
+        raise NotImplementedError
+
+
+class MilvusVectorStore(VectorStore):
+    """Milvus 服务端存储"""
+
+    backend = "milvus"
+
+    def __init__(self, collection_name: str, dim: int):
+        self.collection_name = collection_name
+        self.dim = dim
+        self.client = MilvusClient(f"tcp://{settings.MILVUS_HOST}:{settings.MILVUS_PORT}")
+
+        # ANN 索引配置：构建参数与检索参数均可由配置覆盖
+        self.index_type = settings.MILVUS_INDEX_TYPE.upper()
+        if self.index_type not in DEFAULT_INDEX_PARAMS:
+            print(f"⚠️  不支持的索引类型 {self.index_type}，使用 HNSW")
+            self.index_type = "HNSW"
+        self.index_params = {
+            **DEFAULT_INDEX_PARAMS[self.index_type],
+            **_load_json_params(settings.MILVUS_INDEX_PARAMS, "MILVUS_INDEX_PARAMS")
+        }
+        self.search_params = {
+            **DEFAULT_SEARCH_PARAMS[self.index_type],
+            **_load_json_params(settings.MILVUS_SEARCH_PARAMS, "MILVUS_SEARCH_PARAMS")
+        }
+
+    def ensure_collection(self):
+        """创建集合（如果不存在）：显式 schema + 可配置 ANN 索引"""
+        if self.client.has_collection(self.collection_name):
+            return
+
+        schema = MilvusClient.create_schema(auto_id=True, enable_dynamic_field=True)
+        schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+        schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=self.dim)
+        schema.add_field(field_name="content", datatype=DataType.VARCHAR, max_length=65535)
+        schema.add_field(field_name="document_id", datatype=DataType.INT64)
+        schema.add_field(field_name="chunk_id", datatype=DataType.INT64)
+        # 租户作为 partition key：按租户过滤时只扫描对应分区
+        schema.add_field(
+            field_name="tenant_id",
+            datatype=DataType.VARCHAR,
+            max_length=TENANT_ID_MAX_LENGTH,
+            is_partition_key=settings.MILVUS_PARTITION_KEY_ENABLED
+        )
+        schema.add_field(
+            field_name="tags",
+            datatype=DataType.ARRAY,
+            element_type=DataType.VARCHAR,
+            max_capacity=TAGS_MAX_CAPACITY,
+            max_length=TAG_MAX_LENGTH
+        )
+
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(
+            field_name="vector",
+            index_type=self.index_type,
+            metric_type="COSINE",
+            params=self.index_params
+        )
+        # 标量倒排索引：过滤表达式走索引而非全量扫描
+        index_params.add_index(field_name="document_id", index_type="INVERTED")
+        index_params.add_index(field_name="tags", index_type="INVERTED")
+
+        self.client.create_collection(
+            collection_name=self.collection_name,
+            schema=schema,
+            index_params=index_params
+        )
+        print(f"✅ 创建Milvus集合：{self.collection_name} (索引: {self.index_type} {self.index_params})")
+
+    def drop_collection(self):
+        if self.client.has_collection(self.collection_name):
+            self.client.drop_collection(self.collection_name)
+            print(f"✅ 删除Milvus集合：{self.collection_name}")
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        self.client.insert(collection_name=self.collection_name, data=rows)
+
+    def search(
+        self,
+        vectors: List[List[float]],
+        limit: int,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        output_fields: Optional[List[str]] = None,
+        timeout: Optional[float] = None
+    ) -> List[List[Dict[str, Any]]]:
+        params = {**self.search_params, **(search_params or {})}
+        return self.client.search(
+            collection_name=self.collection_name,
+            data=vectors,
+            limit=limit,
+            search_params={"metric_type": "COSINE", "params": params},
+            filter=filters.to_milvus_expr() if filters else "",
+            output_fields=output_fields or ["content"],
+            timeout=timeout
+        )
+
+    def delete_by_document_id(self, document_id: int) -> int:
+        result = self.client.delete(
+            collection_name=self.collection_name,
+            filter=f"document_id == {int(document_id)}"
+        )
+        return result.get("delete_count", 0) if isinstance(result, dict) else 0
+
+    def count(self) -> int:
+        stats = self.client.get_collection_stats(self.collection_name)
+        return int(stats.get('row_count', 0))
+
+
+class LocalVectorStore(VectorStore):
+    """
+    进程内向量引擎
+
+    - 向量：float32 矩阵（持久化模式下为 memmap 文件，容量倍增扩展），写入时归一化
+    - 标量：id / document_id / 租户 / 标签存为与向量同容量扩展的 numpy 列，
+      租户和标签按字典编码，过滤条件直接计算为列掩码
+    - 检索：归一化点积 = COSINE，argpartition 取精确 top-k
+    - IVF：条目数达到 LOCAL_IVF_MIN_ROWS 后训练球面 k-means 粗量化器，
+      检索时只扫描最近的 nprobe 个簇 + 训练后新写入的尾部数据
+    """
+
+    backend = "local"
+
+    def __init__(self, path: Optional[str], dim: int):
+        """
+        Args:
+            path: 持久化目录，为空时纯内存运行
+            dim: 向量维度
+        """
+        self.path = path
+        self.dim = dim
+        self.search_params = {"nprobe": settings.LOCAL_IVF_NPROBE}
+        self._lock = threading.RLock()
+        self._reset()
+        if self.path:
+            self._load()
+
+    # ---------- 存储 ----------
+
+    def _reset(self):
+        self._capacity = 0
+        self._count = 0
+        self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._document_ids = np.zeros(0, dtype=np.int64)
+        self._tenant_codes = np.zeros(0, dtype=np.int32)  # 0 表示未设置租户
+        self._tag_matrix = np.zeros((0, 0), dtype=bool)  # 行 × 标签编码
+        self._tenant_vocab: Dict[str, int] = {}
+        self._tag_vocab: Dict[str, int] = {}
+        self._meta: List[Dict[str, Any]] = []
+        self._next_id = 1
+        self._invalidate_ivf()
+
+    def _invalidate_ivf(self):
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._ivf_rows = 0  # IVF 覆盖的行数，之后的行走精确扫描
+
+    @property
+    def _vector_file(self) -> str:
+        return os.path.join(self.path, "vectors.f32")
+
+    @property
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, "meta.jsonl")
+
+    def _load(self):
+        """从持久化目录加载：meta.jsonl 每行一条元数据，vectors.f32 为对应行的向量"""
+        os.makedirs(self.path, exist_ok=True)
+        self._recover_rewrite()
+        if not os.path.exists(self._meta_file):
+            return
+        with open(self._meta_file, "r", encoding="utf-8") as f:
+            meta = [json.loads(line) for line in f if line.strip()]
+        if not meta:
+            return
+        self._grow(len(meta))
+        self._index_rows(0, meta)
+        self._count = len(meta)
+        self._meta = meta
+        self._next_id = int(self._ids[:self._count].max()) + 1
+        print(f"✅ 本地向量库已加载: {self.path} ({self._count} 条)")
+        # IVF 不持久化，按加载的数据重新训练，避免重启后退化为全量扫描
+        self._maybe_build_ivf()
+
+    def _grow(self, required: int):
+        """确保容量不少于 required 行，容量按倍数扩展以摊薄扩容成本"""
+        if required <= self._capacity:
+            return
+        new_capacity = max(required, self._capacity * 2, 1024)
+        if self.path:
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+            # 扩展文件后重新映射；已有数据保留在文件中
+            with open(self._vector_file, "ab") as f:
+                f.truncate(new_capacity * self.dim * 4)
+            self._vectors = np.memmap(
+                self._vector_file, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim)
+            )
+        else:
+            vectors = np.zeros((new_capacity, self.dim), dtype=np.float32)
+            vectors[:self._count] = self._vectors[:self._count]
+            self._vectors = vectors
+        self._ids = self._resize(self._ids, new_capacity)
+        self._document_ids = self._resize(self._document_ids, new_capacity)
+        self._tenant_codes = self._resize(self._tenant_codes, new_capacity)
+        self._tag_matrix = self._resize(self._tag_matrix, new_capacity)
+        self._capacity = new_capacity
+
+    def _resize(self, column: np.ndarray, capacity: int) -> np.ndarray:
+        """按新容量重新分配标量列，保留已有的 _count 行"""
+        resized = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+        resized[:self._count] = column[:self._count]
+        return resized
+
+    def _index_rows(self, start: int, meta: List[Dict[str, Any]]):
+        """把元数据写入从 start 开始的标量列（容量需已足够）"""
+        for row, m in enumerate(meta, start):
+            self._ids[row] = m["id"]
+            self._document_ids[row] = m.get("document_id") or 0
+            tenant_id = m.get("tenant_id")
+            if tenant_id:
+                self._tenant_codes[row] = self._tenant_vocab.setdefault(tenant_id, len(self._tenant_vocab) + 1)
+            for tag in m.get("tags") or []:
+                code = self._tag_code(tag)  # 可能加列，需先于取矩阵
+                self._tag_matrix[row, code] = True
+
+    def _tag_code(self, tag: str) -> int:
+        """标签编码；标签数超过矩阵列数时按倍数加列"""
+        code = self._tag_vocab.setdefault(tag, len(self._tag_vocab))
+        width = self._tag_matrix.shape[1]
+        if code >= width:
+            matrix = np.zeros((self._tag_matrix.shape[0], max(8, width * 2)), dtype=bool)
+            matrix[:, :width] = self._tag_matrix
+            self._tag_matrix = matrix
+        return code
+
+    def ensure_collection(self):
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    def drop_collection(self):
+        with self._lock:
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+            if self.path:
+                for file in (self._vector_file, self._meta_file,
+                             self._vector_file + ".tmp", self._meta_file + ".tmp"):
+                    if os.path.exists(file):
+                        os.remove(file)
+            self._reset()
+            print(f"✅ 删除本地向量库：{self.path or '(memory)'}")
+
+    def insert(self, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        vectors = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.clip(norms, 1e-12, None)
+
+        with self._lock:
+            start = self._count
+            self._grow(start + len(rows))
+            self._vectors[start:start + len(rows)] = vectors
+
+            meta = []
+            for row in rows:
+                item = {k: v for k, v in row.items() if k != "vector"}
+                item["id"] = self._next_id
+                self._next_id += 1
+                meta.append(item)
+
+            self._meta.extend(meta)
+            self._index_rows(start, meta)
+            self._count += len(rows)
+
+            if self.path:
+                self._vectors.flush()
+                with open(self._meta_file, "a", encoding="utf-8") as f:
+                    for m in meta:
+                        f.write(json.dumps(m, ensure_ascii=False) + "\n")
+
+            self._maybe_build_ivf()
+
+    def delete_by_document_id(self, document_id: int) -> int:
+        """删除并压缩存储（删除是低频操作，直接重写）"""
+        with self._lock:
+            keep = np.flatnonzero(self._document_ids[:self._count] != int(document_id))
+            deleted = self._count - len(keep)
+            if deleted == 0:
+                return 0
+
+            vectors = np.array(self._vectors[keep])
+            meta = [self._meta[i] for i in keep]
+            columns = (self._ids[keep], self._document_ids[keep], self._tenant_codes[keep], self._tag_matrix[keep])
+            self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self._capacity = 0
+            self._count = 0
+            self._invalidate_ivf()
+            if self.path:
+                self._rewrite_files(vectors, meta)
+            # 持久化时从新文件映射，已含压缩后的向量
+            self._grow(len(meta))
+            if not self.path:
+                self._vectors[:len(meta)] = vectors
+            (self._ids[:len(meta)], self._document_ids[:len(meta)],
+             self._tenant_codes[:len(meta)], self._tag_matrix[:len(meta)]) = columns
+            self._count = len(meta)
+            self._meta = meta
+
+            self._maybe_build_ivf()
+            return deleted
+
+    def _rewrite_files(self, vectors: np.ndarray, meta: List[Dict[str, Any]]):
+        """
+        压缩后重写两个持久化文件：先完整写入临时文件，再 os.replace，不会留下写了一半的文件
+
+        向量文件替换是提交点：之前崩溃保留旧数据，之后崩溃由 _recover_rewrite 在加载时补完元数据
+        """
+        vector_tmp, meta_tmp = self._vector_file + ".tmp", self._meta_file + ".tmp"
+        # 先写向量再写元数据：元数据临时文件存在而向量临时文件不存在，说明已过提交点
+        with open(vector_tmp, "wb") as f:
+            vectors.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            for m in meta:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(vector_tmp, self._vector_file)
+        os.replace(meta_tmp, self._meta_file)
+
+    def _recover_rewrite(self):
+        """处理上次重写中途崩溃留下的临时文件：未到提交点则丢弃，已过提交点则补完元数据"""
+        vector_tmp, meta_tmp = self._vector_file + ".tmp", self._meta_file + ".tmp"
+        if os.path.exists(vector_tmp):
+            for file in (vector_tmp, meta_tmp):
+                if os.path.exists(file):
+                    os.remove(file)
+            print(f"⚠️  丢弃未完成的向量库重写: {self.path}")
+        elif os.path.exists(meta_tmp):
+            os.replace(meta_tmp, self._meta_file)
+            print(f"⚠️  已补完中断的向量库重写: {self.path}")
+
+    def count(self) -> int:
+        return self._count
+
+    # ---------- IVF 粗量化 ----------
+
+    def _maybe_build_ivf(self):
+        """条目数达到阈值且新增数据超过已索引量的 20% 时（重新）训练 IVF"""
+        if self._count < settings.LOCAL_IVF_MIN_ROWS:
+            if self._centroids is not None:
+                self._invalidate_ivf()
+            return
+        if self._centroids is not None and self._count - self._ivf_rows <= self._ivf_rows * 0.2:
+            return
+        self._build_ivf()
+
+    def _build_ivf(self, iterations: int = 10):
+        n = self._count
+        nlist = settings.LOCAL_IVF_NLIST or int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+        data = self._vectors[:n]
+
+        rng = np.random.default_rng(0)
+        sample_size = min(n, nlist * 64)
+        sample = data[rng.choice(n, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+
+        # 球面 k-means：按点积分配，质心重新归一化
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        assign = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+        self._centroids = centroids
+        self._ivf_rows = n
+        print(f"✅ 本地向量库 IVF 训练完成: nlist={nlist}, rows={n}")
+
+    # ---------- 检索 ----------
+
+    def _filter_mask(self, filters: SearchFilter) -> np.ndarray:
+        n = self._count
+        mask = np.ones(n, dtype=bool)
+        if filters.document_ids:
+            mask &= np.isin(self._document_ids[:n], filters.document_ids)
+        if filters.tenant_id:
+            code = self._tenant_vocab.get(filters.tenant_id)
+            if code is None:
+                return np.zeros(n, dtype=bool)
+            mask &= self._tenant_codes[:n] == code
+        if filters.tags:
+            codes = [self._tag_vocab[tag] for tag in filters.tags if tag in self._tag_vocab]
+            mask &= self._tag_matrix[:n, codes].any(axis=1)  # 标签都不存在时全为 False
+        return mask
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """IVF 候选行号；未训练 IVF 时返回 None（全量扫描）"""
+        if self._centroids is None:
+            return None
+        nprobe = max(1, min(nprobe, len(self._lists)))
+        probe = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        tail = np.arange(self._ivf_rows, self._count)
+        return np.concatenate([self._lists[c] for c in probe] + [tail])
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, limit: int) -> np.ndarray:
+        """argpartition 选出 top-k，再对这 k 个排序"""
+        k = min(limit, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        part = np.argpartition(-scores, k - 1)[:k]
+        return part[np.argsort(-scores[part], kind="stable")]
+
+    def search(
+        self,
+        vectors: List[List[float]],
+        limit: int,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[SearchFilter] = None,
+        output_fields: Optional[List[str]] = None,
+        timeout: Optional[float] = None
+    ) -> List[List[Dict[str, Any]]]:
+        params = {**self.search_params, **(search_params or {})}
+        fields = output_fields or ["content"]
+        queries = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        queries = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+
+        with self._lock:
+            n = self._count
+            if n == 0:
+                return [[] for _ in range(len(queries))]
+            data = self._vectors[:n]
+            mask = self._filter_mask(filters) if filters else None
+
+            # 无 IVF 时一次矩阵乘法完成所有查询的打分
+            all_scores = data @ queries.T if self._centroids is None else None
+
+            results = []
+            for qi, query in enumerate(queries):
+                if all_scores is not None:
+                    rows = np.arange(n) if mask is None else np.flatnonzero(mask)
+                    scores = all_scores[rows, qi]
+                else:
+                    rows = self._candidates(query, int(params.get("nprobe", 1)))
+                    if mask is not None:
+                        rows = rows[mask[rows]]
+                    scores = data[rows] @ query
+
+                hits = []
+                for pos in self._top_k(scores, limit):
+                    row = int(rows[pos])
+                    meta = self._meta[row]
+                    hits.append({
+                        "id": int(self._ids[row]),
+                        "distance": float(scores[pos]),
+                        "entity": {f: meta.get(f) for f in fields}
+                    })
+                results.append(hits)
+            return results
+
+
+def create_vector_store(collection_name: str, dim: int) -> Optional[VectorStore]:
+    """
+    按 VECTOR_STORE 配置创建存储后端
+
+    - milvus：仅使用 Milvus，连接失败返回 None（向量检索不可用）
+    - local：仅使用进程内向量引擎
+    - auto：优先 Milvus，连接失败时降级为进程内向量引擎
+    """
+    backend = settings.VECTOR_STORE.lower()
+    local_path = (
+        os.path.join(settings.LOCAL_VECTOR_STORE_DIR, collection_name)
+        if settings.LOCAL_VECTOR_STORE_DIR else None
+    )
+
+    if backend == "local":
+        print("✅ 使用本地向量引擎")
+        return LocalVectorStore(local_path, dim)
+
+    try:
+        return MilvusVectorStore(collection_name, dim)
+    except Exception as e:
+        if backend == "auto":
+            print(f"⚠️  Milvus 连接失败，降级为本地向量引擎: {str(e)}")
+            return LocalVectorStore(local_path, dim)
+        print(f"⚠️  Milvus 连接失败，向量检索功能不可用: {str(e)}")
+        return None
@@ -0,0 +1,264 @@
+"""
+离线压测用的 OpenAI 兼容 LLM 模拟服务
+不依赖 GPU / 云端 API，按可配置的延迟分布和 token 速率返回确定性的回答，
+使 /api/chat 和 /api/agent/chat 全链路可以在离线环境下带着真实的 LLM 时延压测
+
+- POST /v1/chat/completions：支持 stream（SSE，以 data: [DONE] 结束）与 tools（返回预设 tool_calls）
+- GET  /v1/models
+- 首 token 延迟服从对数正态分布（中位数 + sigma），之后按固定 token 速率输出
+- 同一请求体 + 同一 seed 得到相同的回答和延迟
+
+运行:
+    python scripts/mock_llm_server.py --port 9000 --ttft-ms 400 --ttft-sigma 0.4 --tokens-per-sec 40
+应用侧:
+    USE_LOCAL_LLM=true LOCAL_LLM_BASE_URL=http://localhost:9000/v1 python run.py
+
+预设工具调用（--tool-calls rules.json），按顺序匹配最后一条用户消息，命中即返回：
+    [{"match": "多少|计算", "name": "calculator", "arguments": {"expression": "1+1"}},
+     {"match": ".*", "name": "search_knowledge_base", "arguments": {"query": "{question}"}}]
+未配置时，请求携带 search_knowledge_base 工具且尚无工具结果则调用它检索用户问题，否则直接回答
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_VOCAB = (
+    "根据 上下文 文档 中 提到 的 内容 ， 该 问题 可以 从 以下 几个 方面 回答 。 "
+    "首先 系统 通过 向量 检索 和 关键词 检索 召回 候选 片段 ， 然后 使用 精排 模型 排序 。 "
+    "其次 答案 需要 基于 知识库 不要 编造 。 最后 如果 信息 不足 请 说明 无法 回答 。"
+).split()
+
+
+class MockConfig:
+    """模拟服务参数"""
+
+    def __init__(
+        self,
+        model: str = "mock-llm",
+        ttft_ms: float = 400.0,
+        ttft_sigma: float = 0.4,
+        tokens_per_sec: float = 40.0,
+        answer_tokens: int = 120,
+        seed: int = 0,
+        tool_rules: Optional[List[Dict[str, Any]]] = None
+    ):
+        """
+        Args:
+            model: 返回的模型名
+            ttft_ms: 首 token 延迟中位数（毫秒）
+            ttft_sigma: 首 token 延迟对数正态分布的 sigma，0 表示固定延迟
+            tokens_per_sec: 生成速率（token/秒），0 表示不限速
+            answer_tokens: 回答长度（token）
+            seed: 随机种子
+            tool_rules: 预设工具调用规则
+        """
+        self.model = model
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.seed = seed
+        self.tool_rules = tool_rules
+
+
+def _last_user_message(messages: List[Dict[str, Any]]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def _fill_question(value: Any, question: str) -> Any:
+    """把参数值中的 {question} 替换为用户问题（递归处理嵌套的 dict / list，只替换字符串值）"""
+    if isinstance(value, str):
+        return value.replace("{question}", question)
+    if isinstance(value, dict):
+        return {k: _fill_question(v, question) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_fill_question(v, question) for v in value]
+    return value
+
+
+def _question_of(prompt: str) -> str:
+    """从 RAG 提示词中取出“问题：”一行，非 RAG 提示词原样返回"""
+    match = re.search(r"问题：(.+)", prompt)
+    return match.group(1).strip() if match else prompt.strip()
+
+
+class MockLLM:
+    """按请求体确定性地生成回答、工具调用和延迟"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.requests = 0
+
+    def _rng(self, body: Dict[str, Any]) -> random.Random:
+        digest = hashlib.md5(
+            json.dumps(body.get("messages", []), ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return random.Random(f"{self.config.seed}:{digest}")
+
+    def ttft(self, rng: random.Random) -> float:
+        """首 token 延迟（秒）"""
+        median = self.config.ttft_ms / 1000
+        if self.config.ttft_sigma <= 0:
+            return median
+        return rng.lognormvariate(math.log(max(median, 1e-6)), self.config.ttft_sigma)
+
+    def token_interval(self) -> float:
+        return 1.0 / self.config.tokens_per_sec if self.config.tokens_per_sec > 0 else 0.0
+
+    def answer_tokens(self, rng: random.Random, question: str) -> List[str]:
+        head = f"关于“{question[:30]}”，"
+        return [head] + [rng.choice(_VOCAB) for _ in range(max(0, self.config.answer_tokens - 1))]
+
+    def tool_calls(self, body: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """返回本轮应发出的工具调用；已有工具结果或未携带工具时返回 None"""
+        tools = body.get("tools") or []
+        messages = body.get("messages") or []
+        if not tools or any(m.get("role") == "tool" for m in messages):
+            return None
+        offered = {t.get("function", {}).get("name") for t in tools}
+        question = _last_user_message(messages)
+
+        rules = self.config.tool_rules
+        if rules is None:
+            rules = [{"match": ".*", "name": "search_knowledge_base", "arguments": {"query": "{question}"}}]
+        for index, rule in enumerate(rules):
+            if rule.get("name") not in offered or not re.search(rule.get("match", ".*"), question):
+                continue
+            # 在解析后的参数值上替换再序列化，问题中的引号 / 反斜杠由 json.dumps 转义
+            arguments = _fill_question(rule.get("arguments", {}), question)
+            return [{
+                "id": f"call_{index}_{hashlib.md5(question.encode('utf-8')).hexdigest()[:8]}",
+                "type": "function",
+                "function": {"name": rule["name"], "arguments": json.dumps(arguments, ensure_ascii=False)}
+            }]
+        return None
+
+    @staticmethod
+    def usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+        # 粗略按字符数估算提示词 token
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """创建模拟服务应用（测试中可直接配合 httpx.ASGITransport 使用）"""
+    mock = MockLLM(config or MockConfig())
+    app = FastAPI(title="Mock OpenAI-compatible LLM")
+    app.state.mock = mock
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": mock.config.model, "object": "model", "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        mock.requests += 1
+        rng = mock._rng(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        ttft = mock.ttft(rng)
+        interval = mock.token_interval()
+
+        tool_calls = mock.tool_calls(body)
+        tokens = [] if tool_calls else mock.answer_tokens(rng, _question_of(_last_user_message(body.get("messages", []))))
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + interval * max(0, len(tokens) - 1))
+            message: Dict[str, Any] = {"role": "assistant", "content": "".join(tokens)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": mock.config.model,
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "tool_calls" if tool_calls else "stop"
+                }],
+                "usage": MockLLM.usage(body, len(tokens))
+            })
+
+        async def events():
+            def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+                return "data: " + json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": mock.config.model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                }, ensure_ascii=False) + "\n\n"
+
+            await asyncio.sleep(ttft)
+            yield chunk({"role": "assistant", "content": ""})
+            if tool_calls:
+                yield chunk({"tool_calls": [dict(call, index=i) for i, call in enumerate(tool_calls)]})
+            for i, token in enumerate(tokens):
+                if i and interval:
+                    await asyncio.sleep(interval)
+                yield chunk({"content": token})
+            yield chunk({}, "tool_calls" if tool_calls else "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的 LLM 模拟服务（离线压测）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--model", default="mock-llm")
+    parser.add_argument("--ttft-ms", type=float, default=400.0, help="首 token 延迟中位数（毫秒）")
+    parser.add_argument("--ttft-sigma", type=float, default=0.4, help="首 token 延迟对数正态 sigma，0 为固定延迟")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0, help="生成速率，0 为不限速")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="回答长度（token）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tool-calls", default="", help="预设工具调用规则 JSON 文件")
+    args = parser.parse_args()
+
+    tool_rules = None
+    if args.tool_calls:
+        with open(args.tool_calls, encoding="utf-8") as f:
+            tool_rules = json.load(f)
+
+    import uvicorn
+
+    config = MockConfig(
+        model=args.model,
+        ttft_ms=args.ttft_ms,
+        ttft_sigma=args.ttft_sigma,
+        tokens_per_sec=args.tokens_per_sec,
+        answer_tokens=args.answer_tokens,
+        seed=args.seed,
+        tool_rules=tool_rules
+    )
+    print(
+        f"🧪 Mock LLM: http://{args.host}:{args.port}/v1 "
+        f"(TTFT 中位数 {args.ttft_ms:.0f}ms, sigma {args.ttft_sigma}, {args.tokens_per_sec} tokens/s)"
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
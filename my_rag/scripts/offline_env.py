@@ -0,0 +1,188 @@
+"""
+离线单元测试环境（各 scripts/test_*.py 的 --offline 用例共用）
+
+- fake app.config：绕过 pydantic_settings，配置项集中在 FakeSettings，用例可临时改写
+- Stub 掉 Milvus / ES / 模型等重依赖，用 importlib 按依赖顺序加载 app/services 下的模块
+- 导入本模块即完成加载，之后从 sys.modules 取服务模块
+"""
+import os
+import sys
+import types
+import importlib.util
+from unittest.mock import MagicMock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = os.path.join(ROOT, 'app', 'services')
+
+
+# ---------- 1. 构造 fake app.config（绕过 pydantic_settings）----------
+class FakeSettings:
+    RERANK_ENABLED = False          # 关闭，避免下载模型
+    RERANK_MODEL = "BAAI/bge-reranker-base"
+    RECALL_TOP_K = 30
+    RERANK_TOP_K = 5
+    RERANK_SCORE_THRESHOLD = 0.3
+    RERANK_MAX_LENGTH = 64
+    RERANK_MAX_QUERY_TOKENS = 8
+    RERANK_MAX_BATCH_SIZE = 4
+    RERANK_BATCH_LATENCY_MS = 50
+    RERANK_BATCH_TOKENS = 200
+    RERANK_CACHE_ENABLED = True
+    RERANK_CACHE_SIZE = 1000
+    RERANK_CASCADE_ENABLED = True
+    RERANK_CASCADE_SHORTLIST = 3
+    RERANK_SKIP_MARGIN = 0.35
+    MODEL_WORKERS_ENABLED = False
+    MODEL_WORKERS = 0
+    MODEL_WORKER_THREADS = 0
+    MODEL_WORKERS_PRELOAD = False
+    MODEL_WORKERS_ADDRESS = ""
+    MODEL_WORKERS_AUTHKEY = "test-authkey"
+    MODEL_WORKERS_CONNECTIONS = 2
+    MODEL_WORKERS_TIMEOUT = 5
+    MICRO_BATCH_ENABLED = False
+    MICRO_BATCH_WAIT_MS = 20
+    EMBEDDING_MICRO_BATCH_MAX = 8
+    RERANK_MICRO_BATCH_MAX = 4
+    CONTEXT_PACKING_ENABLED = True
+    CONTEXT_TOKEN_BUDGET = 1500
+    CONTEXT_MIN_CHUNK_TOKENS = 10
+    CONTEXT_TOKENIZER = ""
+    VECTOR_DISTANCE_THRESHOLD = 0.5
+    VECTOR_WEIGHT = 0.6
+    KEYWORD_WEIGHT = 0.4
+    RECALL_PARALLEL_ENABLED = True
+    RECALL_POOL_SIZE = 4
+    VECTOR_RECALL_TIMEOUT_MS = 200
+    KEYWORD_RECALL_TIMEOUT_MS = 200
+    RECALL_BATCH_TIMEOUT_PER_QUERY_MS = 100
+    VECTOR_STORE = "milvus"
+    LOCAL_VECTOR_STORE_DIR = ""
+    LOCAL_IVF_MIN_ROWS = 50000
+    LOCAL_IVF_NLIST = 0
+    LOCAL_IVF_NPROBE = 8
+    MILVUS_INDEX_TYPE = "HNSW"
+    MILVUS_INDEX_PARAMS = ""
+    MILVUS_SEARCH_PARAMS = ""
+    EMBEDDING_BACKEND = "torch"
+    EMBEDDING_BATCH_SIZE = 32
+    MILVUS_INSERT_BATCH_SIZE = 2
+    DEFAULT_TENANT_ID = "default"
+    EMBEDDING_BACKEND_VALIDATE = True
+    EMBEDDING_VALIDATION_MIN_COSINE = 0.99
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_SIZE = 100
+    EMBEDDING_CACHE_REDIS_ENABLED = False
+    EMBEDDING_CACHE_TTL = 60
+    CACHE_TTL = 3600
+    ANSWER_CACHE_L1_ENABLED = False  # 不启动订阅线程，用例中手动挂 L1
+    ANSWER_CACHE_L1_SIZE = 100
+    ANSWER_CACHE_L1_TTL = 60
+    CACHE_COMPRESS_MIN_BYTES = 256
+    CACHE_REFRESH_AHEAD_ENABLED = False
+    CACHE_REFRESH_AHEAD_WINDOW = 300
+    SINGLE_FLIGHT_ENABLED = True
+    SINGLE_FLIGHT_LOCK_TTL = 30
+    SINGLE_FLIGHT_WAIT_TIMEOUT = 5
+    LLM_HTTP2 = False
+    LLM_POOL_MAX_CONNECTIONS = 10
+    LLM_POOL_MAX_KEEPALIVE = 5
+    LLM_POOL_KEEPALIVE_EXPIRY = 60
+    LLM_CONNECT_TIMEOUT = 5
+    LLM_READ_TIMEOUT = 30
+    LLM_MAX_CONCURRENCY = 4
+    LLM_RETRY_MAX_ATTEMPTS = 3
+    LLM_RETRY_BASE_DELAY = 0.001
+    LLM_RETRY_MAX_DELAY = 0.01
+    LLM_HEDGE_ENABLED = False
+    LLM_HEDGE_PERCENTILE = 95
+    LLM_HEDGE_MIN_DELAY = 0.05
+    LLM_BREAKER_FAILURE_RATE = 0.5
+    LLM_BREAKER_MIN_REQUESTS = 4
+    LLM_BREAKER_WINDOW = 60
+    LLM_BREAKER_COOLDOWN = 0.2
+    USE_LOCAL_LLM = False
+    LOCAL_LLM_BASE_URL = "http://mock-llm/v1"
+    LOCAL_LLM_MODEL = "mock-llm"
+    LOCAL_LLM_API_KEY = ""
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_THRESHOLD = 0.9
+    SEMANTIC_CACHE_MAX_ENTRIES = 100
+    SEMANTIC_CACHE_REDIS_ENABLED = False
+    MYSQL_USER = "rag"
+    MYSQL_PASSWORD = "rag"
+    MYSQL_HOST = "127.0.0.1"
+    MYSQL_PORT = 3306
+    MYSQL_DATABASE = "rag_db"
+    REDIS_HOST = "127.0.0.1"
+    REDIS_PORT = 6379
+    REDIS_DB = 0
+
+    def __getattr__(self, name):
+        # 其它配置项（MILVUS_HOST 等）实例化时只是被引用，返回 MagicMock 即可
+        return MagicMock()
+
+
+fake_config = types.ModuleType('app.config')
+fake_config.settings = FakeSettings()
+sys.modules['app'] = types.ModuleType('app')
+sys.modules['app.services'] = types.ModuleType('app.services')
+sys.modules['app.config'] = fake_config
+
+# ---------- 2. Stub 外部依赖 ----------
+# redis 使用真实客户端：单元测试注入 fakeredis（见 requirements-test.txt），服务实例连不上本机 Redis 时自动降级
+for m in ['elasticsearch', 'elasticsearch.helpers', 'pymilvus', 'sentence_transformers']:
+    sys.modules[m] = MagicMock()
+
+
+# ---------- 3. 用 importlib 手动加载服务模块 ----------
+def load(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules[name] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+load('app.services.local_cache', os.path.join(SERVICES, 'local_cache.py'))
+load('app.services.embedding_backend', os.path.join(SERVICES, 'embedding_backend.py'))
+load('app.services.embedding_cache', os.path.join(SERVICES, 'embedding_cache.py'))
+load('app.services.search_filter', os.path.join(SERVICES, 'search_filter.py'))
+load('app.services.vector_store', os.path.join(SERVICES, 'vector_store.py'))
+workers_mod = load('app.services.model_workers', os.path.join(SERVICES, 'model_workers.py'))
+batcher_mod = load('app.services.micro_batcher', os.path.join(SERVICES, 'micro_batcher.py'))
+load('app.services.milvus_service', os.path.join(SERVICES, 'milvus_service.py'))
+load('app.services.elasticsearch_service', os.path.join(SERVICES, 'elasticsearch_service.py'))
+semantic_mod = load('app.services.semantic_cache', os.path.join(SERVICES, 'semantic_cache.py'))
+cache_mod = load('app.services.cache_service', os.path.join(SERVICES, 'cache_service.py'))
+flight_mod = load('app.services.single_flight', os.path.join(SERVICES, 'single_flight.py'))
+resilience_mod = load('app.services.llm_resilience', os.path.join(SERVICES, 'llm_resilience.py'))
+llm_mod = load('app.services.llm_service', os.path.join(SERVICES, 'llm_service.py'))
+local_llm_mod = load('app.services.local_llm_service', os.path.join(SERVICES, 'local_llm_service.py'))
+load('app.services.candidate', os.path.join(SERVICES, 'candidate.py'))
+packer_mod = load('app.services.context_packer', os.path.join(SERVICES, 'context_packer.py'))
+rerank_mod = load('app.services.rerank_service', os.path.join(SERVICES, 'rerank_service.py'))
+cascade_mod = load('app.services.rerank_cascade', os.path.join(SERVICES, 'rerank_cascade.py'))
+hybrid_mod = load('app.services.hybrid_search_service', os.path.join(SERVICES, 'hybrid_search_service.py'))
+tools_mod = load('app.services.agent_tools', os.path.join(SERVICES, 'agent_tools.py'))
+agent_mod = load('app.services.agent_service', os.path.join(SERVICES, 'agent_service.py'))
+
+milvus_mod = sys.modules['app.services.milvus_service']
+SearchFilter = sys.modules['app.services.search_filter'].SearchFilter
+vector_store_mod = sys.modules['app.services.vector_store']
+
+
+def load_api(name):
+    """
+    加载 app/api 下的路由模块（需要 sqlalchemy / pymysql；数据库连接在首次查询时才建立，
+    用例中替换掉 conversation_service 即可不连 MySQL）
+    """
+    if 'app.database' not in sys.modules:
+        sys.modules['app.models'] = types.ModuleType('app.models')
+        sys.modules['app.api'] = types.ModuleType('app.api')
+        load('app.database', os.path.join(ROOT, 'app', 'database.py'))
+        load('app.models.database', os.path.join(ROOT, 'app', 'models', 'database.py'))
+        load('app.models.schemas', os.path.join(ROOT, 'app', 'models', 'schemas.py'))
+        load('app.services.conversation_service', os.path.join(SERVICES, 'conversation_service.py'))
+        load('app.services.document_service', os.path.join(SERVICES, 'document_service.py'))
+    return load(f'app.api.{name}', os.path.join(ROOT, 'app', 'api', f'{name}.py'))
@@ -1,7 +1,10 @@
 """
 Redis 缓存功能测试脚本
+运行: python scripts/test_cache.py            # 接口测试，需先启动服务
+      python scripts/test_cache.py --offline  # 离线单元测试，不依赖服务和 Redis
 """
 import requests
+import sys
 import time
 import json
 
@@ -130,5 +133,228 @@ def main():
         print("⚠️  部分测试失败，请检查日志")
     print("=" * 60)
 
+# ---------- 离线单元测试（服务模块由 offline_env 加载，Redis 用 fakeredis 代替）----------
+def test_semantic_cache():
+    from offline_env import SearchFilter, semantic_mod
+    cache = semantic_mod.SemanticCache()
+    scope = SearchFilter.build(tenant_id="t1")
+    cache.set("什么是 RAG？", "检索增强生成", [1.0, 0.0, 0.0, 0.0])
+    cache.set("什么是 RAG？", "租户 t1 的答案", [1.0, 0.0, 0.0, 0.0], scope)
+
+    hit = cache.get([0.98, 0.1, 0.0, 0.0])  # 换种说法：方向接近
+    assert hit and hit["answer"] == "检索增强生成" and hit["similarity"] >= 0.9
+    assert cache.get([0.98, 0.1, 0.0, 0.0], scope)["answer"] == "租户 t1 的答案", "不同检索范围互不复用"
+    assert cache.get([0.0, 1.0, 0.0, 0.0]) is None, "低于阈值不应命中"
+
+    cache.invalidate()
+    assert cache.get([1.0, 0.0, 0.0, 0.0]) is None, "知识库变化后旧答案应失效"
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["generation"] == 1
+    print(f"✅ test_semantic_cache 通过 (hit_rate={stats['hit_rate']})")
+
+
+
+
+def _cache_service():
+    """Redis 换成 fakeredis 的缓存服务实例"""
+    import fakeredis
+    from offline_env import cache_mod, semantic_mod
+    svc = cache_mod.CacheService()
+    svc.use_redis(fakeredis.FakeRedis())
+    svc.redis_client.info = lambda *args: {}  # fakeredis 未实现 INFO
+    svc.semantic_cache = semantic_mod.SemanticCache()
+    return svc
+
+
+def test_kb_version_invalidation():
+    svc = _cache_service()
+
+    svc.set_cached_answer("q", "a1", "ctx")
+    svc.set_cached_answer("q", "a1", "ctx")  # 覆盖写不重复计数
+    assert svc.get_cached_answer("q", "ctx") == "a1"
+    assert svc.get_generation_counts() == {0: 1}
+
+    assert svc.bump_kb_version() == 1
+    assert svc.get_cached_answer("q", "ctx") is None, "入库后旧版本条目不可达"
+    svc.set_semantic_answer("q", "stale", [1.0, 0.0], kb_version=0)
+    assert svc.get_semantic_answer([1.0, 0.0]) is None, "按旧版本生成的答案不应写入"
+
+    svc.set_cached_answer("q", "a2", "ctx")
+    assert svc.clear_all_cache() == 1 and svc.get_kb_version() == 2
+    print(f"✅ test_kb_version_invalidation 通过 ({svc.get_generation_counts()})")
+
+
+def test_answer_cache_l1():
+    import json
+    svc = _cache_service()
+    svc.local = sys.modules['app.services.local_cache'].LRUCache(10, ttl=60)
+    pubsub = svc.redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(svc.INVALIDATION_CHANNEL)
+
+    svc.set_cached_answer("q", "a1", "ctx")
+    svc.redis_client.delete(svc._generate_cache_key("q", "ctx"))  # L2 已无该条目，仍由 L1 命中
+    assert svc.get_cached_answer("q", "ctx") == "a1"
+    assert svc._tier_stats()["l1"]["hits"] == 1 and svc.redis_hits == 0
+    # L1 命中计入同一统计 hash：下一次 L2 查询时一并写入
+    svc.get_cached_answer("other", "ctx")
+    chat = svc.get_cache_stats()["namespaces"]["chat"]
+    assert (chat["hits"], chat["misses"]) == (1, 1), chat
+    assert svc.get_cached_answer("q", "ctx") == "a1"
+    assert svc.get_cache_stats()["namespaces"]["chat"]["hits"] == 2, "统计接口读取前写入累积的 L1 命中"
+
+    # 其它 worker 广播新版本：本地版本号前进，L1 清空
+    svc._listener_alive = True
+    svc._handle_invalidation('{"version": 5}')
+    assert svc.get_kb_version() == 5 and len(svc.local) == 0
+
+    svc.set_cached_answer("q", "a2", "ctx")
+    assert svc.delete_cache("q", "ctx") and svc.get_cached_answer("q", "ctx") is None
+    message = None
+    for _ in range(10):
+        message = message or pubsub.get_message(timeout=0.1)
+    assert message and json.loads(message["data"]) == {"key": svc._generate_cache_key("q", "ctx")}, "单条删除广播给其它 worker"
+    print(f"✅ test_answer_cache_l1 通过 ({svc._tier_stats()['l2']})")
+
+
+def test_cache_counters():
+    svc = _cache_service()
+    redis_client = svc.redis_client
+
+    def expire(key):
+        # 模拟 Redis 按 TTL 删除：键消失，过期索引中的时间已过
+        redis_client.delete(key)
+        redis_client.zadd(svc.EXPIRY_KEY, {key: 0})
+
+    svc.set_cached_answer("q1", "a1", "ctx")
+    svc.set_cached_answer("q1", "a1-new", "ctx")  # 覆盖写
+    svc.set_cached_answer("q2", "a2", "ctx", ttl=1)
+    svc.get_cached_answer("q1", "ctx")
+    svc.get_cached_answer("q3", "ctx")
+    chat = svc.get_cache_stats()["namespaces"]["chat"]
+    assert chat["entries"] == 2 and chat["hits"] == 1 and chat["misses"] == 1
+    assert chat["bytes"] == sum(redis_client.strlen(k) for k in redis_client.scan_iter(match="rag:chat:*"))
+
+    # q2 过期：Redis 删除键后统计时增量扣除
+    expire(svc._generate_cache_key("q2", "ctx"))
+    stats = svc.get_cache_stats()
+    assert stats["namespaces"]["chat"]["entries"] == 1
+    assert stats["entries_per_generation"] == {0: 1}, "过期条目同时从所属版本扣除"
+
+    # 清空：翻版本后旧条目由 SCAN + UNLINK 回收，计数归零
+    svc.bump_kb_version()
+    assert svc.purge_stale_entries() == 1
+    chat = svc.get_cache_stats()["namespaces"]["chat"]
+    assert chat["entries"] == 0 and chat["bytes"] == 0
+    assert svc.get_generation_counts() == {}, "回收后旧版本不再有条目"
+
+    # 清空返回当前版本仍有效的条目数，不含已过期的
+    svc.set_cached_answer("live", "a", "ctx")
+    svc.set_cached_answer("gone", "a", "ctx", ttl=1)
+    expire(svc._generate_cache_key("gone", "ctx"))
+    assert svc.clear_all_cache() == 1
+
+    # 不调用统计接口：写路径按批扣除过期条目，计数用的 hash / zset 不会无界增长
+    svc.PRUNE_EVERY = 4
+    for i in range(40):
+        svc.set_cached_answer(f"burst{i}", "a", "ctx", ttl=1)
+        expire(svc._generate_cache_key(f"burst{i}", "ctx"))
+    assert redis_client.zcard(svc.EXPIRY_KEY) <= svc.PRUNE_EVERY, "最多残留一个扣除周期内写入的条目"
+    assert redis_client.hlen(svc.SIZES_KEY) <= svc.PRUNE_EVERY
+    print(f"✅ test_cache_counters 通过 ({chat})")
+
+
+def test_single_flight():
+    import asyncio
+    import fakeredis
+    from offline_env import flight_mod
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    async def run():
+        # 进程内：并发的同一问题只计算一次
+        local = flight_mod.SingleFlight()
+        local.redis_client = None
+        key = local.make_key("什么是 RAG？")
+        assert key == local.make_key("  什么是  RAG？ ")
+        out = await asyncio.gather(*[local.do(key, compute) for _ in range(5)])
+        assert out == ["answer"] * 5 and len(calls) == 1
+        assert local.stats()["coalesced_local"] == 4
+
+        # 跨 worker：另一个实例等待持锁者写入的结果（两个异步客户端连同一个 Redis）
+        server = fakeredis.FakeServer()
+        worker_a, worker_b = flight_mod.SingleFlight(), flight_mod.SingleFlight()
+        worker_a.use_redis(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        worker_b.use_redis(fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+        out = await asyncio.gather(worker_a.do(key, compute), worker_b.do(key, compute))
+        assert out == ["answer", "answer"] and len(calls) == 2
+        assert worker_b.coalesced_remote == 1 and not await worker_a.redis_client.keys("rag:flight:lock:*")
+
+        # 释放锁比较令牌：锁过期后被其它 worker 获取，原持有者不误删
+        lock_key = f"{worker_a.KEY_PREFIX}lock:{key}"
+        await worker_b.redis_client.set(lock_key, "token-b")
+        await worker_a._release(lock_key, "token-a")
+        assert await worker_a.redis_client.get(lock_key) == "token-b"
+        await worker_b._release(lock_key, "token-b")
+        assert not await worker_a.redis_client.exists(lock_key)
+
+        # 计算者被取消（客户端断开）：等待者不收到取消，由其中一个接手计算
+        leader_started = asyncio.Event()
+
+        async def slow():
+            calls.append(1)
+            leader_started.set()
+            await asyncio.sleep(0.1)
+            return "recomputed"
+
+        for flight in (local, worker_a):
+            calls.clear()
+            leader_started.clear()
+            cancel_key = flight.make_key(f"会被取消的问题 {id(flight)}")
+            leader = asyncio.ensure_future(flight.do(cancel_key, slow))
+            await leader_started.wait()
+            waiters = [asyncio.ensure_future(flight.do(cancel_key, slow)) for _ in range(3)]
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            assert await asyncio.gather(*waiters) == ["recomputed"] * 3, "等待者应拿到结果而不是 CancelledError"
+            assert leader.cancelled() and len(calls) == 2, "取消后只由一个等待者重新计算"
+            assert flight.handoffs == 1 and not flight._inflight
+        assert not await worker_a.redis_client.keys("rag:flight:lock:*"), "被取消的计算者也释放锁"
+        await worker_a.aclose()
+        await worker_b.aclose()
+
+    asyncio.run(run())
+    print("✅ test_single_flight 通过")
+
+
+def test_cache_payload_codec():
+    from offline_env import cache_mod
+    long_answer = "检索增强生成（RAG）先从知识库召回相关片段，再交给大模型生成回答。" * 20
+    payload = cache_mod.encode_payload(long_answer)
+    assert len(payload) < len(long_answer.encode('utf-8')) / 4, "长答案应压缩存储"
+    assert cache_mod.decode_payload(payload) == long_answer
+    short = cache_mod.encode_payload("好的")
+    assert len(short) == 5 + len("好的".encode('utf-8')) and cache_mod.decode_payload(short) == "好的"
+    assert cache_mod.CacheService.KEY_PREFIX == f"rag:chat:f{cache_mod.PAYLOAD_FORMAT}:"
+    print(f"✅ test_cache_payload_codec 通过 ({len(long_answer.encode('utf-8'))}B -> {len(payload)}B)")
+
+
+def run_offline_tests():
+    """离线单元测试"""
+    test_semantic_cache()
+    test_kb_version_invalidation()
+    test_answer_cache_l1()
+    test_cache_counters()
+    test_single_flight()
+    test_cache_payload_codec()
+    print("\n🎉 离线测试全部通过")
+
+
 if __name__ == "__main__":
-    main()
+    if "--offline" in sys.argv:
+        run_offline_tests()
+    else:
+        main()
@@ -1,8 +1,11 @@
 """
 端到端测试脚本
 测试完整的 RAG 工作流程：上传文档 -> 问答 -> 查看历史
+运行: python scripts/test_e2e.py            # 接口测试，需先启动服务
+      python scripts/test_e2e.py --offline  # 离线单元测试：问答接口流水线，不依赖服务
 """
 import requests
+import sys
 import time
 import json
 
@@ -172,5 +175,169 @@ def main():
         print("⚠️  部分测试失败，请检查日志")
     print("=" * 60)
 
+# ---------- 离线单元测试（服务模块由 offline_env 加载，外部服务全部替换）----------
+def _offline_chat_api():
+    """加载问答路由，依赖的服务换成记录调用线程的假实现"""
+    import asyncio
+    import threading
+    from unittest.mock import MagicMock
+    from offline_env import load_api
+    chat_mod = load_api('chat')
+    calls = []
+
+    def record(name, result=None):
+        def fn(*args, **kwargs):
+            calls.append((name, threading.current_thread() is threading.main_thread()))
+            return result
+        return fn
+
+    cache = MagicMock()
+    cache.get_kb_version.side_effect = record("get_kb_version", 0)
+    cache.get_semantic_answer.side_effect = record("get_semantic_answer")
+    cache.get_cached_answer.side_effect = record("get_cached_answer")
+    cache.set_cached_answer.side_effect = record("set_cached_answer", True)
+    cache.set_semantic_answer.side_effect = record("set_semantic_answer")
+    chat_mod.cache_service = cache
+    chat_mod.milvus_service = MagicMock(get_embedding=record("get_embedding", [1.0, 0.0]))
+    chat_mod.hybrid_search_service = MagicMock(search_context_detailed=record(
+        "search_context", {"context": "[片段1] RAG", "dropped_routes": ["keyword"]}
+    ))
+    chat_mod.conversation_service = MagicMock()
+    chat_mod.conversation_service.add_message.return_value = MagicMock(id=7)
+    chat_mod.conversation_service.get_or_create_session.return_value = MagicMock(id=1, session_id="s1")
+    llm = MagicMock()
+
+    async def achat_with_context(question, context):
+        calls.append(("llm", threading.current_thread() is threading.main_thread()))
+        return "RAG 是检索增强生成"
+
+    async def achat_with_context_stream(question, context):
+        calls.append(("llm_stream", threading.current_thread() is threading.main_thread()))
+        for delta in ["RAG ", "是检索", "增强生成"]:
+            await asyncio.sleep(0.02)
+            yield delta
+
+    llm.achat_with_context = achat_with_context
+    llm.achat_with_context_stream = achat_with_context_stream
+    chat_mod.llm_service = llm
+    chat_mod.SessionLocal = MagicMock
+    return chat_mod, calls
+
+
+def test_chat_cache_off_event_loop():
+    import asyncio
+    from unittest.mock import MagicMock
+    chat_mod, calls = _offline_chat_api()
+    request = chat_mod.ChatRequest(question="什么是 RAG？")
+    response = asyncio.run(chat_mod.chat(request, db=MagicMock()))
+    assert response.answer == "RAG 是检索增强生成"
+    assert response.dropped_routes == ["keyword"], "被丢弃的召回路应返回给调用方"
+    names = [name for name, _ in calls]
+    assert names == ["get_embedding", "get_kb_version", "get_semantic_answer", "search_context",
+                     "get_cached_answer", "llm", "set_cached_answer", "set_semantic_answer"], names
+    on_loop = [name for name, on_main in calls if on_main and name != "llm"]
+    assert not on_loop, f"缓存 / 检索调用不应在事件循环上执行: {on_loop}"
+    print("✅ test_chat_cache_off_event_loop 通过")
+
+
+def _read_events(chunks):
+    """解析 SSE 文本为 [(event, data)]"""
+    events = []
+    for chunk in chunks:
+        head, data = chunk.strip().split("\n", 1)
+        events.append((head[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_chat_stream_pipeline():
+    import asyncio
+    chat_mod, calls = _offline_chat_api()
+    request = chat_mod.ChatRequest(question="什么是流式 RAG？")
+
+    async def consume(stop_after_token=False):
+        chunks = []
+        body = (await chat_mod.chat_stream(request)).body_iterator
+        async for chunk in body:
+            chunks.append(chunk)
+            if stop_after_token and chunk.startswith("event: token"):
+                await body.aclose()  # 模拟客户端断开
+                break
+        return _read_events(chunks)
+
+    async def scenario():
+        # 两个并发流式请求经单飞合并：只调用一次 LLM，领头者逐段推送，等待者一次收到完整答案
+        first, second = await asyncio.gather(consume(), consume())
+        # 领头者中途断开，等待者接手重新计算，仍拿到完整答案
+        calls.clear()
+        request.question = "什么是断开的流？"
+        leader = asyncio.ensure_future(consume(stop_after_token=True))
+        await asyncio.sleep(0.01)
+        waiter = await consume()
+        await leader
+        return first, second, waiter
+
+    first, second, waiter = asyncio.run(scenario())
+    for events in (first, second, waiter):
+        assert [e for e, _ in events][0] == "meta" and events[-1][0] == "done", events
+        assert "".join(d["delta"] for e, d in events if e == "token") == "RAG 是检索增强生成"
+    deltas = sorted(len([e for e, _ in ev if e == "token"]) for ev in (first, second))
+    assert deltas == [1, 3], deltas
+    assert sorted(d["cached"] for _, d in (first[-1], second[-1])) == [False, True]
+    assert sorted(d["dropped_routes"] for _, d in (first[-1], second[-1])) == [[], ["keyword"]]
+    names = [name for name, _ in calls]
+    assert names.count("llm_stream") == 2 and "llm" not in names, names
+    assert names.count("set_cached_answer") == 1, names
+    on_loop = [name for name, on_main in calls if on_main and not name.startswith("llm")]
+    assert not on_loop, f"缓存 / 检索调用不应在事件循环上执行: {on_loop}"
+    print("✅ test_chat_stream_pipeline 通过")
+
+
+def test_upload_validation():
+    import asyncio
+    import io
+    from unittest.mock import MagicMock
+    from fastapi import HTTPException, UploadFile
+    from offline_env import load_api
+    upload_mod = load_api('upload')
+    upload_mod.document_service = MagicMock()
+
+    def upload(tenant_id=None, tags=None):
+        file = UploadFile(io.BytesIO(b"RAG"), filename="a.txt")
+        db = MagicMock()
+        db.refresh.side_effect = lambda document: setattr(document, "id", 1)
+        return asyncio.run(upload_mod.upload_document(file=file, tenant_id=tenant_id, tags=tags, db=db))
+
+    # 超出 Milvus 字段上限：入库前返回 400，不保存文件、不写数据库
+    for kwargs in (
+        {"tags": ",".join(f"t{i}" for i in range(33))},
+        {"tags": "ok," + "长" * 22},
+        {"tenant_id": "t" * 65},
+    ):
+        try:
+            upload(**kwargs)
+            assert False, f"应返回 400: {kwargs}"
+        except HTTPException as e:
+            assert e.status_code == 400, e.detail
+    assert not upload_mod.document_service.process_and_index.called
+
+    upload_mod.settings.UPLOAD_DIR = __import__("tempfile").mkdtemp()
+    upload_mod.settings.MAX_FILE_SIZE = 1024
+    response = upload(tenant_id="t1", tags=" a, b ,a,,")
+    assert response.status == "completed"
+    assert upload_mod.document_service.process_and_index.call_args.kwargs["tags"] == ["a", "b"]
+    print("✅ test_upload_validation 通过")
+
+
+def run_offline_tests():
+    """离线单元测试"""
+    test_chat_cache_off_event_loop()
+    test_chat_stream_pipeline()
+    test_upload_validation()
+    print("\n🎉 离线测试全部通过")
+
+
 if __name__ == "__main__":
-    main()
+    if "--offline" in sys.argv:
+        run_offline_tests()
+    else:
+        main()
@@ -0,0 +1,184 @@
+"""
+LLM 调用链路测试（不依赖服务和真实模型，离线环境见 offline_env.py）
+运行: python scripts/test_llm.py
+"""
+import json
+import os
+import random
+
+from offline_env import ROOT, load, llm_mod, local_llm_mod, packer_mod, resilience_mod
+
+
+def test_llm_stream_parsing():
+    import asyncio
+    import httpx
+    sse = "\n".join([
+        'data: {"choices": [{"delta": {"role": "assistant", "content": "检索"}}]}',
+        '',
+        'data: {"choices": [{"delta": {"content": "增强"}}]}',
+        'data: {"choices": [{"delta": {}, "finish_reason": "stop"}]}',
+        'data: [DONE]',
+    ])
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request)
+        body = json.loads(request.content)
+        if body.get("stream"):
+            return httpx.Response(200, text=sse, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "检索增强生成"}}]})
+
+    cloud = llm_mod.CloudLLMService()
+    cloud.api_url, cloud.api_key, cloud.model = "https://llm.test/v4/chat/completions", "test-key", "glm-4"
+    cloud._client = httpx.Client(transport=httpx.MockTransport(handler))
+    assert list(cloud.chat_with_context_stream("什么是 RAG？", "RAG 是检索增强生成")) == ["检索", "增强"]
+    assert cloud.chat_with_context("什么是 RAG？", "RAG 是检索增强生成") == "检索增强生成"
+    assert list(cloud.chat_with_context_stream("q", "无相关内容")) == [llm_mod.NO_CONTEXT_ANSWER]
+
+    async def run():
+        cloud._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        cloud._async_semaphore = asyncio.Semaphore(2)
+        deltas = [d async for d in cloud.achat_with_context_stream("什么是 RAG？", "RAG 是检索增强生成")]
+        answer = await cloud.achat_with_context("什么是 RAG？", "RAG 是检索增强生成")
+        await cloud.aclose()
+        return deltas, answer
+
+    assert asyncio.run(run()) == (["检索", "增强"], "检索增强生成")
+    assert len(requests_seen) == 4 and all(r.headers["Authorization"].startswith("Bearer") for r in requests_seen)
+    print("✅ test_llm_stream_parsing 通过")
+
+
+
+
+def test_llm_resilience():
+    import asyncio
+    import time
+    import httpx
+    statuses = [503, 503, 200, 401]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return httpx.Response(status, json={"error": status})
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    cloud = llm_mod.CloudLLMService()
+    cloud.api_url, cloud.api_key, cloud.model = "https://llm.test/v4/chat/completions", "test-key", "glm-4"
+    cloud._client = httpx.Client(transport=httpx.MockTransport(handler))
+    assert cloud.chat("q") == "ok" and cloud.resilience.retries == 2, "两次 503 后重试成功"
+    try:
+        cloud.chat("q")
+        assert False, "401 应直接失败"
+    except Exception as e:
+        assert "401" in str(e) and not statuses, "401 不可重试"
+
+    # 熔断：错误率超过阈值后快速失败，冷却后探测成功即恢复
+    breaker = resilience_mod.CircuitBreaker(failure_rate=0.5, min_requests=4, window=60, cooldown=0.1)
+    for ok in (True, False, True, False):
+        breaker.allow()
+        breaker.record_success() if ok else breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.12)
+    assert breaker.allow() and not breaker.allow(), "半开状态只放行一个探测请求"
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+    # 对冲：首个请求慢于 p95 时发出第二个请求，先返回者胜出
+    caller = resilience_mod.ResilientCaller()
+    caller.hedge_enabled = True
+    for _ in range(20):
+        caller.latency.record(0.01)
+    delays = [1.0, 0.0]
+
+    async def slow_then_fast():
+        await asyncio.sleep(delays.pop(0))
+        return "hedged"
+
+    start = time.perf_counter()
+    assert asyncio.run(caller.acall(slow_then_fast)) == "hedged"
+    assert time.perf_counter() - start < 0.5 and caller.hedge_wins == 1
+    print(f"✅ test_llm_resilience 通过 ({caller.stats()['breaker']['state']})")
+
+
+def test_context_packing():
+    packer = packer_mod.ContextPacker()
+    counter = packer.counter
+    assert counter.count("知识库") == 3 and counter.count("hello world") == 4 and counter.count("") == 0
+
+    shared = "分块之间有重叠的这一句话会在两个片段中同时出现。"
+    results = [
+        {"content": "低分片段的内容。" * 10, "rerank_score": 0.35},
+        {"content": "最相关的片段，排在最前面。" + shared, "rerank_score": 0.95},
+        {"content": shared + "第二相关的片段还有自己的内容。", "rerank_score": 0.8},
+    ]
+    full = packer.pack(results)
+    assert full["chunks"] == [1, 2, 0], "按 rerank 分数降序装入"
+    assert full["text"].startswith("[片段1] 最相关的片段") and full["text"].count(shared) == 1
+    assert full["deduped_sentences"] == 1 and full["tokens"] == counter.count(full["text"])
+
+    # 预算不足：低分片段被按句截断，预算过小时直接丢弃
+    budget = full["tokens"] - 40
+    tight = packer.pack(results, budget=budget)
+    assert tight["trimmed"] == [0] and tight["tokens"] <= budget and tight["tokens"] < full["tokens"]
+    tiny = packer.pack(results, budget=counter.count("[片段1] 最相关的片段，排在最前面。" + shared) + 5)
+    assert tiny["chunks"] == [1] and tiny["dropped"] == [2, 0]
+
+    # 首句超长时按字符截断
+    long_one = packer.pack([{"content": "长" * 200}], budget=50)
+    assert long_one["trimmed"] == [0] and long_one["tokens"] <= 50
+    assert packer.pack([])["text"] == "无相关内容"
+    print(f"✅ test_context_packing 通过 ({packer.stats()['tokens_saved']} tokens saved)")
+
+
+def test_local_llm_mock_server():
+    import asyncio
+    import httpx
+    mock_mod = load('mock_llm_server', os.path.join(ROOT, 'scripts', 'mock_llm_server.py'))
+    app = mock_mod.create_app(mock_mod.MockConfig(ttft_ms=5, ttft_sigma=0.3, tokens_per_sec=0, answer_tokens=12))
+    local = local_llm_mod.get_local_llm_service()
+    assert local is local_llm_mod.get_local_llm_service() and local.api_url == "http://mock-llm/v1/chat/completions"
+    assert "Authorization" not in local._headers()
+
+    async def run():
+        local._async_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app))
+        local._async_semaphore = asyncio.Semaphore(4)
+        prompt = llm_mod.build_context_prompt("什么是混合检索", "[片段1] 混合检索结合向量和关键词。")
+        answer = await local.achat(prompt)
+        streamed = "".join([d async for d in local.achat_stream(prompt)])
+        assert answer == await local.achat(prompt) == streamed, "同一请求回答确定"
+        assert answer.startswith("关于“什么是混合检索”")
+
+        # 携带工具且无工具结果时返回预设 tool_calls，拿到工具结果后直接回答
+        tools = [{"type": "function", "function": {"name": "search_knowledge_base", "parameters": {}}}]
+        messages = [{"role": "user", "content": "混合检索怎么融合"}]
+        message = await local._apost(local._payload(messages, 0.1, tools=tools, tool_choice="auto"))
+        call = message["tool_calls"][0]
+        assert call["function"]["name"] == "search_knowledge_base"
+        assert json.loads(call["function"]["arguments"]) == {"query": "混合检索怎么融合"}
+        messages += [
+            {"role": "assistant", "content": "", "tool_calls": [call]},
+            {"role": "tool", "tool_call_id": call["id"], "content": "RRF 融合"}
+        ]
+        final = await local._apost(local._payload(messages, 0.1, tools=tools, tool_choice="auto"))
+        assert final["content"] and not final.get("tool_calls")
+
+        # 问题含引号 / 反斜杠：参数仍是合法 JSON
+        tricky = '路径 "C:\\data\\rag" 里的 \\n 是什么'
+        message = await local._apost(local._payload(
+            [{"role": "user", "content": tricky}], 0.1, tools=tools, tool_choice="auto"
+        ))
+        assert json.loads(message["tool_calls"][0]["function"]["arguments"]) == {"query": tricky}
+        await local.aclose()
+
+    asyncio.run(run())
+    mock = app.state.mock
+    assert mock.ttft(random.Random(1)) == mock.ttft(random.Random(1))
+    print(f"✅ test_local_llm_mock_server 通过 ({mock.requests} 次请求)")
+
+
+if __name__ == "__main__":
+    test_llm_stream_parsing()
+    test_llm_resilience()
+    test_context_packing()
+    test_local_llm_mock_server()
+    print("\n🎉 全部测试通过")
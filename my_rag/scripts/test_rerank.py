@@ -1,64 +1,23 @@
 """
-验证 Rerank + 混合检索流水线逻辑（完全自包含，不依赖项目 venv / Milvus / ES / 模型）
+验证 Rerank + 混合检索流水线逻辑（不依赖 Milvus / ES / 模型，离线环境见 offline_env.py）
 运行: python scripts/test_rerank.py
 """
+import json
 import os
 import sys
-import types
-import importlib.util
 from unittest.mock import MagicMock
 
-ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-SERVICES = os.path.join(ROOT, 'app', 'services')
-
-
-# ---------- 1. 构造 fake app.config（绕过 pydantic_settings）----------
-class _FakeSettings:
-    RERANK_ENABLED = False          # 关闭，避免下载模型
-    RERANK_MODEL = "BAAI/bge-reranker-base"
-    RECALL_TOP_K = 30
-    RERANK_TOP_K = 5
-    RERANK_SCORE_THRESHOLD = 0.3
-    VECTOR_DISTANCE_THRESHOLD = 0.5
-    VECTOR_WEIGHT = 0.6
-    KEYWORD_WEIGHT = 0.4
-
-    def __getattr__(self, name):
-        # 其它配置项（MILVUS_HOST 等）实例化时只是被引用，返回 MagicMock 即可
-        return MagicMock()
-
-
-fake_config = types.ModuleType('app.config')
-fake_config.settings = _FakeSettings()
-sys.modules['app'] = types.ModuleType('app')
-sys.modules['app.services'] = types.ModuleType('app.services')
-sys.modules['app.config'] = fake_config
-
-# ---------- 2. Stub 外部依赖 ----------
-for m in ['elasticsearch', 'elasticsearch.helpers', 'pymilvus', 'sentence_transformers']:
-    sys.modules[m] = MagicMock()
-
-
-# ---------- 3. 用 importlib 手动加载服务模块 ----------
-def load(name, path):
-    spec = importlib.util.spec_from_file_location(name, path)
-    mod = importlib.util.module_from_spec(spec)
-    sys.modules[name] = mod
-    spec.loader.exec_module(mod)
-    return mod
-
-
-load('app.services.milvus_service', os.path.join(SERVICES, 'milvus_service.py'))
-load('app.services.elasticsearch_service', os.path.join(SERVICES, 'elasticsearch_service.py'))
-rerank_mod = load('app.services.rerank_service', os.path.join(SERVICES, 'rerank_service.py'))
-hybrid_mod = load('app.services.hybrid_search_service', os.path.join(SERVICES, 'hybrid_search_service.py'))
+from offline_env import (
+    FakeSettings, SearchFilter, workers_mod, batcher_mod, milvus_mod, vector_store_mod,
+    rerank_mod, cascade_mod, hybrid_mod, tools_mod, agent_mod
+)
 
 _sigmoid = rerank_mod._sigmoid
 rerank_service = rerank_mod.rerank_service
 HybridSearchService = hybrid_mod.HybridSearchService
 
 
-# ---------- 4. 测试用例 ----------
+# ---------- 测试用例 ----------
 def test_sigmoid():
     assert abs(_sigmoid(0.0) - 0.5) < 1e-9
     assert _sigmoid(100.0) > 0.99999
@@ -84,6 +43,28 @@ def test_rrf():
     print(f"✅ test_rrf 通过 (B fused_score={fused[0]['fused_score']:.6f})")
 
 
+def test_rrf_chunk_key():
+    svc = HybridSearchService.__new__(HybridSearchService)
+    vec = [{"content": "x", "document_id": 1, "chunk_id": 0, "distance": 0.9},
+           {"content": "y", "document_id": 1, "chunk_id": 1, "distance": 0.8}]
+    kw = [{"content": "x", "document_id": 1, "chunk_id": 0, "score": 3.2}]
+    fused = svc._reciprocal_rank_fusion(vec, kw, 0.6, 0.4, k=60)
+    assert len(fused) == 2 and fused[0].key == (1, 0)
+    assert fused[0]["distance"] == 0.9 and fused[0]["score"] == 3.2, "两路元信息应合并到同一候选"
+
+    # 旧 Milvus 行缺 chunk_id、ES 行有：同一片段仍合并为一个候选，分数不被拆开
+    legacy_vec = [{"content": "x", "document_id": 1, "distance": 0.9},
+                  {"content": "y", "document_id": 1, "distance": 0.8}]
+    mixed = svc._reciprocal_rank_fusion(legacy_vec, kw, 0.6, 0.4, k=60)
+    assert len(mixed) == 2 and mixed[0]["content"] == "x"
+    assert mixed[0]["distance"] == 0.9 and mixed[0]["score"] == 3.2
+    assert abs(mixed[0]["fused_score"] - fused[0]["fused_score"]) < 1e-12
+    # 不同文档的相同内容不合并
+    other_doc = [{"content": "x", "document_id": 2, "chunk_id": 0}]
+    assert len(svc._reciprocal_rank_fusion(legacy_vec, other_doc, 0.6, 0.4, k=60)) == 3
+    print("✅ test_rrf_chunk_key 通过")
+
+
 def test_finalize_truncate():
     svc = HybridSearchService.__new__(HybridSearchService)
     svc.rerank = rerank_service  # enabled=False
@@ -131,11 +112,743 @@ def test_vector_finalize_threshold():
     print(f"✅ test_vector_finalize_threshold 通过 (保留 {contents})")
 
 
+def test_embedding_cache():
+    svc = milvus_mod.MilvusService()
+    fake_model = MagicMock()
+    fake_model.encode.return_value = [MagicMock(tolist=lambda: [0.1] * 384)]
+    svc._embedding_backend = fake_model
+    svc.vector_dim = 384
+    v1 = svc.get_embedding("什么是 RAG？")
+    v2 = svc.get_embedding("  什么是  RAG？ ")  # 归一化后同一键
+    assert v1 == v2
+    assert fake_model.encode.call_count == 1, "重复查询不应再次前向计算"
+    stats = svc.embedding_cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    print(f"✅ test_embedding_cache 通过 (hit_rate={stats['hit_rate']})")
+
+
+def test_insert_chunks_pipeline():
+    import threading
+    import numpy as np
+
+    class _Store:
+        backend = "fake"
+
+        def __init__(self, fail_at=None):
+            self.batches, self.deleted, self.fail_at = [], [], fail_at
+            self.in_flight = threading.Lock()
+
+        def ensure_collection(self):
+            pass
+
+        def insert(self, data):
+            assert self.in_flight.acquire(blocking=False), "同一时刻只应有一批在途写入"
+            try:
+                threading.Event().wait(0.02)  # 慢写入：调用方必须等待最后一批完成
+                if len(self.batches) == self.fail_at:
+                    raise RuntimeError("milvus down")
+                self.batches.append(data)
+            finally:
+                self.in_flight.release()
+
+        def delete_by_document_id(self, document_id):
+            self.deleted.append(document_id)
+            return 0
+
+    class _Backend:
+        name = "torch"
+
+        def encode(self, texts, batch_size=32):
+            return np.array([[float(t[1:]), 0.0] for t in texts], dtype=np.float32)
+
+    chunks = [f"c{i}" for i in range(5)]
+    svc = milvus_mod.MilvusService()
+    svc._embedding_backend, svc.vector_dim, svc.enabled = _Backend(), 2, True
+    svc.store = _Store()
+    svc.insert_chunks(chunks, [{"document_id": 7}] * 5)
+    assert [len(b) for b in svc.store.batches] == [2, 2, 1], "按 MILVUS_INSERT_BATCH_SIZE 分批，且最后一批已写完"
+    rows = [item for b in svc.store.batches for item in b]
+    assert [r["content"] for r in rows] == chunks, "写入顺序与输入一致"
+    assert [r["chunk_id"] for r in rows] == list(range(5)), "chunk_id 跨批次连续"
+    assert [r["vector"][0] for r in rows] == [0.0, 1.0, 2.0, 3.0, 4.0], "向量与文本对应"
+    assert all(r["document_id"] == 7 for r in rows) and not svc.store.deleted
+
+    # 后续批次失败：按 document_id 删除已写入的批次并抛出
+    svc.store = _Store(fail_at=1)
+    try:
+        svc.insert_chunks(chunks, [{"document_id": 9}] * 5)
+        raise AssertionError("写入失败应抛出")
+    except RuntimeError:
+        pass
+    assert len(svc.store.batches) == 1 and svc.store.deleted == [9]
+    print("✅ test_insert_chunks_pipeline 通过 (分批顺序 / chunk_id 偏移 / 失败回滚)")
+
+
+def test_embedding_backend_fallback():
+    import tempfile
+    import threading
+    import numpy as np
+    backend_mod = sys.modules['app.services.embedding_backend']
+
+    class _Fixed:
+        def __init__(self, name, vectors):
+            self.name, self.vectors = name, np.asarray(vectors, dtype=np.float32)
+
+        def encode(self, texts, batch_size=32):
+            return self.vectors[:len(texts)]
+
+    reference = [[1.0, 0.0], [0.0, 1.0]]
+    assert abs(backend_mod.validate_backend(_Fixed("onnx", reference), _Fixed("torch", reference), ["a", "b"]) - 1) < 1e-6
+    skewed = [[1.0, 0.0], [0.6, 0.8]]
+    assert abs(backend_mod.validate_backend(_Fixed("onnx", skewed), _Fixed("torch", reference), ["a", "b"]) - 0.8) < 1e-6
+
+    # 加载失败 / 校验不达标 / 未知后端：回退到 torch
+    originals = (backend_mod.TorchEmbeddingBackend, backend_mod.OnnxEmbeddingBackend, backend_mod.resolve_model_path)
+    backend_mod.TorchEmbeddingBackend = lambda path: _Fixed("torch", reference)
+    backend_mod.resolve_model_path = lambda: "fake-model"
+    try:
+        def broken(path, quantize=False):
+            raise ImportError("No module named 'onnxruntime'")
+
+        backend_mod.OnnxEmbeddingBackend = broken
+        assert backend_mod.load_embedding_backend("onnx").name == "torch"
+        backend_mod.OnnxEmbeddingBackend = lambda path, quantize=False: _Fixed("onnx-int8", skewed)
+        assert backend_mod.load_embedding_backend("onnx-int8").name == "torch", "偏差过大应回退"
+        backend_mod.OnnxEmbeddingBackend = lambda path, quantize=False: _Fixed("onnx-int8", reference)
+        assert backend_mod.load_embedding_backend("onnx-int8").name == "onnx-int8"
+        assert backend_mod.load_embedding_backend("tensorrt").name == "torch"
+
+        # 向量缓存键按实际生效的后端：配置 onnx-int8、实际回退到 torch
+        FakeSettings.EMBEDDING_BACKEND = "onnx-int8"
+        svc = milvus_mod.MilvusService()
+        original_loader = milvus_mod.load_embedding_backend
+        milvus_mod.load_embedding_backend = lambda: _Fixed("torch", [[0.1] * 384])
+        try:
+            svc.vector_dim = 384
+            svc.get_embedding("回退后缓存键")
+            assert ":torch:" in svc.embedding_cache.model_id, svc.embedding_cache.model_id
+        finally:
+            milvus_mod.load_embedding_backend = original_loader
+            FakeSettings.EMBEDDING_BACKEND = "torch"
+    finally:
+        backend_mod.TorchEmbeddingBackend, backend_mod.OnnxEmbeddingBackend, backend_mod.resolve_model_path = originals
+
+    # 并发首次加载：只生成一次，先写临时文件再原子替换
+    path = os.path.join(tempfile.mkdtemp(), "model.onnx")
+    builds = []
+
+    def build(tmp_path):
+        builds.append(tmp_path)
+        assert not os.path.exists(path), "生成期间目标文件不可见"
+        with open(tmp_path, "w") as f:
+            f.write("graph")
+        threading.Event().wait(0.05)
+
+    threads = [threading.Thread(target=backend_mod.build_once, args=(path, build)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1 and open(path).read() == "graph"
+    assert not [f for f in os.listdir(os.path.dirname(path)) if f.endswith(".tmp")]
+    print("✅ test_embedding_backend_fallback 通过")
+
+
+def test_batch_search():
+    import numpy as np
+
+    # 向量批量检索：一次编码、一次检索，结果与查询一一对应（含缓存命中的查询）
+    class _Backend:
+        name = "torch"
+
+        def __init__(self):
+            self.calls = []
+
+        def encode(self, texts, batch_size=32):
+            self.calls.append(list(texts))
+            return np.array([[float(t[1:]), 0.0] for t in texts], dtype=np.float32)
+
+    class _Store:
+        def __init__(self):
+            self.calls = 0
+
+        def search(self, vectors, limit, search_params=None, filters=None, output_fields=None, timeout=None):
+            self.calls += 1
+            self.timeout = timeout
+            return [[{"id": i, "distance": 1.0, "entity": {"content": f"hit-q{int(v[0])}", "document_id": int(v[0])}}]
+                    for i, v in enumerate(vectors)]
+
+    svc = milvus_mod.MilvusService()
+    svc._embedding_backend, svc.vector_dim, svc.enabled = _Backend(), 2, True
+    svc.store = _Store()
+    svc.get_embedding("q2")  # 预热缓存，批量检索时只编码未命中的查询
+    results = svc.search_batch(["q3", "q2", "q10", "q1"], top_k=1, timeout=0.5)
+    assert [r[0]["content"] for r in results] == ["hit-q3", "hit-q2", "hit-q10", "hit-q1"], results
+    assert svc._embedding_backend.calls[-1] == ["q3", "q1", "q10"], "未命中的查询合并为一次前向"
+    assert svc.store.calls == 1 and svc.store.timeout == 0.5, "超时下推到向量库"
+    svc.store.search = MagicMock(side_effect=RuntimeError("milvus down"))
+    assert svc.search_batch(["q1", "q2"]) == [[], []], "检索失败时每个查询返回空结果"
+
+    # ES 批量检索：单个子查询失败只影响该查询，其余结果位置不变
+    es_mod = sys.modules['app.services.elasticsearch_service']
+    es = es_mod.ElasticsearchService()
+    es.enabled = True
+
+    def _resp(content):
+        return {"hits": {"hits": [{"_source": {"content": content, "document_id": 1}, "_score": 2.0}]}}
+
+    es.es_client.msearch = MagicMock(return_value={"responses": [
+        _resp("a"), {"error": {"type": "search_phase_execution_exception"}}, _resp("c")
+    ]})
+    results = es.msearch(["qa", "qb", "qc"], top_k=2)
+    assert [[h["content"] for h in r] for r in results] == [["a"], [], ["c"]]
+    searches = es.es_client.msearch.call_args.kwargs["searches"]
+    es.es_client.options = MagicMock(return_value=es.es_client)
+    es.msearch(["qa", "qb", "qc"], request_timeout=0.5)
+    es.es_client.options.assert_called_once_with(request_timeout=0.5)
+    assert len(searches) == 6 and [b["query"]["match"]["content"]["query"] for b in searches[1::2]] == ["qa", "qb", "qc"]
+    es.es_client.msearch.side_effect = RuntimeError("es down")
+    assert es.msearch(["qa", "qb"]) == [[], []]
+
+    # Agent：同一轮多个知识库搜索合并为一次批量检索，结果按 tool_call 对回
+    def _call(call_id, name, arguments):
+        return {"id": call_id, "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)}}
+
+    agent = agent_mod.SimpleAgent()
+    original = agent_mod.search_documents_batch
+    batch_calls = []
+    agent_mod.search_documents_batch = lambda queries: batch_calls.append(queries) or [f"结果:{q}" for q in queries]
+    try:
+        messages = agent._execute_tool_calls([
+            _call("c1", "search_knowledge_base", {"query": "RAG"}),
+            _call("c2", "calculator", {"expression": "1 + 2"}),
+            _call("c3", "search_knowledge_base", {"query": "Milvus"}),
+        ])
+        assert batch_calls == [["RAG", "Milvus"]]
+        assert [m["tool_call_id"] for m in messages] == ["c1", "c2", "c3"]
+        assert messages[0]["content"] == "结果:RAG" and messages[2]["content"] == "结果:Milvus"
+        assert "3" in messages[1]["content"]
+        # 只有一个搜索调用时不走批量
+        assert agent._batch_search_calls([_call("c1", "search_knowledge_base", {"query": "RAG"})]) == {}
+        assert len(batch_calls) == 1
+    finally:
+        agent_mod.search_documents_batch = original
+    print("✅ test_batch_search 通过 (结果对齐 / 子查询失败 / Agent 合并)")
+
+
+def test_search_filter():
+    assert SearchFilter.build() is None, "全空过滤条件不应下推"
+    f = SearchFilter.build(document_ids=[1, 2], tenant_id="t1", tags=["财务"])
+    expr = f.to_milvus_expr()
+    assert expr == 'document_id in [1, 2] and tenant_id == "t1" and array_contains_any(tags, ["财务"])', expr
+    assert {"terms": {"document_id": [1, 2]}} in f.to_es_filter()
+    print(f"✅ test_search_filter 通过 ({expr})")
+
+
+def test_local_vector_store():
+    import tempfile
+    import numpy as np
+    rng = np.random.default_rng(42)
+    store = vector_store_mod.LocalVectorStore(None, dim=8)
+    vecs = rng.normal(size=(200, 8)).astype(np.float32)
+    store.insert([
+        {"vector": v.tolist(), "content": f"c{i}", "document_id": i % 4, "chunk_id": i,
+         "tenant_id": "t1" if i % 2 else "t2", "tags": []}
+        for i, v in enumerate(vecs)
+    ])
+    hits = store.search([vecs[17].tolist()], limit=3, output_fields=["content", "document_id"])[0]
+    assert hits[0]["entity"]["content"] == "c17" and abs(hits[0]["distance"] - 1.0) < 1e-5
+    scoped = store.search([vecs[17].tolist()], limit=5, filters=SearchFilter.build(document_ids=[2]),
+                          output_fields=["document_id"])[0]
+    assert scoped and all(h["entity"]["document_id"] == 2 for h in scoped)
+
+    # IVF：nprobe 取满时结果与精确检索一致
+    store._build_ivf()
+    ivf_hits = store.search([vecs[17].tolist()], limit=3, search_params={"nprobe": 10 ** 6})[0]
+    assert [h["id"] for h in ivf_hits] == [h["id"] for h in hits]
+
+    assert store.delete_by_document_id(1) == 50 and store.count() == 150
+
+    # 租户 / 标签过滤：列掩码，删除压缩后仍与行对齐；未知租户或标签不命中
+    tagged = store.search([vecs[17].tolist()], limit=200, output_fields=["tenant_id", "document_id"],
+                          filters=SearchFilter.build(tenant_id="t1"))[0]
+    assert len(tagged) == 50 and all(h["entity"]["tenant_id"] == "t1" for h in tagged)
+    assert not store.search([vecs[0].tolist()], limit=5, filters=SearchFilter.build(tenant_id="t9"))[0]
+    assert not store.search([vecs[0].tolist()], limit=5, filters=SearchFilter.build(tags=["missing"]))[0]
+
+    # 容量倍增扩展：标量列与向量同步扩容，id 与行保持对应
+    grown = vector_store_mod.LocalVectorStore(None, dim=8)
+    for start in range(0, 1500, 100):
+        grown.insert([
+            {"vector": vecs[i % 200].tolist(), "content": f"g{i}", "document_id": i,
+             "tenant_id": f"t{i % 3}", "tags": [f"tag{i % 20}"]}
+            for i in range(start, start + 100)
+        ])
+    assert grown._capacity >= 1500 and list(grown._ids[:grown.count()]) == list(range(1, 1501))
+    hits = grown.search([vecs[5].tolist()], limit=1500, output_fields=["content", "tags", "tenant_id"],
+                        filters=SearchFilter.build(tenant_id="t1", tags=["tag7", "tag13"]))[0]
+    expected = {f"g{i}" for i in range(1500) if i % 3 == 1 and i % 20 in (7, 13)}
+    assert {h["entity"]["content"] for h in hits} == expected
+    assert all(h["id"] == int(h["entity"]["content"][1:]) + 1 for h in hits), "id 与元数据行对齐"
+
+    # 持久化：重启后重建 IVF，检索结果与重启前一致
+    path = tempfile.mkdtemp()
+    FakeSettings.LOCAL_IVF_MIN_ROWS = 100
+    try:
+        persisted = vector_store_mod.LocalVectorStore(path, dim=8)
+        persisted.insert([
+            {"vector": v.tolist(), "content": f"c{i}", "document_id": i, "tenant_id": "t1", "tags": ["x"]}
+            for i, v in enumerate(vecs)
+        ])
+        before = persisted.search([vecs[3].tolist()], limit=3, search_params={"nprobe": 10 ** 6})[0]
+        reloaded = vector_store_mod.LocalVectorStore(path, dim=8)
+        assert reloaded._centroids is not None and reloaded._ivf_rows == 200, "重启后应重建 IVF"
+        after = reloaded.search([vecs[3].tolist()], limit=3, search_params={"nprobe": 10 ** 6},
+                                filters=SearchFilter.build(tenant_id="t1", tags=["x"]))[0]
+        assert [h["id"] for h in after] == [h["id"] for h in before]
+
+        # 删除重写：临时文件 + os.replace；在替换元数据前崩溃，重启时补完，两个文件保持一致
+        replace = os.replace
+        replaced = []
+
+        def crash_before_meta(src, dst):
+            if replaced:
+                raise KeyboardInterrupt("模拟崩溃")
+            replaced.append(dst)
+            replace(src, dst)
+
+        vector_store_mod.os.replace = crash_before_meta
+        try:
+            reloaded.delete_by_document_id(3)
+            assert False, "应在替换元数据前中断"
+        except KeyboardInterrupt:
+            pass
+        finally:
+            vector_store_mod.os.replace = replace
+        recovered = vector_store_mod.LocalVectorStore(path, dim=8)
+        assert recovered.count() == 199 and 3 not in recovered._document_ids[:recovered.count()]
+        hit = recovered.search([vecs[4].tolist()], limit=1, search_params={"nprobe": 10 ** 6})[0][0]
+        assert hit["entity"]["content"] == "c4", "向量与元数据行对齐"
+        # 提交点之前崩溃（向量临时文件仍在）：丢弃临时文件，保留原数据
+        for name in ("vectors.f32.tmp", "meta.jsonl.tmp"):
+            with open(os.path.join(path, name), "wb") as f:
+                f.write(b"partial")
+        assert vector_store_mod.LocalVectorStore(path, dim=8).count() == 199
+        assert not any(name.endswith(".tmp") for name in os.listdir(path))
+        assert recovered.delete_by_document_id(4) == 1
+        assert vector_store_mod.LocalVectorStore(path, dim=8).count() == 198
+    finally:
+        FakeSettings.LOCAL_IVF_MIN_ROWS = 50000
+    print("✅ test_local_vector_store 通过")
+
+
+def test_parallel_recall_deadline():
+    import time
+    svc = HybridSearchService()
+    slow = MagicMock()
+    slow.enabled = True
+    slow.search.side_effect = lambda *a, **kw: time.sleep(1) or [{"content": "late"}]
+    fast = MagicMock()
+    fast.search.return_value = [{"content": "A"}, {"content": "B"}]
+    svc.milvus, svc.es, svc.rerank = fast, slow, rerank_service
+    start = time.perf_counter()
+    out = svc.hybrid_search_detailed("q", top_k=2)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.6, f"慢路应在超时后被丢弃, 实际耗时 {elapsed:.2f}s"
+    assert out["meta"]["dropped_routes"] == ["keyword"]
+    assert [r["content"] for r in out["results"]] == ["A", "B"]
+
+    # 批量召回：超时随查询数放宽并下推到两路；被丢弃的路返回给调用方
+    queries = [f"q{i}" for i in range(4)]
+    fast.search_batch.side_effect = lambda qs, **kw: [[{"content": f"v-{q}"}] for q in qs]
+    slow.msearch.side_effect = lambda qs, **kw: time.sleep(0.3) or [[{"content": f"k-{q}"}] for q in qs]
+    batch = svc.hybrid_search_batch_detailed(queries, top_k=1)
+    assert fast.search_batch.call_args.kwargs["timeout"] == 0.5
+    assert slow.msearch.call_args.kwargs["request_timeout"] == 0.5
+    assert batch["meta"]["dropped_routes"] == [], "0.3s 在 4 个查询的批量超时（0.5s）内，不应丢弃"
+    slow.msearch.side_effect = lambda qs, **kw: time.sleep(1) or [[] for _ in qs]
+    detailed = svc.search_context_batch_detailed(queries, top_k=1)
+    assert detailed["dropped_routes"] == ["keyword"]
+    assert "v-q3" in detailed["contexts"][3]
+    original = tools_mod.hybrid_search_service
+    tools_mod.hybrid_search_service = svc
+    try:
+        assert "召回路 keyword 超时或失败" in tools_mod.search_documents_batch(queries)[0]
+    finally:
+        tools_mod.hybrid_search_service = original
+    print(f"✅ test_parallel_recall_deadline 通过 ({elapsed * 1000:.0f}ms)")
+
+
+class _CharTokenizer:
+    """按字符分词的假分词器（每个字符一个 token）"""
+
+    def __call__(self, text, add_special_tokens=False):
+        if isinstance(text, str):
+            return {'input_ids': [ord(c) for c in text]}
+        return {'input_ids': [[ord(c) for c in t] for t in text]}
+
+    def num_special_tokens_to_add(self, pair=False):
+        return 3
+
+
+def test_rerank_bucketing():
+    import numpy as np
+    plan = rerank_mod.plan_batches(np.array([10, 500, 12, 11, 480]), token_budget=1000, max_batch_size=4)
+    assert [b.tolist() for b in plan] == [[0, 3, 2], [4, 1]], "短的一桶，长的一桶"
+    assert [b.tolist() for b in rerank_mod.plan_batches(np.array([900, 950]), 500, 4)] == [[0], [1]]
+
+    probs = np.array([0.2, 0.9, 0.5, 0.9, 0.7, 0.4])
+    assert rerank_mod.select_top_k(probs, 3, 0.3).tolist() == [1, 3, 4]
+    assert rerank_mod.select_top_k(probs, 10, 0.45).tolist() == [1, 3, 4, 2]
+    assert np.allclose(rerank_mod._sigmoid_array(np.array([-100.0, 0.0, 3.0])),
+                       [_sigmoid(-100.0), 0.5, _sigmoid(3.0)])
+
+    svc = rerank_mod.RerankService()
+    svc.enabled = True
+    svc._model = MagicMock(tokenizer=_CharTokenizer(), model=object())
+    seen = []
+
+    def fake_forward(tokenizer, hf_model, pairs):
+        seen.append([len(q) + len(d) + 3 for q, d in pairs])
+        return np.array([len(d) / 10 - 2 for _, d in pairs], dtype=np.float32)
+
+    svc._forward = fake_forward
+    docs = ["短" * 5, "长" * 1000, "中" * 20, "短" * 6]
+    out = svc.rerank("一个超过八个字符的很长的查询", docs, top_k=2, score_threshold=0.1)
+    assert all(max(batch) <= 64 for batch in seen), "每对截断到 RERANK_MAX_LENGTH"
+    assert seen[0] == sorted(seen[0]) and sum(len(b) for b in seen) == 4
+    assert [r["index"] for r in out] == [1, 2], "按 logit 降序取 top_k"
+    assert abs(out[0]["rerank_score"] - _sigmoid(5.3 - 2)) < 1e-6  # 64 - 8 - 3 = 53 个 doc token
+    stats = svc.stats()
+    assert stats["pairs"] == 4 and stats["tokens_per_sec"] and 0 < stats["padding_efficiency"] <= 1
+
+    # 无分词器时退回 CrossEncoder.predict：默认激活为 sigmoid，需取原始 logit，分数与分桶路径同尺度
+    class _SigmoidCrossEncoder:
+        def predict(self, pairs, batch_size=32, activation_fct=None):
+            logits = np.array([len(d) / 10 - 2 for _, d in pairs], dtype=np.float32)
+            return logits if activation_fct is not None else rerank_mod._sigmoid_array(logits)
+
+    fallback = rerank_mod.RerankService()
+    fallback.enabled = True
+    fallback._model = _SigmoidCrossEncoder()
+    out = fallback.rerank("q", ["中" * 20, "短" * 5], top_k=2, score_threshold=0.3)
+    assert [r["index"] for r in out] == [0], "logit -1.5 的候选被 0.3 概率阈值过滤"
+    assert abs(out[0]["rerank_score"] - _sigmoid(0.0)) < 1e-6
+    print(f"✅ test_rerank_bucketing 通过 ({stats['batches']} 批, 填充率 {stats['padding_efficiency']:.0%})")
+
+
+def test_rerank_score_cache():
+    import numpy as np
+    svc = rerank_mod.RerankService()
+    svc.enabled = True
+    svc._model = MagicMock(tokenizer=_CharTokenizer(), model=object())
+    scored = []
+
+    def fake_forward(tokenizer, hf_model, pairs):
+        scored.extend(len(d) for _, d in pairs)
+        return np.array([len(d) / 10 - 1 for _, d in pairs], dtype=np.float32)
+
+    svc._forward = fake_forward
+    docs = ["甲" * 10, "乙" * 20, "丙" * 30]
+    first = svc.rerank("混合检索 怎么融合", docs, top_k=3, score_threshold=0.0)
+    assert len(scored) == 3
+
+    # 归一化后相同的 query：已打分的片段命中缓存，只对新片段打分
+    again = svc.rerank("混合检索  怎么融合", docs[1:] + ["丁" * 40], top_k=3, score_threshold=0.0)
+    assert len(scored) == 4 and scored[-1] == 40, "只对未命中的候选打分"
+    assert [r["content"] for r in again] == ["丁" * 40, "丙" * 30, "乙" * 20]
+    assert again[1]["rerank_score"] == first[0]["rerank_score"], "缓存 logit 与重新打分一致"
+
+    svc.rerank("另一个问题", docs, top_k=3, score_threshold=0.0)
+    assert len(scored) == 7, "不同 query 不共享打分"
+    svc.score_cache = sys.modules['app.services.local_cache'].LRUCache(4)
+    svc.rerank("混合检索怎么融合", docs + ["戊" * 5, "己" * 6], top_k=3, score_threshold=0.0)
+    stats = svc.stats()["score_cache"]
+    assert stats["evictions"] == 1 and stats["size"] == 4
+    print(f"✅ test_rerank_score_cache 通过 (evictions={stats['evictions']})")
+
+
+def test_model_worker_pool():
+    import tempfile
+    import threading
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    assert workers_mod.pool_shape(0, 0, cores=8) == (4, 2)
+    assert workers_mod.pool_shape(2, 0, cores=8) == (2, 4)
+    assert workers_mod.pool_shape(0, 4, cores=8) == (2, 4)
+    assert workers_mod.parse_address("127.0.0.1:8765") == ("127.0.0.1", 8765)
+    assert workers_mod.parse_address("/tmp/models.sock") == "/tmp/models.sock"
+    assert workers_mod.check_address("localhost:8765") == ("localhost", 8765)
+    for exposed in ("0.0.0.0:8765", "10.0.0.5:8765", "example.com:8765"):
+        try:
+            workers_mod.check_address(exposed)
+            assert False, f"非回环地址应被拒绝: {exposed}"
+        except ValueError:
+            pass
+    for key in ("", "rag-model-workers"):
+        FakeSettings.MODEL_WORKERS_AUTHKEY = key
+        try:
+            workers_mod.ModelWorkerServer("/tmp/never.sock", executor=object())
+            assert False, f"密钥 {key!r} 应拒绝启动"
+        except ValueError:
+            pass
+    FakeSettings.MODEL_WORKERS_AUTHKEY = "test-authkey"
+
+    def fail(*args):
+        raise ValueError("坏输入")
+
+    original, create_executor = dict(workers_mod.TASKS), workers_mod._create_executor
+    workers_mod.TASKS.update(embed=lambda texts, batch_size: np.ones((len(texts), 3), dtype=np.float32), fail=fail)
+    address = os.path.join(tempfile.mkdtemp(), "models.sock")
+    server = workers_mod.ModelWorkerServer(address, executor=ThreadPoolExecutor(2))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    FakeSettings.MODEL_WORKERS_ENABLED = True
+    try:
+        for _ in range(100):
+            if os.path.exists(address):
+                break
+            threading.Event().wait(0.01)
+        assert os.stat(address).st_mode & 0o777 == 0o600, "socket 仅本用户可访问"
+        pool = workers_mod.ModelWorkerPool()
+        pool.address = address
+        assert pool.mode == "shared"
+        assert pool.call("embed", ["a", "b"], 2).shape == (2, 3), "结果经本地 socket 返回"
+        try:
+            pool.call("fail")
+            assert False, "服务端异常应传回调用方"
+        except RuntimeError as e:
+            assert "坏输入" in str(e)
+        assert pool.stats()["calls"] == 2 and pool.stats()["errors"] == 1
+        pool.shutdown()
+
+        # 共享服务不可达：退回进程内执行
+        unreachable = workers_mod.ModelWorkerPool()
+        unreachable.address = address + ".missing"
+        assert unreachable.call("embed", ["a"], 1).shape == (1, 3) and unreachable.mode == "in_process"
+
+        # 本地进程池：推理进程崩溃后重建进程池并重试一次，之后的调用不再失败
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import get_context
+        marker = os.path.join(tempfile.mkdtemp(), "crashed")
+        workers_mod.TASKS["crash_once"] = lambda: os.path.exists(marker) or open(marker, "w").close() or os._exit(1)
+        workers_mod._create_executor = lambda: ProcessPoolExecutor(1, mp_context=get_context("fork"))
+        local = workers_mod.ModelWorkerPool()
+        local.address = ""
+        assert local.call("crash_once") is True, "重建后重试成功"
+        assert local.call("embed", ["a"], 1).shape == (1, 3)
+        stats = local.stats()
+        assert (stats["restarts"], stats["errors"], stats["calls"]) == (1, 0, 2), stats
+
+        # 超时：等待中的任务被取消，单独计数
+        release, ran = threading.Event(), []
+        workers_mod.TASKS["record"] = lambda: ran.append(1)
+        stuck = ThreadPoolExecutor(1)
+        stuck.submit(release.wait)
+        local._executor, local.timeout = stuck, 0.05
+        try:
+            local.call("record")
+            assert False, "超时应抛给调用方"
+        except TimeoutError:
+            pass
+        release.set()
+        stuck.shutdown(wait=True)
+        stats = local.stats()
+        assert (stats["timeouts"], stats["errors"]) == (1, 0), stats
+        assert ran == [], "超时的任务已取消，不再执行"
+    finally:
+        FakeSettings.MODEL_WORKERS_ENABLED = False
+        server.close()
+        workers_mod._create_executor = create_executor
+        workers_mod.TASKS.clear()
+        workers_mod.TASKS.update(original)
+    print("✅ test_model_worker_pool 通过")
+
+
+def _swallow(fn, *args):
+    try:
+        fn(*args)
+    except Exception:
+        pass
+
+
+def test_micro_batching():
+    import threading
+    import numpy as np
+    from concurrent.futures import ThreadPoolExecutor
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        if "boom" in items:
+            raise ValueError("boom")
+        return [x * 2 for x in items]
+
+    batcher = batcher_mod.MicroBatcher("test", double, max_batch_size=4, max_wait_ms=50)
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(batcher.submit, range(6)))
+    assert results == [x * 2 for x in range(6)], "结果按请求分发"
+    assert all(len(c) <= 4 for c in calls) and len(calls) < 6, "并发请求被合并"
+    try:
+        batcher.submit("boom")
+        assert False, "批处理异常应抛给调用方"
+    except ValueError:
+        pass
+    stats = batcher.stats()
+    assert stats["requests"] == 7 and stats["largest_batch"] >= 2 and stats["avg_wait_ms"] > 0
+
+    # BaseException 不杀死批处理线程；等待有超时，超时的请求被取消、不再计算
+    release = threading.Event()
+    ran = []
+
+    def fragile(items):
+        ran.extend(items)
+        if "exit" in items:
+            raise SystemExit("worker exit")
+        if "slow" in items:
+            release.wait(2)
+        return list(items)
+
+    fragile_batcher = batcher_mod.MicroBatcher("fragile", fragile, max_batch_size=1, max_wait_ms=1, timeout=0.2)
+    try:
+        fragile_batcher.submit("exit")
+        assert False, "BaseException 应抛给调用方"
+    except SystemExit:
+        pass
+    assert fragile_batcher.submit("ok") == "ok", "批处理线程仍然存活"
+    for item in ("slow", "queued"):
+        threading.Thread(target=lambda i=item: _swallow(fragile_batcher.submit, i), daemon=True).start()
+    threading.Event().wait(0.4)
+    release.set()
+    assert fragile_batcher.submit("after") == "after"
+    assert fragile_batcher.stats()["timeouts"] == 2
+    assert "queued" not in ran, "超时取消的请求不再计算"
+
+    # 精排：并发查询的未命中候选合并为一次分桶打分，每个查询的结果互不串扰
+    FakeSettings.MICRO_BATCH_ENABLED = True
+    try:
+        svc = rerank_mod.RerankService()
+    finally:
+        FakeSettings.MICRO_BATCH_ENABLED = False
+    svc.enabled = True
+    svc._model = MagicMock(tokenizer=_CharTokenizer(), model=object())
+    forwards = []
+    barrier = threading.Barrier(3)
+
+    def fake_forward(tokenizer, hf_model, pairs):
+        forwards.append(len(pairs))
+        return np.array([len(d) - len(q) for q, d in pairs], dtype=np.float32)
+
+    svc._forward = fake_forward
+
+    def query(n):
+        barrier.wait()
+        return svc.rerank("问" * n, ["文" * (n + 1), "文" * (n + 5)], top_k=2, score_threshold=0.0)
+
+    with ThreadPoolExecutor(3) as pool:
+        outs = list(pool.map(query, [1, 2, 3]))
+    assert all([r["index"] for r in out] == [1, 0] for out in outs)
+    assert all(abs(out[0]["rerank_score"] - _sigmoid(5.0)) < 1e-6 for out in outs), "logit 按查询正确拆分"
+    assert sum(forwards) == 6 and svc.batcher.stats()["largest_batch"] >= 2
+    print(f"✅ test_micro_batching 通过 (rerank 平均批 {svc.batcher.stats()['avg_batch_size']} 个查询)")
+
+
+def test_rerank_cascade():
+    RerankCascade = cascade_mod.RerankCascade
+    svc = HybridSearchService.__new__(HybridSearchService)
+    mock_rerank = MagicMock()
+    mock_rerank.enabled = True
+    mock_rerank.model = MagicMock()
+    # 精排结果为候选倒序，下标指向传入的 docs
+    mock_rerank.rerank.side_effect = lambda q, docs, top_k: [
+        {"index": len(docs) - 1 - i, "content": d, "rerank_score": 0.9 - 0.1 * i}
+        for i, d in enumerate(docs[::-1][:top_k])
+    ]
+    svc.rerank = mock_rerank
+    mock_milvus = MagicMock()
+    mock_milvus.get_embedding.return_value = [1.0, 0.0]
+    svc.milvus = mock_milvus
+
+    # 1. 两路第一名一致，且第二名只有单路命中：RRF 分差足够，跳过 Cross-Encoder
+    vec = [{"content": "A", "document_id": 1, "chunk_id": 0, "distance": 0.9},
+           {"content": "B", "document_id": 1, "chunk_id": 1, "distance": 0.8}]
+    kw = [{"content": "A", "document_id": 1, "chunk_id": 0, "score": 5.0}]
+    fused = svc._reciprocal_rank_fusion(vec, kw, 0.6, 0.4)
+    meta = {}
+    out = svc._finalize("q", fused, top_k=2, meta=meta)
+    assert [r["content"] for r in out] == ["A", "B"] and mock_rerank.rerank.call_count == 0
+    assert meta["rerank"]["stages"] == ["rrf"] and meta["rerank"]["early_exit"]
+    assert meta["rerank"]["rrf_margin"] >= 0.35
+    assert fused.top_agreed() and fused.ranks[:, int(fused.order[0])].tolist() == [1, 1]
+
+    # 两路第一名不一致（向量第 1、关键词第 15）：即使 RRF 分差超过阈值也必须精排
+    filler = [{"content": f"kw{i}", "document_id": 9, "chunk_id": i} for i in range(14)]
+    disagree = svc._reciprocal_rank_fusion(vec, filler + kw, 0.6, 0.4)
+    first, second = disagree.scores[disagree.order[:2]]
+    assert (first - second) / first >= 0.35 and not disagree.top_agreed()
+    meta = {}
+    svc._finalize("q", disagree, top_k=2, cascade=RerankCascade(shortlist=0), meta=meta)
+    assert "early_exit" not in meta["rerank"] and "rrf_margin" not in meta["rerank"]
+    assert meta["rerank"]["stages"] == ["rrf", "cross_encoder"] and mock_rerank.rerank.call_count == 1
+
+    # 两路一致但第一名向量相似度低于下限：不提前退出；提前退出时低相似度候选被剔除
+    low = [dict(vec[0], distance=0.3), vec[1]]
+    meta = {}
+    svc._finalize("q", svc._reciprocal_rank_fusion(low, kw, 0.6, 0.4), top_k=2, meta=meta)
+    assert "early_exit" not in meta["rerank"] and mock_rerank.rerank.call_count == 2
+    tail = [vec[0], dict(vec[1], distance=0.2)]
+    out = svc._finalize("q", svc._reciprocal_rank_fusion(tail, kw, 0.6, 0.4), top_k=2)
+    assert [r["content"] for r in out] == ["A"] and mock_rerank.rerank.call_count == 2
+    mock_rerank.rerank.reset_mock()
+
+    # 请求级关闭跳过：同一候选进入 Cross-Encoder（候选数未超过粗筛数，不粗筛）
+    meta = {}
+    svc._finalize("q", fused, top_k=2, cascade=RerankCascade.build(skip_margin=0), meta=meta)
+    assert meta["rerank"]["stages"] == ["rrf", "cross_encoder"] and mock_rerank.rerank.call_count == 1
+
+    # 2. 第二名也是双路命中：分差小，先按余弦相似度粗筛到 3 个再精排
+    vec = [{"content": c, "document_id": 2, "chunk_id": i, "distance": d}
+           for i, (c, d) in enumerate([("v0", 0.9), ("v1", 0.2), ("v2", 0.8), ("v3", 0.1)])]
+    kw = [{"content": "v0", "document_id": 2, "chunk_id": 0},
+          {"content": "v2", "document_id": 2, "chunk_id": 2},
+          {"content": "k0", "document_id": 3, "chunk_id": 0}]
+    mock_milvus.get_embeddings.return_value = [[0.6, 0.8]]  # k0 余弦 0.6
+    fused = svc._reciprocal_rank_fusion(vec, kw, 0.6, 0.4)
+    meta = {}
+    out = svc._finalize("q", fused, top_k=2, meta=meta)
+    docs = mock_rerank.rerank.call_args[0][1]
+    assert sorted(docs) == ["k0", "v0", "v2"], f"低相似度候选应被粗筛掉, got {docs}"
+    assert docs == [fused[i]["content"] for i in range(len(fused)) if fused[i]["content"] in docs], "粗筛保持 RRF 顺序"
+    mock_milvus.get_embeddings.assert_called_once_with(["k0"])  # 只编码仅关键词召回的候选
+    assert [r["content"] for r in out] == docs[::-1][:2], "精排下标映射回原候选"
+    assert out[0]["document_id"] in (2, 3) and out[0]["rerank_score"] == 0.9
+    assert meta["rerank"]["stages"] == ["rrf", "bi_encoder", "cross_encoder"]
+    assert meta["rerank"]["candidates"] == 5 and meta["rerank"]["shortlist"] == 3
+
+    # 3. 纯向量路径：按 distance 粗筛，不做提前退出
+    out = svc._vector_finalize("q", vec, top_k=5, cascade=RerankCascade(shortlist=2))
+    assert mock_rerank.rerank.call_args[0][1] == ["v0", "v2"]
+    assert RerankCascade.build() is None and RerankCascade(shortlist=2).key() != RerankCascade().key()
+    print("✅ test_rerank_cascade 通过 (提前退出 / 粗筛 / 下标映射)")
+
+
 if __name__ == "__main__":
     test_sigmoid()
     test_rerank_degradation()
     test_rrf()
+    test_rrf_chunk_key()
     test_finalize_truncate()
     test_finalize_rerank_mock()
     test_vector_finalize_threshold()
+    test_embedding_cache()
+    test_insert_chunks_pipeline()
+    test_embedding_backend_fallback()
+    test_batch_search()
+    test_search_filter()
+    test_local_vector_store()
+    test_parallel_recall_deadline()
+    test_rerank_bucketing()
+    test_rerank_score_cache()
+    test_model_worker_pool()
+    test_micro_batching()
+    test_rerank_cascade()
     print("\n🎉 全部测试通过")